@@ -20,6 +20,7 @@ if int(sublime.version()) >= 3000:
     from .lib.display.T3SViews import TypescriptEventListener2
     from .lib.system.Project import get_or_create_project_and_add_view, \
                                     close_all_projects
+    from .lib.server.Processes import TssWarmPool
 
 
     def plugin_loaded():
@@ -40,7 +41,7 @@ if int(sublime.version()) >= 3000:
         """ This will be called by sublime if this plugin will be unloaded """
         set_plugin_temporarily_disabled()
         close_all_projects()
-        # TODO: Kill processes
+        TssWarmPool.kill()
 
 
     def run_tests(filepattern=''):
@@ -15,6 +15,95 @@ function switchToForwardSlashes(path) {
 // fixed version should be in nodejs from about v0.9.9/v0.8.19?
 var readline = require("./readline");
 var EOL = require("os").EOL;
+/** writes one answer to stdout. Replaced by framedOutput() in framed mode */
+var writeAnswer = function (text) {
+    console.log(text);
+};
+/** answers of the current batch, null if no batch is handled */
+var batchAnswers = null;
+/** framed mode: every answer is written as "<byte length>\n<text>" */
+function framedOutput() {
+    writeAnswer = function (text) {
+        if (batchAnswers) {
+            batchAnswers.push(text);
+            return;
+        }
+        process.stdout.write(Buffer.byteLength(text, 'utf8') + '\n' + text);
+    };
+}
+/** calls onLine(line) for every line of input and onClose() at the end.
+    Line mode: the input is read with readline.
+    Framed mode: every command is sent as "<byte length>\n<payload>", the payload
+    (eg. an update command with its content lines) is split into lines.
+    So the client can send a frame with one gathered write, and the
+    payload doesn't need to be scanned for the end of the command.
+    A batch frame "batch\n<command>\n<command>.." contains several commands,
+    their answers are written as one frame "batch\n<answer>\n<answer>..".
+    returns an object with close() */
+function createInput(framed, onLine, onClose) {
+    if (!framed) {
+        var rl = readline.createInterface({ input: process.stdin, output: process.stdout });
+        rl.on('line', onLine).on('close', onClose);
+        return rl;
+    }
+    var chunks = [], buffered = 0, length = -1, closed = false;
+    var input = {
+        close: function () {
+            if (!closed) {
+                closed = true;
+                process.stdin.pause();
+                onClose();
+            }
+        }
+    };
+    // returns the first n received bytes, payloads are only concatenated once
+    function take(n) {
+        var all = chunks.length === 1 ? chunks[0] : Buffer.concat(chunks, buffered);
+        chunks = all.length > n ? [all.slice(n)] : [];
+        buffered -= n;
+        return all.slice(0, n);
+    }
+    process.stdin.on('data', function (data) {
+        chunks.push(data);
+        buffered += data.length;
+        while (!closed && buffered > 0) {
+            if (length < 0) {
+                if (chunks.length > 1 && chunks[0].length < 32) {
+                    chunks = [Buffer.concat(chunks, buffered)];
+                }
+                var eol = -1;
+                for (var i = 0; i < chunks[0].length && i < 32; i++) {
+                    if (chunks[0][i] === 10) {
+                        eol = i;
+                        break;
+                    }
+                }
+                if (eol < 0) {
+                    return; // header is not complete
+                }
+                length = parseInt(take(eol + 1).toString('ascii'), 10);
+            }
+            if (buffered < length) {
+                return;
+            }
+            var lines = take(length).toString('utf8').split('\n');
+            var isBatch = lines[0] === 'batch';
+            length = -1;
+            if (isBatch) {
+                batchAnswers = [];
+            }
+            for (var l = isBatch ? 1 : 0; l < lines.length && !closed; l++) {
+                onLine(lines[l]);
+            }
+            if (isBatch) {
+                var answers = ['batch'].concat(batchAnswers).join('\n');
+                batchAnswers = null;
+                writeAnswer(answers);
+            }
+        }
+    }).on('end', input.close);
+    return input;
+}
 /** TypeScript Services Server,
     an interactive commandline tool
     for getting info on .ts projects */
@@ -22,6 +111,7 @@ var TSS = (function () {
     function TSS(prettyJSON) {
         if (prettyJSON === void 0) { prettyJSON = false; }
         this.prettyJSON = prettyJSON;
+        this.requestTag = "";
     } // NOTE: call setup
     /**
      * @param line 1 based index
@@ -50,6 +140,21 @@ var TSS = (function () {
         var lineText = script.content.substring(lineStart, lineEnd);
         return lineText;
     };
+    /**
+     * @param line 1 based index
+     * @returns position of the line break at the end of line
+     */
+    TSS.prototype.lineEndPosition = function (fileName, line) {
+        var script = this.fileNameToScript[fileName];
+        var pos = script.lineMap[line]; // start of the next line
+        if (pos > 0 && script.content.charAt(pos - 1) === "\n") {
+            pos--;
+        }
+        if (pos > 0 && script.content.charAt(pos - 1) === "\r") {
+            pos--;
+        }
+        return pos;
+    };
     TSS.prototype.updateScript = function (fileName, content) {
         var script = this.fileNameToScript[fileName];
         if (script) {
@@ -132,6 +237,9 @@ var TSS = (function () {
         // build program from root files,
         // chase dependencies (references and imports), normalize file names, ...
         this.compilerHost = ts.createCompilerHost(this.compilerOptions);
+        if (this.sourceFileCache) {
+            this.compilerHost.getSourceFile = this.sourceFileCache.wrap(this.compilerHost, this.compilerOptions);
+        }
         this.program = ts.createProgram(this.rootFiles, this.compilerOptions, this.compilerHost);
         this.fileNames = [];
         this.fileNameToScript = {};
@@ -159,20 +267,20 @@ var TSS = (function () {
             trace: function (message) { return undefined; },
             error: function (message) { return console.error(message); } // ??
         };
-        this.ls = ts.createLanguageService(this.lsHost, ts.createDocumentRegistry());
+        this.ls = ts.createLanguageService(this.lsHost, this.documentRegistry || ts.createDocumentRegistry());
     };
     TSS.prototype.output = function (info, excludes) {
         if (excludes === void 0) { excludes = ["displayParts"]; }
         var replacer = function (k, v) { return excludes.indexOf(k) !== -1 ? undefined : v; };
         if (info) {
-            console.log(JSON.stringify(info, replacer, this.prettyJSON ? " " : undefined).trim());
+            writeAnswer(this.requestTag + JSON.stringify(info, replacer, this.prettyJSON ? " " : undefined).trim());
         }
         else {
-            console.log(JSON.stringify(info, replacer));
+            writeAnswer(this.requestTag + JSON.stringify(info, replacer));
         }
     };
     TSS.prototype.outputJSON = function (json) {
-        console.log(json.trim());
+        writeAnswer(this.requestTag + json.trim());
     };
     TSS.prototype.handleNavBarItem = function (file, item) {
         var _this = this;
@@ -187,19 +295,28 @@ var TSS = (function () {
         };
     };
     /** commandline server main routine: commands in, JSON info out */
-    TSS.prototype.listen = function () {
+    TSS.prototype.listen = function (framed) {
+        var _this = this;
+        var input = createInput(framed, this.createLineHandler(function () { input.close(); }), function () {
+            _this.outputJSON('"TSS closing"');
+        });
+        this.outputJSON(this.listeningMessage('loaded'));
+    };
+    /** returns function(input) which handles one line of input,
+        quit() will be called for the quit command */
+    TSS.prototype.createLineHandler = function (quit) {
         var _this = this;
         var line;
         var col;
-        var rl = readline.createInterface({ input: process.stdin, output: process.stdout });
         var cmd, pos, file, script, added, range, check, def, refs, locs, info, source, brief, member, navbarItems, pattern;
         var collecting = 0, on_collected_callback, lines = [];
+        var tag;
         var commands = {};
         function match(cmd, regexp) {
             commands[regexp.source] = true;
             return cmd.match(regexp);
         }
-        rl.on('line', function (input) {
+        var handler = function (input) {
             var m;
             try {
                 cmd = input.trim();
@@ -209,8 +326,18 @@ var TSS = (function () {
                     if (collecting === 0) {
                         on_collected_callback();
                     }
+                    return;
+                }
+                if (tag = cmd.match(/^#(\d+) ([\s\S]*)$/)) {
+                    // pipelined request: answer with the same tag, so that
+                    // the client can route the response by request id
+                    _this.requestTag = '#' + tag[1] + ' ';
+                    cmd = tag[2];
                 }
-                else if (m = match(cmd, /^(type|quickInfo) (\d+) (\d+) (.*)$/)) {
+                else {
+                    _this.requestTag = "";
+                }
+                if (m = match(cmd, /^(type|quickInfo) (\d+) (\d+) (.*)$/)) {
                     line = parseInt(m[2]);
                     col = parseInt(m[3]);
                     file = _this.resolveRelativePath(m[4]);
@@ -320,6 +447,31 @@ var TSS = (function () {
                     }
                     _this.output(info, ["displayParts", "documentation"]);
                 }
+                else if (m = match(cmd, /^completionDetails (\d+) (\d+) (\d+) (.*)$/)) {
+                    // details of the completion entries named in the next <count> lines,
+                    // for clients which have asked for completions-brief
+                    collecting = parseInt(m[1]);
+                    var detailsTag = _this.requestTag;
+                    on_collected_callback = function () {
+                        _this.requestTag = detailsTag;
+                        var file = _this.resolveRelativePath(m[4]);
+                        var pos = _this.lineColToPosition(file, parseInt(m[2]), parseInt(m[3]));
+                        info = lines.map(function (name) {
+                            var d = _this.ls.getCompletionEntryDetails(file, pos, name.trim());
+                            if (d) {
+                                d["type"] = ts.displayPartsToString(d.displayParts);
+                                d["docComment"] = ts.displayPartsToString(d.documentation);
+                            }
+                            return d || { name: name.trim() };
+                        });
+                        on_collected_callback = undefined;
+                        lines = [];
+                        _this.output(info, ["displayParts", "documentation"]);
+                    };
+                    if (collecting === 0) {
+                        on_collected_callback();
+                    }
+                }
                 else if (m = match(cmd, /^update( nocheck)? (\d+)( (\d+)-(\d+))? (.*)$/)) {
                     file = _this.resolveRelativePath(m[6]);
                     script = _this.fileNameToScript[file];
@@ -329,16 +481,20 @@ var TSS = (function () {
                     // TODO: handle dependency changes
                     if (!added || !range) {
                         collecting = parseInt(m[2]);
+                        var updateTag = _this.requestTag;
                         on_collected_callback = function () {
+                            _this.requestTag = updateTag;
                             if (!range) {
                                 _this.updateScript(file, lines.join(EOL));
                             }
                             else {
+                                // replaces the lines startLine..endLine (1 based, inclusive),
+                                // the line break at the end of endLine is kept
                                 var startLine = parseInt(m[4]);
                                 var endLine = parseInt(m[5]);
                                 var maxLines = script.lineMap.length;
                                 var startPos = startLine <= maxLines ? (startLine < 1 ? 0 : _this.lineColToPosition(file, startLine, 1)) : script.content.length;
-                                var endPos = endLine < maxLines ? (endLine < 1 ? 0 : _this.lineColToPosition(file, endLine + 1, 0) - 1) //??CHECK
+                                var endPos = endLine < maxLines ? (endLine < 1 ? 0 : _this.lineEndPosition(file, endLine))
                                  : script.content.length;
                                 _this.editScript(file, startPos, endPos, lines.join(EOL));
                             }
@@ -353,7 +509,18 @@ var TSS = (function () {
                         };
                     }
                     else {
-                        _this.outputJSON('"cannot update line range in new file"');
+                        // the lines of the range belong to this command, they must not be read as commands
+                        collecting = parseInt(m[2]);
+                        var rangeTag = _this.requestTag;
+                        on_collected_callback = function () {
+                            _this.requestTag = rangeTag;
+                            on_collected_callback = undefined;
+                            lines = [];
+                            _this.outputJSON('"cannot update line range in new file"');
+                        };
+                        if (collecting === 0) {
+                            on_collected_callback();
+                        }
                     }
                 }
                 else if (m = match(cmd, /^showErrors$/)) {
@@ -383,7 +550,7 @@ var TSS = (function () {
                 else if (m = match(cmd, /^lastError(Dump)?$/)) {
                     if (_this.lastError)
                         if (m[1])
-                            console.log(JSON.parse(_this.lastError).stack);
+                            _this.outputJSON(JSON.stringify(JSON.parse(_this.lastError).stack));
                         else
                             _this.outputJSON(_this.lastError);
                     else
@@ -394,8 +561,8 @@ var TSS = (function () {
                     file = _this.resolveRelativePath(m[2]);
                     source = _this.fileNameToScript[file].content;
                     if (dump === "-") {
-                        console.log('dumping ' + file);
-                        console.log(source);
+                        // one tagged answer: the source as JSON string
+                        _this.outputJSON(JSON.stringify(source));
                     }
                     else {
                         ts.sys.writeFile(dump, source, false);
@@ -408,14 +575,14 @@ var TSS = (function () {
                     _this.outputJSON(_this.listeningMessage('reloaded'));
                 }
                 else if (m = match(cmd, /^quit$/)) {
-                    rl.close();
+                    quit();
                 }
                 else if (m = match(cmd, /^prettyJSON (true|false)$/)) {
                     _this.prettyJSON = m[1] === 'true';
                     _this.outputJSON('"pretty JSON: ' + _this.prettyJSON + '"');
                 }
                 else if (m = match(cmd, /^help$/)) {
-                    console.log(Object.keys(commands).join(EOL));
+                    _this.outputJSON(JSON.stringify(Object.keys(commands)));
                 }
                 else {
                     _this.outputJSON('"TSS command syntax error: ' + cmd + '"');
@@ -425,10 +592,10 @@ var TSS = (function () {
                 _this.lastError = (JSON.stringify({ msg: e.toString(), stack: e.stack })).trim();
                 _this.outputJSON('"TSS command processing error: ' + e + '"');
             }
-        }).on('close', function () {
-            _this.outputJSON('"TSS closing"');
-        });
-        this.outputJSON(this.listeningMessage('loaded'));
+        };
+        /** true while the content lines of an update are read */
+        handler.isCollecting = function () { return collecting > 0; };
+        return handler;
     };
     TSS.prototype.listeningMessage = function (prefix) {
         var count = this.rootFiles.length - 1;
@@ -454,14 +621,166 @@ function findConfigFile() {
     }
     return undefined;
 }
+/** reads tsconfig.json in projectDir, returns {fileNames, options} or {error} */
+function readProject(projectDir, commandLineOptions) {
+    var configFile = ts.normalizePath(ts.combinePaths(projectDir, "tsconfig.json"));
+    var configObject = ts.readConfigFile(configFile);
+    if (!configObject) {
+        return { error: "can't read tsconfig.json at " + configFile };
+    }
+    var configObjectParsed = ts.parseConfigFile(configObject, ts.getDirectoryPath(configFile));
+    if (configObjectParsed.errors.length > 0) {
+        return { error: configObjectParsed.errors };
+    }
+    return { fileNames: configObjectParsed.fileNames,
+             options: ts.extend(commandLineOptions, configObjectParsed.options) };
+}
+/** Shares parsed source files of the default libs between the projects of one host.
+    Only the default lib files are shared: they are never updated by the editor. */
+var SourceFileCache = (function () {
+    function SourceFileCache() {
+        this.files = {};
+    }
+    SourceFileCache.prototype.wrap = function (compilerHost, options) {
+        var _this = this;
+        var getSourceFile = compilerHost.getSourceFile;
+        var libFileName = ts.normalizePath(compilerHost.getDefaultLibFileName(options));
+        return function (fileName, languageVersion, onError) {
+            if (ts.normalizePath(fileName) !== libFileName) {
+                return getSourceFile(fileName, languageVersion, onError);
+            }
+            // no target means es3
+            var key = (languageVersion || ts.ScriptTarget.ES3) + '|' + fileName;
+            if (!_this.files[key]) {
+                _this.files[key] = getSourceFile(fileName, languageVersion, onError);
+            }
+            return _this.files[key];
+        };
+    };
+    /** parses the default lib for options before the first project needs it */
+    SourceFileCache.prototype.preload = function (options) {
+        var compilerHost = ts.createCompilerHost(options);
+        var getSourceFile = this.wrap(compilerHost, options);
+        getSourceFile(compilerHost.getDefaultLibFileName(options), options.target);
+    };
+    return SourceFileCache;
+})();
+/** TypeScript Services Host,
+    serves several tsconfig.json projects in one process.
+    Commands are addressed to a project with "@<project id> <command>",
+    projects are added with "open <project id> <tsconfig dir>" and
+    removed with "close <project id>" or "@<project id> quit". */
+var TSSHost = (function () {
+    function TSSHost(commandLineOptions) {
+        this.commandLineOptions = commandLineOptions;
+        this.projects = {};
+        this.documentRegistry = ts.createDocumentRegistry();
+        this.sourceFileCache = new SourceFileCache();
+        this.requestTag = "";
+    }
+    TSSHost.prototype.outputJSON = function (json) {
+        writeAnswer(this.requestTag + json.trim());
+    };
+    TSSHost.prototype.open = function (projectId, projectDir) {
+        var _this = this;
+        var project = readProject(projectDir, ts.extend({}, this.commandLineOptions));
+        if (project.error) {
+            this.outputJSON(JSON.stringify("TSS project error: " + JSON.stringify(project.error)));
+            return;
+        }
+        var tss = new TSS();
+        tss.documentRegistry = this.documentRegistry;
+        tss.sourceFileCache = this.sourceFileCache;
+        tss.setup(project.fileNames, project.options);
+        tss.handler = tss.createLineHandler(function () {
+            _this.close(projectId);
+        });
+        this.projects[projectId] = tss;
+        this.outputJSON(tss.listeningMessage('loaded'));
+    };
+    TSSHost.prototype.close = function (projectId) {
+        delete this.projects[projectId];
+        this.outputJSON('"TSS closing"');
+    };
+    TSSHost.prototype.listen = function (framed) {
+        var _this = this;
+        var collectingProject;
+        var input = createInput(framed, function (line) {
+            var m, tag = "", cmd = line.trim();
+            // content lines of an update belong to the project which has requested them
+            if (collectingProject) {
+                collectingProject.handler(line);
+                if (!collectingProject.handler.isCollecting()) {
+                    collectingProject = undefined;
+                }
+                return;
+            }
+            if (m = cmd.match(/^(#\d+ )([\s\S]*)$/)) {
+                tag = m[1];
+                cmd = m[2];
+            }
+            _this.requestTag = tag;
+            try {
+                if (m = cmd.match(/^@(\S+) ([\s\S]*)$/)) {
+                    var tss = _this.projects[m[1]];
+                    if (!tss) {
+                        _this.outputJSON('"TSS unknown project: ' + m[1] + '"');
+                        return;
+                    }
+                    tss.handler(tag + m[2]);
+                    if (tss.handler.isCollecting()) {
+                        collectingProject = tss;
+                    }
+                }
+                else if (m = cmd.match(/^open (\S+) (.*)$/)) {
+                    _this.open(m[1], m[2]);
+                }
+                else if (m = cmd.match(/^close (\S+)$/)) {
+                    _this.close(m[1]);
+                }
+                else if (m = cmd.match(/^quit$/)) {
+                    input.close();
+                }
+                else {
+                    _this.outputJSON('"TSS host command syntax error: ' + cmd + '"');
+                }
+            }
+            catch (e) {
+                _this.outputJSON('"TSS host command processing error: ' + e + '"');
+            }
+        }, function () {
+            _this.outputJSON('"TSS host closing"');
+        });
+        // most projects use the es3 or es5 default lib. A warm host is ready when it is parsed
+        try {
+            this.sourceFileCache.preload(this.commandLineOptions);
+            this.sourceFileCache.preload(ts.extend({ target: ts.ScriptTarget.ES5 }, this.commandLineOptions));
+        }
+        catch (e) {
+            console.error("TSS host could not preload the default lib: " + e);
+        }
+        this.outputJSON('"TSS host listening.."');
+    };
+    return TSSHost;
+})();
 var fileNames;
-var configFile, configObject, configObjectParsed;
+var configFile, project;
+// --host and --framed are no typescript options, remove them before parsing the commandline
+var hostMode = ts.sys.args.indexOf("--host") !== -1;
+var framedMode = ts.sys.args.indexOf("--framed") !== -1;
+if (framedMode) {
+    framedOutput();
+}
 // NOTE: partial options support only
-var commandLine = ts.parseCommandLine(ts.sys.args);
+var commandLine = ts.parseCommandLine(ts.sys.args.filter(function (arg) { return arg !== "--host" && arg !== "--framed"; }));
 if (commandLine.options.version) {
     console.log(require("../package.json").version);
     process.exit(0);
 }
+if (hostMode) {
+    new TSSHost(commandLine.options).listen(framedMode);
+    return;
+}
 if (commandLine.fileNames.length > 0) {
     fileNames = commandLine.fileNames;
 }
@@ -473,18 +792,13 @@ else {
 }
 var options;
 if (configFile) {
-    configObject = ts.readConfigFile(configFile);
-    if (!configObject) {
-        console.error("can't read tsconfig.json at", configFile);
-        process.exit(1);
-    }
-    configObjectParsed = ts.parseConfigFile(configObject, ts.getDirectoryPath(configFile));
-    if (configObjectParsed.errors.length > 0) {
-        console.error(configObjectParsed.errors);
+    project = readProject(ts.getDirectoryPath(configFile), commandLine.options);
+    if (project.error) {
+        console.error(project.error);
         process.exit(1);
     }
-    fileNames = configObjectParsed.fileNames;
-    options = ts.extend(commandLine.options, configObjectParsed.options);
+    fileNames = project.fileNames;
+    options = project.options;
 }
 else {
     options = ts.extend(commandLine.options, ts.getDefaultCompilerOptions());
@@ -497,4 +811,4 @@ if (!fileNames) {
 }
 var tss = new TSS();
 tss.setup(fileNames, options);
-tss.listen();
+tss.listen(framedMode);
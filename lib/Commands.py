@@ -13,7 +13,7 @@ from .display.T3SViews import T3SVIEWS
 from .display.Message import MESSAGE
 
 from .system.Project import get_or_create_project_and_add_view, project_by_id
-from .system.globals import OPENED_PROJECTS
+from .system.globals import OPENED_PROJECTS, METRICS
 
 from .utils.fileutils import read_file
 from .utils.viewutils import get_file_infos
@@ -57,14 +57,14 @@ class TypescriptType(sublime_plugin.TextCommand):
             (_line, _col) = self.view.rowcol(pos)
             _view = self.view
 
-            def async_react(types, filename, line, col):
+            def async_react(types):
                 if types == None: return
                 if 'kind' not in types: return
 
                 # Only display type if cursor has not moved
                 view = sublime.active_window().active_view()
                 pos = view.sel()[0].begin()
-                (_line, _col) = view.rowcol(pos)
+                (line, col) = view.rowcol(pos)
                 if col != _col or line != _line: return
                 if view != _view: return
 
@@ -76,8 +76,8 @@ class TypescriptType(sublime_plugin.TextCommand):
 
                 view.show_popup_menu(liste, None)
 
-            # start async request
-            project.tsserver.type(self.view.file_name(), _line, _col, callback=async_react)
+            # cached (eg. prefetched) or async request
+            project.quick_info.request(self.view, pos, async_react)
 
 
 # ################################# GO TO DEFINITION ###########################
@@ -361,3 +361,33 @@ class TypescriptBuildView(sublime_plugin.TextCommand):
             else:
                 T3SVIEWS.COMPILE.set_text(edit_token, display_file)
 
+
+
+# ################################# METRICS ####################################
+
+class TypescriptShowMetrics(sublime_plugin.TextCommand):
+    """ Shows the latency histograms, queue gauges and counters of all tss.js processes in a new view. """
+
+    def run(self, edit, format='text'):
+        window = self.view.window() or sublime.active_window()
+        view = window.new_file()
+        view.set_scratch(True)
+        view.set_name('ArcticTypescript Metrics')
+        text = METRICS.to_json() if format == 'json' else METRICS.report()
+        view.run_command('append', {'characters': text})
+
+
+class TypescriptDumpMetrics(sublime_plugin.TextCommand):
+    """ Writes the metrics as JSON to a file, eg. to compare tss.js versions and settings. """
+
+    def run(self, edit):
+        window = self.view.window() or sublime.active_window()
+        default_path = os.path.join(os.path.expanduser('~'), 'arctictypescript-metrics.json')
+        window.show_input_panel('Dump metrics to:', default_path, self.dump, None, None)
+
+    def dump(self, path):
+        try:
+            METRICS.dump(path)
+            sublime.status_message("Metrics written to %s" % path)
+        except (OSError, IOError) as e:
+            Debug('error', "Could not write metrics: %s" % e)
@@ -27,6 +27,8 @@ class TypescriptEventListener(sublime_plugin.EventListener):
     def on_close_async(self, view):
         project = get_or_create_project_and_add_view(view, wizzard=False)
         if project:
+            if project.is_initialized():
+                project.completion.cancel_outdated_request(view, view_closed=True)
             project.close(view)
 
 
@@ -79,6 +81,8 @@ class TypescriptEventListener(sublime_plugin.EventListener):
         project = get_or_create_project_and_add_view(view)
         if project and project.is_initialized():
             project.highlighter.display_error_in_status_if_cursor(view)
+            project.completion.cancel_outdated_request(view)
+            project.quick_info.schedule_prefetch(view)
             view.erase_regions('typescript-definition')
             view.erase_regions('typescript-error-hint')
 
@@ -110,6 +114,16 @@ class TypescriptEventListener(sublime_plugin.EventListener):
 
 
 
+    # ON HOVER
+    @catch_CancelCommand
+    def on_hover(self, view, point, hover_zone):
+        if hover_zone != sublime.HOVER_TEXT:
+            return
+        project = get_or_create_project_and_add_view(view, wizzard=False)
+        if project and project.is_initialized() and project.get_setting('quick_info_popup'):
+            project.quick_info.show_popup(view, point)
+
+
     # ON QUERY COMPLETION
     @catch_CancelCommand
     def on_query_completions(self, view, prefix, locations):
@@ -123,6 +137,11 @@ class TypescriptEventListener(sublime_plugin.EventListener):
                 project.completion.enabled_for['viewid'] = -1 # receive only once
                 return (project.completion.get_list(), sublime.INHIBIT_WORD_COMPLETIONS | sublime.INHIBIT_EXPLICIT_COMPLETIONS)
 
+            # typing after a dot: narrow the last member completion locally
+            narrowed = project.completion.narrowed_list(view)
+            if narrowed is not None:
+                return (narrowed, sublime.INHIBIT_WORD_COMPLETIONS | sublime.INHIBIT_EXPLICIT_COMPLETIONS)
+
 
     # ON QUERY CONTEXT (execute commandy only on opened .ts files)
     @catch_CancelCommand
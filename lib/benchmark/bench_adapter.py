@@ -0,0 +1,301 @@
+# coding=utf8
+
+"""
+    Benchmark for the adapter (server/Processes.py: TssConnection, TssAdapterThread and
+    AsyncCommand) against stand_in_tss.py instead of tss.js. Needs neither sublime
+    (see headless.py) nor node, nor network access:
+
+        cd ArcticTypescript
+        python -m lib.benchmark.bench_adapter [scenario ..]
+
+    Scenarios:
+        overhead    one command after the other against a stand-in which answers at once:
+                    the round trip through the adapter compared with a bare TssConnection.request()
+        throughput  N_QUERIES queries appended at once, answered after 0.5ms each:
+                    commands/sec and latency through the adapter compared with
+                    pipelining them directly on the connection
+        storm       typing for STORM_SECONDS: an update of all processes every
+                    KEYSTROKE_INTERVAL seconds, a batched completion query on every fourth
+                    keystroke and a debounced showErrors. The stand-in needs longer for an
+                    update than the typist, so merging decides whether the queries keep up.
+                    Reports how many updates have been merged and the tail latencies.
+
+    The latencies are measured from append_to_queue() until the future of the command is done,
+    the counters come from METRICS (see server/Metrics.py). Uses the IOLoop on posix.
+"""
+
+import os
+import sys
+import time
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from . import headless
+headless.install()
+
+from ..server.AsyncCommand import AsyncCommand
+from ..server.Processes import TssConnection, TssAdapterThread, start_tss_process, read_first_message, FRAMED_PROTOCOL
+from ..server.IOLoop import IOLoop
+from ..server.Metrics import Histogram
+from ..system.globals import METRICS
+
+
+STAND_IN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stand_in_tss.py')
+FILENAME = '/project/src/app.ts'
+PERCENTILES = (50, 95, 99)
+
+OVERHEAD_ROUNDS = 500
+N_QUERIES = 2000
+STORM_SECONDS = 3
+KEYSTROKE_INTERVAL = 0.005
+UPDATE_LINES = 2000 # the content of each update
+
+
+# ----------------------------------------- STAND-IN PROCESSES ---------------------------------- #
+
+class BenchLane(object):
+    """ A stand-in process with its connection and adapter, the part of TssJsStarterThread which is benchmarked. """
+
+    def __init__(self, lane, server_args):
+        self.lane = lane
+        framed = ['--framed'] if FRAMED_PROTOCOL else []
+        process, error = start_tss_process(sys.executable, [sys.executable, STAND_IN_PATH] + framed + server_args, '.')
+        if error:
+            raise RuntimeError(error)
+        read_first_message(process.stdout)
+        self.connection = TssConnection(process)
+        self.connection.start()
+        self.tss_queue = Queue()
+        self.tss_adapter = TssAdapterThread(self.connection, self.tss_queue, supervisor=self)
+        loop = IOLoop.get()
+        if loop is not None:
+            self.tss_adapter.attach_to_loop(loop)
+        else:
+            self.tss_adapter.daemon = True
+            self.tss_adapter.start()
+        self.started = True
+
+    def send_async_command(self, async_command):
+        self.tss_adapter.put(async_command)
+
+    def load(self):
+        return self.tss_queue.qsize() + len(self.tss_adapter.middleware_queue) + len(self.tss_adapter.in_flight)
+
+    def restart_process(self):
+        return None, None # a benchmark doesn't recover
+
+    def on_recovered(self, seconds, reissued_count):
+        pass
+
+    def close(self):
+        self.tss_adapter.put("stop!")
+        self.connection.close()
+
+
+class BenchProcesses(object):
+    """ The interface of Processes which AsyncCommand uses: a SLOW lane and query workers. """
+
+    def __init__(self, workers, server_args):
+        self.slow = BenchLane('slow', server_args)
+        self.workers = [BenchLane('fast%i' % i, server_args) for i in range(workers)]
+
+    def all(self):
+        return [self.slow] + self.workers
+
+    def is_initialized(self):
+        return True
+
+    def least_loaded_worker(self):
+        return min(self.workers, key=lambda w: w.load())
+
+    def close(self):
+        for lane in self.all():
+            lane.close()
+
+
+class BenchProject(object):
+
+    def __init__(self, workers=1, server_args=()):
+        self.id = 'bench'
+        self.processes = BenchProcesses(workers, list(server_args))
+
+    def close(self):
+        self.processes.close()
+
+
+# ----------------------------------------- MEASURING ---------------------------------- #
+
+class Latencies(object):
+    """ Notes when the futures of commands are done. """
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.histogram.samples = [] # all samples for the percentiles
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.all_done = threading.Event()
+        self.all_done.set()
+
+    def track(self, async_command):
+        with self.lock:
+            self.pending += 1
+            self.all_done.clear()
+        async_command.future.add_done_callback(lambda future: self.on_done(async_command))
+        return async_command
+
+    def on_done(self, async_command):
+        with self.lock:
+            if async_command.is_executed:
+                self.histogram.add(time.time() - async_command.time_queue)
+            self.pending -= 1
+            if self.pending == 0:
+                self.all_done.set()
+
+    def wait(self, timeout=60):
+        if not self.all_done.wait(timeout):
+            raise RuntimeError("%i commands have not been answered within %is" % (self.pending, timeout))
+
+    def columns(self):
+        ordered = sorted(self.histogram.samples)
+        return ' '.join('%8.2f' % (1000 * (self.histogram.percentile(p, ordered) or 0)) for p in PERCENTILES)
+
+
+def query(project, i):
+    """ A type query with a unique id, so it isn't merged with the others. """
+    return AsyncCommand('type 1 1 %s' % FILENAME, project).set_id('type %i' % i).interactive().append_to_queue()
+
+
+def print_header(title):
+    print("")
+    print(title)
+    print("%-34s %10s %s" % ('', 'count', ' '.join('%8s' % ('p%i ms' % p) for p in PERCENTILES)))
+
+
+# ----------------------------------------- SCENARIOS ---------------------------------- #
+
+def overhead():
+    project = BenchProject(server_args=['--latency', '*=0'])
+    try:
+        connection = project.processes.workers[0].connection
+        direct = Latencies()
+        for i in range(OVERHEAD_ROUNDS):
+            start = time.time()
+            connection.request('type 1 1 %s' % FILENAME)
+            direct.histogram.add(time.time() - start)
+
+        adapter = Latencies()
+        for i in range(OVERHEAD_ROUNDS):
+            adapter.track(query(project, i))
+            adapter.wait()
+    finally:
+        project.close()
+
+    print_header("OVERHEAD of the adapter, %i commands one after the other" % OVERHEAD_ROUNDS)
+    print("%-34s %10i %s" % ('TssConnection.request()', direct.histogram.count, direct.columns()))
+    print("%-34s %10i %s" % ('AsyncCommand through the adapter', adapter.histogram.count, adapter.columns()))
+    print("adapter overhead per command: %.3fms (mean)"
+          % (1000 * (adapter.histogram.total / adapter.histogram.count - direct.histogram.total / direct.histogram.count)))
+
+
+def throughput():
+    project = BenchProject(server_args=['--latency', '*=0.0005'])
+    try:
+        connection = project.processes.workers[0].connection
+        answered = threading.Event()
+        remaining = [N_QUERIES]
+        def on_answer(answer):
+            remaining[0] -= 1 # only the reader calls this
+            if remaining[0] == 0:
+                answered.set()
+        start = time.time()
+        for i in range(N_QUERIES):
+            connection.send(connection.next_request_id(), 'type 1 1 %s' % FILENAME, on_answer)
+        answered.wait(60)
+        direct_seconds = time.time() - start
+
+        latencies = Latencies()
+        start = time.time()
+        for i in range(N_QUERIES):
+            latencies.track(query(project, i))
+        latencies.wait()
+        adapter_seconds = time.time() - start
+    finally:
+        project.close()
+
+    print_header("THROUGHPUT of %i queries appended at once, stand-in needs 0.5ms each" % N_QUERIES)
+    print("%-34s %10i %8s  %.0f commands/s" % ('pipelined on TssConnection', N_QUERIES, '', N_QUERIES / direct_seconds))
+    print("%-34s %10i %s  %.0f commands/s" % ('through the adapter', latencies.histogram.count,
+                                              latencies.columns(), N_QUERIES / adapter_seconds))
+
+
+def storm():
+    METRICS.reset()
+    project = BenchProject(workers=2, server_args=['--latency', 'update=0.008', '--latency', 'completions=0.004',
+                                                   '--latency', 'showErrors=0.2', '--jitter', '0.3'])
+    content = '\n'.join('    var line%i = %i;' % (i, i) for i in range(UPDATE_LINES))
+    queries = Latencies()
+    errors = Latencies()
+    keystrokes = 0
+    try:
+        start = time.time()
+        while time.time() - start < STORM_SECONDS:
+            keystrokes += 1
+            update = AsyncCommand('update nocheck %i %s' % (UPDATE_LINES, FILENAME), project) \
+                .set_id('update %s' % FILENAME) \
+                .set_payload(content) \
+                .append_to_all_queues()
+            if keystrokes % 4 == 0:
+                queries.track(AsyncCommand('completions 1 1 %s' % FILENAME, project)
+                              .set_id('completions_command')
+                              .batch_with(update)
+                              .interactive()
+                              .append_to_queue())
+            errors.track(AsyncCommand('showErrors', project)
+                         .set_id('showErrors')
+                         .procrastinate()
+                         .activate_debounce()
+                         .background()
+                         .append_to_queue())
+            time.sleep(KEYSTROKE_INTERVAL)
+        queries.wait()
+        errors.wait()
+        seconds = time.time() - start
+    finally:
+        project.close()
+
+    snapshot = METRICS.snapshot()
+    def answered(kind):
+        return sum(h['count'] for h in snapshot['histograms'] if h['name'] == 'execution' and h['kind'] == kind)
+    def counted(name, kind):
+        return sum(c['value'] for c in snapshot['counters'] if c['name'] == name and c['kind'] == kind)
+    lanes = len(project.processes.all())
+
+    print_header("STORM of %i keystrokes in %.1fs, %i processes, stand-in needs 8ms per update"
+                 % (keystrokes, seconds, lanes))
+    print("%-34s %10i %s" % ('completions (append to answer)', queries.histogram.count, queries.columns()))
+    print("%-34s %10i %s" % ('showErrors (append to answer)', errors.histogram.count, errors.columns()))
+    print("updates sent to tss.js:   %i of %i (%.0f%% merged, %i replaced)"
+          % (answered('update'), keystrokes * lanes, 100 - 100.0 * answered('update') / (keystrokes * lanes),
+             counted('replaced', 'update')))
+    print("completions answered:     %i of %i (%i replaced)"
+          % (answered('completions'), keystrokes // 4, counted('replaced', 'completions')))
+    print("showErrors answered:      %i of %i" % (answered('showErrors'), keystrokes))
+    print("max queue depth:          %s" % ', '.join('%s %i' % (g['lane'], g['max'])
+                                                     for g in snapshot['gauges'] if g['name'] == 'queue depth'))
+
+
+SCENARIOS = [('overhead', overhead), ('throughput', throughput), ('storm', storm)]
+
+
+def main(argv=None):
+    names = (argv if argv is not None else sys.argv[1:]) or [name for name, scenario in SCENARIOS]
+    for name, scenario in SCENARIOS:
+        if name in names:
+            scenario()
+
+
+if __name__ == '__main__':
+    main()
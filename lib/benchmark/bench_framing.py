@@ -0,0 +1,93 @@
+# coding=utf8
+
+"""
+    Benchmark for sending updates to tss.js (server/Framing.py). Runs without sublime:
+
+        cd ArcticTypescript
+        python -m lib.benchmark.bench_framing
+
+    Sends full updates of files with SIZES bytes into a pipe (drained by a thread
+    which reads into a reused buffer, so it doesn't allocate) and measures the bytes
+    allocated while the update is built and written: every allocation of this size
+    is a copy of the file content. The former implementation formatted the content
+    into the command, prepended the request tag and encoded the result. The framed
+    implementation only encodes the content and writes it with one gathered write.
+
+    Needs tracemalloc (python 3.4+) for the bytes, the times are measured anyway.
+"""
+
+import os
+import time
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ..server.Framing import make_frame, write_gathered
+
+
+SIZES = [10000, 1000000, 4000000]
+ROUNDS = 20
+FILENAME = '/project/src/some/file.ts'
+
+
+def send_former(stdin, request_id, lines, content):
+    """ The former implementation of TssConnection.send() for an update. """
+    command = 'update nocheck {0} {1}\n{2}'.format(str(lines+1), FILENAME, content)
+    stdin.write(("#%i %s" % (request_id, command)).encode('UTF-8'))
+    stdin.write("\n".encode('UTF-8'))
+    stdin.flush()
+
+
+def send_framed(stdin, request_id, lines, content):
+    command = 'update nocheck {0} {1}'.format(str(lines+1), FILENAME)
+    write_gathered(stdin, make_frame(request_id, command, content))
+
+
+def drain(fd):
+    buffer = memoryview(bytearray(65536))
+    with os.fdopen(fd, 'rb', buffering=0) as stdout:
+        while stdout.readinto(buffer):
+            pass
+
+
+def bench(send, size):
+    """ Returns (bytes allocated per update / content size, milliseconds per update) """
+    line = 'var x = "some typescript";\n'
+    content = line * (size // len(line))
+    lines = content.count('\n')
+
+    read_fd, write_fd = os.pipe()
+    drainer = threading.Thread(target=drain, args=(read_fd,))
+    drainer.start()
+    stdin = os.fdopen(write_fd, 'wb')
+
+    copies = float('nan')
+    if tracemalloc is not None:
+        tracemalloc.start()
+        send(stdin, 1, lines, content)
+        copies = tracemalloc.get_traced_memory()[1] / float(len(content))
+        tracemalloc.stop()
+
+    start = time.time()
+    for i in range(ROUNDS):
+        send(stdin, i, lines, content)
+    ms = (time.time() - start) * 1000 / ROUNDS
+
+    stdin.close()
+    drainer.join()
+    return copies, ms
+
+
+def main():
+    print("per update   content bytes   copies of content       ms")
+    for name, send in [('framed', send_framed), ('former', send_former)]:
+        for size in SIZES:
+            copies, ms = bench(send, size)
+            print("%-8s %12i %12.2f %12.2f" % (name, size, copies, ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# coding=utf8
+
+"""
+    Benchmark for the transformation of completion entries to list items
+    (system/ListItems.py). Runs without sublime:
+
+        cd ArcticTypescript
+        python -m lib.benchmark.bench_list_items
+
+    Converts ENTRIES generated lib.d.ts like entries (methods with up to 4 arguments,
+    callbacks, generics, properties) ROUNDS times, like ROUNDS completion requests
+    for the same members. The former implementation parsed every signature again,
+    ListItems parses it once (cold) and answers the following requests from its cache (warm).
+    The items of both implementations are compared. ListItems is configured like
+    the one of the plugin (system/Completion.py), with the default cache size.
+"""
+
+import re
+import time
+
+from ..system.ListItems import ListItems
+
+
+ENTRIES = 5000
+ROUNDS = 10
+PREFIXES = {'method': u'○', 'property': u'●', 'declare': ''} # like utils/uiutils.py
+
+
+def make_entries(n):
+    argument_types = ['string', 'number', 'Node', '(ev: MouseEvent) => any', 'Array<string>',
+                      'NodeListOf<HTMLElement>', '{ [key: string]: any; }']
+    entries = []
+    for i in range(n):
+        name = 'member%i' % i
+        if i % 3 == 0:
+            entries.append({'kind': 'property', 'kindModifiers': 'declare', 'name': name,
+                            'type': '(property) Element%i.%s: %s' % (i % 50, name, argument_types[i % 7])})
+            continue
+        args = ', '.join('arg%i%s: %s' % (a, '?' if a == 2 else '', argument_types[(i + a) % 7])
+                         for a in range(i % 5))
+        entries.append({'kind': 'method', 'kindModifiers': 'declare', 'name': name,
+                        'type': '(method) Element%i.%s(%s): %s' % (i % 50, name, args, argument_types[i % 7])})
+    return entries
+
+
+# ----------------------------------------- FORMER IMPLEMENTATION ---------------------------------- #
+
+def former_list_item(entry):
+    """ Completion._get_list_key() and Completion._get_list_value() before ListItems """
+    kindModifiers = PREFIXES.get(entry['kindModifiers'], '')
+    kind = PREFIXES.get(entry['kind'], '')
+    type_ = entry['type'] if 'type' in entry else entry['name']
+    key = kindModifiers+' '+kind+' '+str(entry['name'])+' '+str(type_)
+
+    kind_part = "(%s)" % entry['kind']
+    if type_.startswith(kind_part):
+        type_ = type_[len(kind_part):]
+
+    match = re.match(r'.*\((.*)\):', str(type_))
+    result = []
+
+    if match:
+        variables = former_parse_args(match.group(1))
+        count = 1
+        for variable in variables:
+            splits = variable.split(':')
+            if len(splits) > 1:
+                data = '"'+variable+'"'
+                data = '${'+str(count)+':'+data+'}'
+                result.append(data)
+                count = count+1
+            else:
+                result.append('')
+
+        return (key, re.escape(entry['name'])+'('+','.join(result)+')')
+    else:
+        return (key, re.escape(entry['name']))
+
+
+def former_parse_args(group):
+    args = []
+    arg = ""
+    callback = False
+
+    for char in group:
+        if char == '(' or char == '<':
+            arg += char
+            callback = True
+        elif char == ')' or char == '>':
+            arg += char
+            callback = False
+        elif char == ',':
+            if callback == False:
+                args.append(arg)
+                arg = ""
+            else:
+                arg+=char
+        else:
+            arg+=char
+
+    args.append(arg)
+    return args
+
+
+# ----------------------------------------- BENCHMARK ---------------------------------- #
+
+def bench(convert, entries):
+    """ Returns (items of the first round, ms of the first round, ms per following round) """
+    start = time.time()
+    items = [convert(entry) for entry in entries]
+    first = (time.time() - start) * 1000
+    start = time.time()
+    for i in range(ROUNDS - 1):
+        [convert(entry) for entry in entries]
+    following = (time.time() - start) * 1000 / (ROUNDS - 1)
+    return items, first, following
+
+
+def main():
+    entries = make_entries(ENTRIES)
+    list_items = ListItems(PREFIXES)
+
+    former_items, former_first, former_following = bench(former_list_item, entries)
+    items, first, following = bench(list_items.list_item, entries)
+    assert items == former_items, "ListItems differs from the former implementation"
+
+    print("%i entries             first request ms   following requests ms" % ENTRIES)
+    print("%-20s %18.2f %23.2f" % ('former', former_first, former_following))
+    print("%-20s %18.2f %23.2f" % ('ListItems', first, following))
+    print(list_items.cache_info())
+
+
+if __name__ == '__main__':
+    main()
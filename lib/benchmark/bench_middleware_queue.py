@@ -0,0 +1,111 @@
+# coding=utf8
+
+"""
+    Microbenchmark for server/MiddlewareQueue.py. Runs without sublime:
+
+        cd ArcticTypescript
+        python -m lib.benchmark.bench_middleware_queue
+
+    Fills the queue with N pending commands (every fourth one debouncing,
+    like showErrors triggers during an update storm) and measures the cost per
+    command of append, merge lookup and pop_next. The per command cost of the
+    MiddlewareQueue should not grow with N, the plain list (the former
+    implementation) grows linearly with N.
+"""
+
+import time
+
+from ..server.MiddlewareQueue import MiddlewareQueue
+
+
+SIZES = [100, 1000, 10000]
+
+
+class FakeCommand(object):
+    """ Has the attributes of AsyncCommand which are used by the queue. """
+
+    def __init__(self, _id, debounce, now):
+        self.id = _id
+        self.time_queue = now
+        self.ready_at = now + (3600 if debounce else 0)
+
+    def can_be_executed_now(self):
+        return time.time() >= self.ready_at
+
+    def time_until_execution(self):
+        return max(0, self.ready_at - time.time())
+
+    def schedule_key(self):
+        return (self.ready_at, 0, self.time_queue)
+
+    def is_long_running(self):
+        return False
+
+
+class ListQueue(object):
+    """ The former middleware queue: a list which is scanned for every operation. """
+
+    def __init__(self):
+        self.commands = []
+
+    def append(self, command):
+        self.commands.append(command)
+
+    def with_id(self, _id):
+        return [c for c in self.commands if c.id == _id]
+
+    def remove(self, command):
+        self.commands.remove(command)
+
+    def pop_next(self, slot_is_free=True, long_running_allowed=True):
+        executable = [c for c in self.commands if c.can_be_executed_now()]
+        if not executable:
+            return None, False
+        command = min(executable, key=lambda c: c.schedule_key())
+        self.commands.remove(command)
+        return command, False
+
+
+def make_commands(n):
+    now = time.time()
+    return [FakeCommand('cmd %i' % (i // 2), i % 4 == 3, now + i * 1e-6) for i in range(n)]
+
+
+def bench(queue_class, n, rounds=1000):
+    """ Returns microseconds per command for append, merge lookup and pop_next with n pending commands. """
+    queue = queue_class()
+    for c in make_commands(n):
+        queue.append(c)
+
+    extra = make_commands(rounds)
+
+    start = time.time()
+    for c in extra:
+        queue.append(c)
+    t_append = time.time() - start
+
+    start = time.time()
+    for c in extra:
+        for same_id in queue.with_id(c.id):
+            if same_id is not c:
+                queue.remove(same_id)
+    t_merge = time.time() - start
+
+    start = time.time()
+    for i in range(rounds):
+        queue.pop_next()
+    t_pop = time.time() - start
+
+    return [t * 1e6 / rounds for t in (t_append, t_merge, t_pop)]
+
+
+def main():
+    print("us per command      append   merge     pop")
+    for queue_class in [MiddlewareQueue, ListQueue]:
+        for n in SIZES:
+            t_append, t_merge, t_pop = bench(queue_class, n)
+            print("%-15s %6i %7.2f %7.2f %7.2f" % (queue_class.__name__, n, t_append, t_merge, t_pop))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# coding=utf8
+
+"""
+    Lets benchmarks import the modules which use the sublime API (eg. server/Processes.py)
+    outside of sublime. install() registers a minimal sublime module before they are imported:
+    set_timeout() runs the callbacks one after the other in a "main thread", like sublime does,
+    the UI functions do nothing. Only for the benchmarks, the plugin never imports this.
+"""
+
+import sys
+import types
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+class MainThread(threading.Thread):
+    """ Runs the callbacks of set_timeout() in order, in one thread. """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name='headless main thread')
+        self.daemon = True
+        self.callbacks = Queue()
+
+    def set_timeout(self, callback, delay=0):
+        if delay:
+            timer = threading.Timer(delay / 1000.0, self.callbacks.put, [callback])
+            timer.daemon = True
+            timer.start()
+        else:
+            self.callbacks.put(callback)
+
+    def run(self):
+        while True:
+            callback = self.callbacks.get()
+            try:
+                callback()
+            except Exception as e:
+                print("headless main thread: %s" % e)
+
+    def wait_until_idle(self, timeout=10):
+        """ Returns when all callbacks which have been queued so far have run. """
+        done = threading.Event()
+        self.callbacks.put(done.set)
+        done.wait(timeout)
+
+
+MAIN_THREAD = MainThread()
+
+
+def install():
+    """ Registers the headless sublime module, unless sublime has been imported already. """
+    if 'sublime' in sys.modules:
+        return
+    sublime = types.ModuleType('sublime')
+    sublime.version = lambda: '3083'
+    sublime.set_timeout = MAIN_THREAD.set_timeout
+    sublime.set_timeout_async = MAIN_THREAD.set_timeout
+    sublime.status_message = lambda message: None
+    sublime.error_message = lambda message: print(message)
+    sublime.message_dialog = lambda message: None
+    sublime.active_window = lambda: None
+    sublime.load_settings = lambda name: None
+    sublime.packages_path = lambda: ''
+    sublime.expand_variables = lambda value, variables: value
+    sublime.platform = lambda: sys.platform
+    sublime.View = type('View', (object,), {})
+    sublime.Region = type('Region', (object,), {})
+    sys.modules['sublime'] = sublime
+    sys.modules['sublime_plugin'] = types.ModuleType('sublime_plugin')
+    MAIN_THREAD.start()
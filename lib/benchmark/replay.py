@@ -0,0 +1,245 @@
+# coding=utf8
+
+"""
+    Sends a recorded session (setting record_tss_commands, see server/Recorder.py)
+    to fresh tss.js processes and compares the latencies. Runs without sublime:
+
+        cd ArcticTypescript
+        python -m lib.benchmark.replay <recording> [--speed 4] [--node node]
+
+    One tss.js is started for every recorded lane (in the recorded project directory).
+    The commands are sent with the same batches and at the recorded times,
+    divided by --speed (0: as fast as possible). The replay doesn't wait for answers
+    before sending (like the adapter with its in-flight slots), so a speed above the
+    original pace shows how tss.js copes with a denser stream of the same commands.
+    The execution times (send to answer) per command kind are compared with the recorded ones,
+    and so are the answers: the commands whose answer differs are listed.
+
+    The new tss.js reads the files from disk, as the recorded one did when it was started.
+    If the files have changed since the recording, the answers differ. Crashes are not
+    replayed, a restart in the recording is only reported.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from subprocess import Popen, PIPE
+from threading import Thread, Lock, Event
+
+from ..server.Framing import make_frame, make_batch_frame, write_gathered
+from ..server.Metrics import Histogram
+from ..server.Recorder import read_recording
+
+
+TSS_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'bin', 'tss.js')
+PERCENTILES = (50, 95, 99)
+ANSWER_TIMEOUT = 60 # seconds to wait for the last answers after everything has been sent
+MAX_LISTED_DIFFERENCES = 20
+
+
+# ----------------------------------------- TSS.JS PROCESS ---------------------------------- #
+
+class ReplayProcess(object):
+    """ A tss.js --framed process which notes the arrival time of every answer. """
+
+    tag_re = re.compile(br'^#(\d+) ')
+
+    def __init__(self, node, project_dir):
+        self.process = Popen([node, TSS_PATH, '--project', '.', '--framed'],
+                             stdin=PIPE, stdout=PIPE, stderr=PIPE, cwd=project_dir)
+        self.sent = {} # sent[request id] = time
+        self.answered = {} # answered[request id] = (time, answer text)
+        self.lock = Lock()
+        self.all_answered = Event()
+        self.expected = 0
+        self.first_message = self.read_frame()
+        self.reader = Thread(target=self.read_answers)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def read_frame(self):
+        header = self.process.stdout.readline()
+        if not header:
+            raise EOFError("tss.js has closed stdout")
+        return self.process.stdout.read(int(header))
+
+    def read_answers(self):
+        try:
+            while True:
+                payload = self.read_frame()
+                now = time.time()
+                lines = payload.split(b'\n')[1:] if payload.startswith(b'batch\n') else [payload]
+                for line in lines:
+                    m = self.tag_re.match(line)
+                    if m is not None:
+                        self.on_answer(int(m.group(1)), now, line[m.end():].decode('utf-8'))
+        except (EOFError, ValueError):
+            self.all_answered.set()
+
+    def on_answer(self, request_id, now, answer):
+        with self.lock:
+            self.answered[request_id] = (now, answer)
+            if len(self.answered) >= self.expected:
+                self.all_answered.set()
+
+    def send(self, sends):
+        """ Sends the recorded send events of one batch in one frame. """
+        now = time.time()
+        with self.lock:
+            for event in sends:
+                self.sent[event['id']] = now
+        if len(sends) == 1:
+            buffers = make_frame(sends[0]['id'], sends[0]['cmd'], sends[0].get('payload'))
+        else:
+            buffers = make_batch_frame([(e['id'], e['cmd'], e.get('payload')) for e in sends])
+        write_gathered(self.process.stdin, buffers)
+
+    def kill(self):
+        try:
+            self.process.kill()
+        except ProcessLookupError:
+            pass
+
+
+# ----------------------------------------- REPLAY ---------------------------------- #
+
+def group_batches(events):
+    """ Returns {lane: [(t, [send events of one batch])]} in the recorded order. """
+    lanes = {}
+    for event in events:
+        if event['e'] != 'send':
+            continue
+        batches = lanes.setdefault(event['lane'], [])
+        if batches and batches[-1][1][0]['batch'] == event['batch']:
+            batches[-1][1].append(event)
+        else:
+            batches.append((event['t'], [event]))
+    return lanes
+
+
+def send_lane(process, batches, start, speed):
+    for t, sends in batches:
+        if speed > 0:
+            delay = start + t / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        process.send(sends)
+
+
+def same_answer(recorded, replayed):
+    """ Compares two answer texts as JSON values, so the order of the keys doesn't matter. """
+    try:
+        return json.loads(recorded) == json.loads(replayed)
+    except ValueError:
+        return recorded.strip() == replayed.strip()
+
+
+def replay(events, node, speed):
+    """
+        Returns {request id: (send event, recorded seconds, replayed seconds or None,
+        replayed answer text or None)}
+    """
+    header = events[0]
+    lanes = group_batches(events)
+    processes = {}
+    try:
+        for lane, batches in lanes.items():
+            processes[lane] = ReplayProcess(node, header['project'])
+            processes[lane].expected = sum(len(sends) for t, sends in batches)
+
+        start = time.time()
+        senders = [Thread(target=send_lane, args=(processes[lane], batches, start, speed))
+                   for lane, batches in lanes.items()]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        for process in processes.values():
+            process.all_answered.wait(ANSWER_TIMEOUT)
+    finally:
+        for process in processes.values():
+            process.kill()
+
+    recorded = dict((event['id'], event) for event in events if event['e'] == 'answer')
+    results = {}
+    for event in events:
+        if event['e'] != 'send' or event['id'] not in recorded:
+            continue
+        process = processes[event['lane']]
+        answer = process.answered.get(event['id'])
+        if answer is None:
+            results[event['id']] = (event, recorded[event['id']]['exec'], None, None)
+        else:
+            results[event['id']] = (event, recorded[event['id']]['exec'],
+                                    answer[0] - process.sent[event['id']], answer[1])
+    return results
+
+
+def report(events, results, speed):
+    sends = [e for e in events if e['e'] == 'send']
+    restarts = [e for e in events if e['e'] == 'restart']
+    duration = sends[-1]['t'] if sends else 0
+    print("%i commands in %i lanes over %.1fs, replayed at %s"
+          % (len(sends), len(set(e['lane'] for e in sends)), duration,
+             "%gx speed" % speed if speed > 0 else "full speed"))
+    if restarts:
+        print("The recording contains %i restarts of tss.js, which are not replayed" % len(restarts))
+
+    recorded_answers = dict((e['id'], e.get('answer')) for e in events if e['e'] == 'answer')
+    kinds = {}
+    differing = []
+    for request_id, (send, recorded, replayed, answer) in sorted(results.items()):
+        histograms = kinds.setdefault(send['kind'], (Histogram(), Histogram(), [], []))
+        histograms[0].add(recorded)
+        if replayed is None:
+            histograms[2].append(request_id)
+            continue
+        histograms[1].add(replayed)
+        if recorded_answers[request_id] is not None and not same_answer(recorded_answers[request_id], answer):
+            histograms[3].append(request_id)
+            differing.append((send, recorded_answers[request_id], answer))
+
+    print("")
+    print("%-20s %6s %8s %8s  %s" % ('command', 'count', 'missing', 'differ',
+          '  '.join('%-26s' % ('p%i recorded/replayed/diff' % p) for p in PERCENTILES)))
+    for kind, (recorded, replayed, missing, different) in sorted(kinds.items()):
+        columns = []
+        for p in PERCENTILES:
+            r, n = recorded.percentile(p), replayed.percentile(p)
+            if n is None:
+                columns.append('%8.1f %8s %8s' % (1000 * r, '-', '-'))
+            else:
+                columns.append('%8.1f %8.1f %+8.1f' % (1000 * r, 1000 * n, 1000 * (n - r)))
+        print("%-20s %6i %8i %8i  %s" % (kind, recorded.count, len(missing), len(different), '  '.join(columns)))
+    print("(ms)")
+
+    if differing:
+        print("")
+        print("%i answers differ from the recording%s:" % (len(differing), ", the first %i" % MAX_LISTED_DIFFERENCES
+                                                           if len(differing) > MAX_LISTED_DIFFERENCES else ""))
+        for send, recorded, replayed in differing[:MAX_LISTED_DIFFERENCES]:
+            print("#%i %s" % (send['id'], send['cmd']))
+            print("    recorded: %s" % recorded.strip()[:100])
+            print("    replayed: %s" % replayed.strip()[:100])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replays a recorded tss.js command stream.")
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="pace relative to the recording, 0: as fast as possible (default 1)")
+    parser.add_argument('--node', default='node', help="path of node (default: node in $PATH)")
+    args = parser.parse_args(argv)
+
+    events = read_recording(args.recording)
+    if not events or events[0]['e'] != 'start':
+        sys.exit("%s is no recording of ArcticTypescript" % args.recording)
+    results = replay(events, args.node, args.speed)
+    report(events, results, args.speed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+# coding=utf8
+
+"""
+    Stand-in for bin/tss.js which speaks its protocol without node and TypeScript,
+    for benchmarking the adapter (see bench_adapter.py). Start it like tss.js:
+
+        python stand_in_tss.py [--framed] [--latency KIND=SECONDS ..] [--size KIND=BYTES ..]
+                               [--concurrent] [--echo] [--log FILE]
+
+    Like tss.js it handles one command after the other: "#<request id> <command>" lines,
+    the content lines after "update .. <n> <file>" and the names after
+    "completionDetails <n> ..", "<byte length>\\n<payload>" frames with --framed and batch
+    frames ("batch\\n<command>\\n<command>..", answered with one frame). A command
+    "@<project id> <command>" of a shared host is handled like <command>.
+
+    Every command sleeps for the latency of its kind (the first word, eg. 'type'),
+    varied by +-jitter, then it is answered with a JSON value of about the configured size:
+    an "updated <file>" string for updates, an object with entries for completions,
+    an array for showErrors, references and completionDetails, an object for everything else.
+    With --concurrent, every command (but the commands of a batch) is answered after its
+    latency without waiting for the commands before it, so the answers arrive out of order,
+    which the tags allow. With --echo, a command is answered with itself as JSON string
+    instead, so the answers can be told apart.
+    "quit" ends the process. With --log, every command (without tag and lines) is appended
+    to FILE when it arrives, so tests can check what the adapter has sent.
+    Uses only the standard library, so it can be started by path.
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+
+DEFAULT_LATENCIES = {'update': 0.001, 'type': 0.002, 'completions': 0.01, 'completions-brief': 0.005,
+                     'completionDetails': 0.003, 'definition': 0.003, 'references': 0.05,
+                     'showErrors': 0.1, '*': 0.002}
+DEFAULT_SIZES = {'completions': 20000, 'completions-brief': 5000, 'completionDetails': 2000,
+                 'showErrors': 2000, 'references': 1000, '*': 200}
+ARRAY_KINDS = ('showErrors', 'references', 'completionDetails')
+
+
+class StandInTss(object):
+
+    tag_re = re.compile(r'^#(\d+) (?:@\S+ )?([\s\S]*)$')
+
+    def __init__(self, output, framed, latencies, sizes, jitter=0.0, seed=0, log=None,
+                 concurrent=False, echo=False):
+        self.output = output # binary stream
+        self.log = log # text stream for the received commands or None
+        self.concurrent = concurrent
+        self.echo = echo
+        self.write_lock = threading.Lock()
+        self.framed = framed
+        self.latencies = latencies
+        self.sizes = sizes
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.bodies = {} # answer per kind, the size doesn't depend on the command
+        self.collecting = 0 # lines which belong to the pending command
+        self.pending = None # (tag, kind, command) which waits for its lines
+        self.batch_answers = None # answers of the current batch frame
+        self.is_closed = False
+
+    # INPUT
+    def on_line(self, line):
+        if self.collecting > 0:
+            self.collecting -= 1
+            if self.collecting == 0:
+                self.answer(*self.pending)
+            return
+        m = self.tag_re.match(line.strip())
+        tag, command = ('#%s ' % m.group(1), m.group(2)) if m else ('', line.strip())
+        kind = command.split(' ', 1)[0]
+        if self.log is not None:
+            self.log.write(command + '\n')
+            self.log.flush()
+        if kind == 'quit':
+            self.write(tag + '"bye"')
+            self.is_closed = True
+            return
+        lines = re.match(r'^(?:update(?: nocheck)?|completionDetails) (\d+)', command)
+        if lines is not None and int(lines.group(1)) > 0:
+            self.collecting = int(lines.group(1))
+            self.pending = (tag, kind, command)
+            return
+        self.answer(tag, kind, command)
+
+    def on_frame(self, payload):
+        lines = payload.decode('utf-8').split('\n')
+        if lines[0] != 'batch':
+            for line in lines:
+                self.on_line(line)
+            return
+        self.batch_answers = []
+        for line in lines[1:]:
+            self.on_line(line)
+        answers, self.batch_answers = self.batch_answers, None
+        self.write('\n'.join(['batch'] + answers))
+
+    # OUTPUT
+    def answer(self, tag, kind, command):
+        latency = self.latencies.get(kind, self.latencies['*'])
+        latency *= 1 + self.jitter * (2 * self.random.random() - 1)
+        if self.echo:
+            body = json.dumps(command)
+        elif kind == 'update':
+            body = json.dumps('updated %s' % command.rsplit(' ', 1)[-1])
+        else:
+            body = self.body(kind)
+        if self.concurrent and self.batch_answers is None:
+            timer = threading.Timer(latency, self.write, [tag + body])
+            timer.daemon = True
+            timer.start()
+            return
+        if latency > 0:
+            time.sleep(latency)
+        self.write(tag + body)
+
+    def body(self, kind):
+        if kind not in self.bodies:
+            size = self.sizes.get(kind, self.sizes['*'])
+            element = {'name': 'member', 'kind': 'method', 'kindModifiers': 'declare',
+                       'type': '(method) Element.member(): void', 'docComment': ''}
+            count = max(1, size // len(json.dumps(element)))
+            if kind.startswith('completions'):
+                value = {'isMemberCompletion': True, 'entries': [dict(element, name='member%i' % i)
+                                                                 for i in range(count)]}
+            elif kind in ARRAY_KINDS:
+                value = [dict(element, name='member%i' % i) for i in range(count)]
+            else:
+                value = dict(element, docComment='x' * max(0, size - len(json.dumps(element))))
+            self.bodies[kind] = json.dumps(value)
+        return self.bodies[kind]
+
+    def write(self, text):
+        if self.batch_answers is not None:
+            self.batch_answers.append(text)
+            return
+        data = text.encode('utf-8')
+        with self.write_lock:
+            if self.framed:
+                self.output.write(('%i\n' % len(data)).encode('ascii') + data)
+            else:
+                self.output.write(data + b'\n')
+            self.output.flush()
+
+    # LOOP
+    def serve(self, input):
+        """ Reads commands from the binary stream input until it is closed or quit has been answered. """
+        self.write('"loaded stand-in, TSS listening.."')
+        while not self.is_closed:
+            if self.framed:
+                header = input.readline()
+                if not header:
+                    return
+                self.on_frame(input.read(int(header)))
+            else:
+                line = input.readline()
+                if not line:
+                    return
+                self.on_line(line.decode('utf-8'))
+
+
+def parse_pairs(pairs, defaults, convert):
+    """ Returns defaults updated by ["KIND=VALUE"]. "*=VALUE" replaces all defaults. """
+    values = dict(defaults)
+    pairs = [pair.split('=', 1) for pair in pairs or []]
+    for kind, value in sorted(pairs, key=lambda pair: pair[0] != '*'):
+        if kind == '*':
+            values = dict.fromkeys(values, convert(value))
+        values[kind] = convert(value)
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in for tss.js with configurable latency and answer sizes.")
+    parser.add_argument('--framed', action='store_true')
+    parser.add_argument('--latency', action='append', metavar='KIND=SECONDS',
+                        help="latency of a command kind, * for all kinds which are not given")
+    parser.add_argument('--size', action='append', metavar='KIND=BYTES',
+                        help="approximate answer size of a command kind, * for all kinds which are not given")
+    parser.add_argument('--jitter', type=float, default=0.0, help="latencies vary by +- this fraction")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrent', action='store_true', help="answer out of order, after the latency of each command")
+    parser.add_argument('--echo', action='store_true', help="answer every command with itself")
+    parser.add_argument('--log', metavar='FILE', help="append every received command to FILE")
+    parser.add_argument('--project', help="ignored, like the other arguments of tss.js")
+    args, ignored = parser.parse_known_args(argv)
+
+    log = open(args.log, 'a') if args.log else None
+    server = StandInTss(sys.stdout.buffer, args.framed,
+                        parse_pairs(args.latency, DEFAULT_LATENCIES, float),
+                        parse_pairs(args.size, DEFAULT_SIZES, int),
+                        args.jitter, args.seed, log, args.concurrent, args.echo)
+    try:
+        server.serve(sys.stdin.buffer)
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        if log is not None:
+            log.close()
+
+
+if __name__ == '__main__':
+    main()
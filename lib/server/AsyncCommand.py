@@ -4,9 +4,12 @@ import uuid
 import time
 import sublime
 import json
+from concurrent.futures import Future
 
 from ..utils import Debug
 from ..utils.debounce import DEFAULT_DEBOUNCE_DELAY
+from ..utils.jsonstream import JsonArrayStream
+from ..system.globals import COMMAND_COUNTERS
 
 # ----------------------------------------- ASYNC COMMAND ---------------------------------- #
 
@@ -25,7 +28,22 @@ class AsyncCommand(object):
             .procrastinate() \
             .set_id('errors') \
             .do_json_decode_tss_answer() \
-            .append_to_slow_queue()
+            .background() \
+            .append_to_queue()
+
+        Every command has a priority class: sync (default, eg. updates), interactive
+        (completion, quickInfo), navigation (definition, references) or background
+        (showErrors, indexing). Each class has a time budget. The deadline of a command
+        is the time it has been queued (or debounced) plus this budget.
+        Each process sends the command with the earliest deadline first,
+        so sync commands are never overtaken and nothing starves.
+        Background commands are sent to the SLOW process, all others to the least
+        loaded query worker.
+
+        append_to_queue() returns the command itself. Keep it as cancellation handle:
+        cancel() drops a query which is not needed anymore (cursor moved, view closed).
+        Every command has an execution timeout (depends on the class, see set_execution_timeout).
+        If tss.js hasn't answered in time, it is considered hung and will be restarted.
 
         The id is used to identify brother commands which do the same thing (maybe on the same file).
         If an id is given, all pending commands with the same id will
@@ -33,11 +51,39 @@ class AsyncCommand(object):
         it's first brother is on the turn. Use procastinate() to reverse this behaviour:
         Then it will be deffered until the last aka newest brother is on turn.
         Id will also be used for debouncing.
+
+        Every command has a future (concurrent.futures.Future). It gets the answer (decoded and
+        transformed) as result, is cancelled with the command, takes the result of the command
+        which has replaced this one and fails with TimeoutError after the execution timeout.
+        Compose with future.add_done_callback() (called in the thread which reads the answer)
+        or wait with future.result(timeout), but never in the main thread.
     """
 
     MERGE_PROCRASTINATE = 1
     MERGE_IMMEDIATE = 2
 
+    PRIORITY_SYNC = 0
+    PRIORITY_INTERACTIVE = 1
+    PRIORITY_NAVIGATION = 2
+    PRIORITY_BACKGROUND = 3
+
+    PRIORITY_NAMES = {PRIORITY_SYNC: 'sync',
+                      PRIORITY_INTERACTIVE: 'interactive',
+                      PRIORITY_NAVIGATION: 'navigation',
+                      PRIORITY_BACKGROUND: 'background'}
+
+    # seconds tss.js may need to answer a command of this class
+    PRIORITY_TIMEOUTS = {PRIORITY_SYNC: 60.0,
+                         PRIORITY_INTERACTIVE: 10.0,
+                         PRIORITY_NAVIGATION: 30.0,
+                         PRIORITY_BACKGROUND: 120.0}
+
+    # seconds a command of this class may wait for commands with an earlier deadline
+    PRIORITY_BUDGETS = {PRIORITY_SYNC: 0.0,
+                        PRIORITY_INTERACTIVE: 0.05,
+                        PRIORITY_NAVIGATION: 0.5,
+                        PRIORITY_BACKGROUND: 5.0}
+
 
     def __init__(self, command, project):
         self.command = command
@@ -49,14 +95,32 @@ class AsyncCommand(object):
         self.executing_callback = None
         self.callback_kwargs = {}
         self.merge_behaviour = self.MERGE_IMMEDIATE
+        self.priority = self.PRIORITY_SYNC
         self.debounce_time = 0
         self.json_decode_tss_answer = False
+        self.payload = None
+        self.chunk_callback = None
+        self.stream_answer = False
+        self.stream_key = None
+        self.result_transform = None
+        self.chunk_transform = None
+        self.prepared_chunks = [] # results of chunk_transform for the current answer
+        self.stream = None # JsonArrayStream of the current answer
+        self.journal_entry = None
+        self.make_command = None
+        self.batch = None # [commands] which belong together, shared by all of them
+        self.execution_timeout = None # None: use PRIORITY_TIMEOUTS
+        self.future = Future()
+        self.leader = None # identical command whose answer this one gets (see follow)
+        self.followers = []
 
         self.time_queue = 0
         self.time_last_bounce = 0
         self.time_execute = 0
         self.time_finish = 0
         self.is_executed = False
+        self.is_cancelled = False
+        self.request_id = None # set by TssAdapterThread when sent to tss.js
 
     # ------------------------- chainable config ---------------------------------- #
 
@@ -78,10 +142,104 @@ class AsyncCommand(object):
         self.debounce_time = delay
         return self
 
+    def interactive(self):
+        """ Set priority class for requests the user is waiting for while typing, eg. completions. """
+        self.priority = self.PRIORITY_INTERACTIVE
+        return self
+
+    def navigation(self):
+        """ Set priority class for explicit requests which may take longer, eg. references. """
+        self.priority = self.PRIORITY_NAVIGATION
+        return self
+
+    def background(self):
+        """ Set priority class for long running work, eg. showErrors. Executed by the SLOW process. """
+        self.priority = self.PRIORITY_BACKGROUND
+        return self
+
+    def set_journal_entry(self, filename, content):
+        """
+            Tells the adapter that tss.js knows content for filename after this command.
+            The journal is replayed if tss.js has to be restarted.
+            filename None: tss.js reads all files from disk again.
+        """
+        self.journal_entry = (filename, content)
+        return self
+
+    def set_payload(self, payload):
+        """
+            Text for the lines after the command, eg. the content of an update.
+            It is sent without being concatenated with the command string.
+        """
+        self.payload = payload
+        return self
+
+    def set_late_binding(self, make_command):
+        """
+            The command string will be made when the command is sent:
+            make_command(journal) is called in the adapter thread and returns the
+            command string, a tuple (command string, payload) or None if there is nothing to send anymore.
+            journal is the adapter's dict of what its tss.js knows about each file
+            (see TssAdapterThread), make_command has to keep it up to date.
+        """
+        self.make_command = make_command
+        return self
+
+    def batch_with(self, command):
+        """
+            Declares that this command belongs together with command, eg. a query and the
+            update of the file before it. If both are pending on the same process, they are sent
+            in one frame (in the order of declaration) and tss.js answers them in one frame.
+            Call it before append_to_queue(). command may be None.
+        """
+        if command is not None:
+            if command.batch is None:
+                command.batch = [command]
+            self.batch = command.batch
+            self.batch.append(self)
+        return self
+
+    def set_execution_timeout(self, seconds):
+        """ Seconds tss.js may need to answer. Overrides the timeout of the priority class. """
+        self.execution_timeout = seconds
+        return self
+
     def do_json_decode_tss_answer(self):
         self.json_decode_tss_answer = True
         return self
 
+    def stream_json_array(self, chunk_callback=None, key=None):
+        """
+            The answer is a JSON array (or an object with the array member <key>).
+            It is decoded while tss.js is still sending: chunk_callback([elements], **callback_kwargs)
+            will be called for every chunk of received elements. The result callback gets
+            the decoded answer afterwards, like with do_json_decode_tss_answer().
+        """
+        self.stream_answer = True
+        self.chunk_callback = chunk_callback
+        self.stream_key = key
+        return self
+
+    def set_result_transform(self, transform):
+        """
+            transform(tss_answer, prepared_chunks) will be called in the reader thread (or the IOLoop worker),
+            the result callback gets its return value. Use it to do the expensive preparation
+            of the data for the views (formatting, sorting), so the main thread only has to display it.
+            prepared_chunks is the list of the chunk_transform results of this answer.
+            transform must not use the sublime API.
+        """
+        self.result_transform = transform
+        return self
+
+    def set_chunk_transform(self, transform):
+        """
+            transform([elements]) will be called in the reader thread (or the IOLoop worker) for every chunk of a
+            streamed answer (see stream_json_array), chunk_callback gets its return value.
+            transform must not use the sublime API.
+        """
+        self.chunk_transform = transform
+        return self
+
     def set_callback_kwargs(self, **callback_kwargs):
         """ Set additional arguments the callbacks will be called with. """
         self.callback_kwargs = callback_kwargs
@@ -109,72 +267,211 @@ class AsyncCommand(object):
 
     # ------------------------- finish chain: execute ------------------------------ #
 
-    def append_to_fast_queue(self):
-        Debug('command', "CMD queued @FAST: %s" % self.id)
+    def append_to_queue(self):
+        """
+            Sends this command to the process which is responsible for its priority class.
+            Returns self.
+        """
+        Debug('command', "CMD queued @%s: %s" % (self.get_priority_name(), self.id))
+        if self.priority == self.PRIORITY_BACKGROUND:
+            return self._append_to_queue('slow')
         return self._append_to_queue('fast')
 
-    def append_to_slow_queue(self):
-        Debug('command', "CMD queued @SLOW: %s" % self.id)
-        return self._append_to_queue('slow')
-
-    def append_to_both_queues(self):
-        return self.append_to_slow_queue() \
-           and self.append_to_fast_queue()
+    def append_to_all_queues(self):
+        """ Sends this command to the SLOW process and to every query worker. Returns self. """
+        Debug('command', "CMD queued @ALL: %s" % self.id)
+        return self._append_to_queue('all')
 
     def _append_to_queue(self, process_type):
         if not self.project.processes.is_initialized():
-            return False
+            return self
 
         self.time_queue = time.time()
         self.time_last_bounce = self.time_queue
 
         if process_type == 'fast':
-            self.project.processes.fast.send_async_command(self)
+            self.project.processes.least_loaded_worker().send_async_command(self)
         elif process_type == 'slow':
             self.project.processes.slow.send_async_command(self)
+        elif process_type == 'all':
+            for process in self.project.processes.all():
+                process.send_async_command(self)
+        return self
+
+    # ------------------------- cancellation ---------------------------------- #
+
+    def cancel(self):
+        """
+            The command will not be sent anymore and the result callback will not be called.
+            Sync commands (eg. updates) can't be cancelled. Returns True if cancelled.
+        """
+        if self.priority == self.PRIORITY_SYNC or self.is_executed or self.is_cancelled:
+            return False
+        if any(not follower.is_cancelled for follower in self.followers):
+            # other callers wait for the same answer, only this one doesn't get it anymore
+            self.result_callback = None
+            Debug('command+', "CMD callback dropped, followers wait for the answer [ %s ]" % self.id)
+            return True
+        self.is_cancelled = True
+        self.future.cancel()
+        COMMAND_COUNTERS['cancelled'] += 1
+        Debug('command+', "CMD cancelled after %fs [ %s ]" % (time.time() - self.time_queue, self.id))
         return True
 
+    # ------------------------- single flight ---------------------------------- #
+
+    def follow(self, leader):
+        """
+            This command will not be sent, it gets the answer of the identical leader command,
+            which has been queued before and has not been answered yet. Returns self.
+        """
+        self.leader = leader
+        self.time_queue = time.time()
+        leader.followers.append(self)
+        leader.future.add_done_callback(self._on_leader_done)
+        return self
+
+    def _on_leader_done(self, leader_future):
+        self._resolve_like(leader_future)
+        if self.is_cancelled or leader_future.cancelled() or leader_future.exception() is not None:
+            return # the leader has been cancelled or has timed out
+        # answered or replaced by an identical command (see TypescriptToolsWrapper._send_or_use_cache)
+        self.is_executed = True
+        answer = leader_future.result()
+        if self.result_callback is not None:
+            sublime.set_timeout(lambda: self.result_callback(answer, **self.callback_kwargs), 000)
+
     # ------------------------- call callbacks ---------------------------------- #
 
     def on_replaced(self, by):
         """ calls callback by using sublime.set_timeout """
         by.time_last_bounce = max(self.time_last_bounce, by.time_last_bounce)
+        by.future.add_done_callback(self._resolve_like)
         if self.replaced_callback is not None:
             sublime.set_timeout(lambda:self.replaced_callback(by, **self.callback_kwargs),000)
 
         Debug('command+', "CMD replaced after %fs [ %s ]" % (time.time() - self.time_queue, self.id))
 
+    def _resolve_like(self, future):
+        """ Resolves the future of this replaced command like the future of the replacing one. """
+        if self.future.done():
+            return
+        if future.cancelled():
+            self.future.cancel()
+        elif future.exception() is not None:
+            self.future.set_exception(future.exception())
+        else:
+            self.future.set_result(future.result())
+
     def on_result(self, tss_answer):
-        """ calls callback by using sublime.set_timeout """
+        """ resolves the future and calls callback by using sublime.set_timeout """
         self.is_executed = True
-        if self.result_callback is not None:
-            if self.json_decode_tss_answer:
+        if not self.is_cancelled:
+            if self.json_decode_tss_answer and not self.stream_answer:
                 tss_answer = json.loads(tss_answer)
-            sublime.set_timeout(lambda:self.result_callback(tss_answer, **self.callback_kwargs),000)
+            if self.result_transform is not None:
+                tss_answer = self._transform(self.result_transform, tss_answer, self.prepared_chunks)
+            if not self.future.done(): # commands for all processes are answered by each of them
+                self.future.set_result(tss_answer)
+            if self.result_callback is not None:
+                sublime.set_timeout(lambda:self.result_callback(tss_answer, **self.callback_kwargs),000)
 
         self.time_finish = time.time()
-        Debug('command', "CMD %fs = %fs + %fs to execute %s" % (
+        Debug('command', "CMD %fs = %fs + %fs to execute %s (%s)" % (
             self.time_finish - self.time_queue,
             self.time_execute - self.time_queue,
             self.time_finish - self.time_execute,
-            self.id))
+            self.id,
+            self.get_priority_name()))
+
+    def on_chunk(self, elements):
+        """ calls chunk_transform and chunk_callback by using sublime.set_timeout """
+        if self.is_cancelled:
+            return
+        if self.chunk_transform is not None:
+            elements = self._transform(self.chunk_transform, elements)
+            self.prepared_chunks.append(elements)
+        if self.chunk_callback is not None:
+            sublime.set_timeout(lambda: self.chunk_callback(elements, **self.callback_kwargs), 000)
+
+    def _transform(self, transform, *args):
+        """ Runs a transform in the reader thread or the IOLoop worker. A failing transform must not kill it. """
+        try:
+            return transform(*args)
+        except Exception as e:
+            Debug('error', "CMD result transform failed: %s (%s)" % (e, self.command[0:100]))
+            return None
+
+    def on_timeout(self):
+        """ Called by the adapter if tss.js has not answered within the execution timeout. """
+        if not self.future.done():
+            self.future.set_exception(TimeoutError("tss.js has not answered within %.1fs" % self.get_execution_timeout()))
+        COMMAND_COUNTERS['timed out'] += 1
+        Debug('error', "CMD timed out after %.1fs: %s" % (self.get_execution_timeout(), self.command[0:100]))
 
     def on_execute(self):
         """ calls executing_callback using sublime.set_timeout """
         if self.executing_callback is not None:
             sublime.set_timeout(lambda: self.executing_callback(**self.callback_kwargs))
 
-    # ------------------------- debouncing helpers ---------------------------------- #
+    # ------------------------- scheduling helpers ---------------------------------- #
+
+    def get_priority_name(self):
+        return self.PRIORITY_NAMES[self.priority]
+
+    def kind(self):
+        """ Returns the tss.js command name, eg. 'completions' or 'update'. Used for metrics. """
+        return self.command.split(' ', 1)[0]
+
+    def deadline(self):
+        """ Latest time this command should be sent to tss.js. """
+        return self.time_last_bounce + self.debounce_time + self.PRIORITY_BUDGETS[self.priority]
+
+    def schedule_key(self):
+        """ Commands with smaller keys will be sent first: earliest deadline, then class, then age. """
+        return (self.deadline(), self.priority, self.time_queue)
 
-    def create_new_queue_trigger_command(self):
+    def make_stream(self, run=None):
         """
-            Creates an AsyncCommand instance which then can be added to queue without having any effect.
+            Returns a new JsonArrayStream for the answer if streaming is activated, otherwise None.
+            run(on_chunk, elements) calls on_chunk in another thread (eg. IOLoop.call_in_worker), None: directly.
         """
-        return AsyncCommand("!trigger!", self.project).set_id("trigger")
+        self.prepared_chunks = []
+        if not self.stream_answer:
+            self.stream = None
+        elif run is None:
+            self.stream = JsonArrayStream(self.on_chunk, self.stream_key)
+        else:
+            self.stream = JsonArrayStream(lambda elements: run(self.on_chunk, elements), self.stream_key)
+        return self.stream
+
+    def answer_size(self, tss_answer):
+        """ Returns the number of characters tss.js has sent for the raw or streamed answer. """
+        if self.stream is not None:
+            return self.stream.size
+        return len(tss_answer) if isinstance(tss_answer, str) else 0
+
+    def get_execution_timeout(self):
+        if self.execution_timeout is not None:
+            return self.execution_timeout
+        return self.PRIORITY_TIMEOUTS[self.priority]
 
-    def is_only_a_queue_trigger_command(self):
-        """ Returns True if this is a command without effect. """
-        return self.id == "trigger"
+    def time_until_timeout(self, time_sent):
+        """
+            Returns 0 or the seconds tss.js has left to answer this command, which has been sent at time_sent.
+            The adapter passes the time of its lane: time_execute is the time of the last lane.
+        """
+        return max(0, time_sent + self.get_execution_timeout() - time.time())
+
+    def is_idempotent(self):
+        """ Returns True if this command can be sent again. Only sync commands change tss.js. """
+        return self.priority != self.PRIORITY_SYNC
+
+    def is_long_running(self):
+        """ Returns True for classes which may block a tss.js process for seconds. """
+        return self.priority >= self.PRIORITY_NAVIGATION
+
+    # ------------------------- debouncing helpers ---------------------------------- #
 
     def can_be_executed_now(self):
         """ Returns False if debouncing is activated but timeout not finished. Otherwise True. """
@@ -0,0 +1,84 @@
+# coding=utf8
+
+import os
+
+
+MAX_VIEWS = 1024 # IOV_MAX of linux and osx, the most buffers one os.writev takes
+
+
+# ----------------------------------------- FRAMING ---------------------------------- #
+
+def make_frame(request_id, command, payload=None, framed=True):
+    """
+        Returns the list of byte buffers to send command (and the payload lines after it) to tss.js.
+        framed: "<byte length>\n#<request id> <command>\n<payload>" (tss.js --framed),
+        otherwise the line protocol "#<request id> <command>\n<payload>\n".
+        The payload (eg. the content of an update) is encoded once and never concatenated.
+    """
+    buffers = _command_buffers(request_id, command, payload)
+    if framed:
+        return _with_length(buffers)
+    buffers.append(b"\n")
+    return buffers
+
+
+def make_batch_frame(requests, framed=True):
+    """
+        Returns the list of byte buffers to send several [(request_id, command, payload)] in one
+        frame: "<byte length>\nbatch\n#<request id> <command>\n<payload>\n#<request id> ..".
+        tss.js answers with one frame "batch\n#<request id> <answer>\n#<request id> ..".
+        The line protocol has no batches, the commands are only written together.
+    """
+    if not framed:
+        return [b for request in requests for b in make_frame(*request, framed=False)]
+    buffers = [b"batch"]
+    for request_id, command, payload in requests:
+        buffers.append(b"\n")
+        buffers.extend(_command_buffers(request_id, command, payload))
+    return _with_length(buffers)
+
+
+def _command_buffers(request_id, command, payload):
+    buffers = [("#%i %s" % (request_id, command)).encode('UTF-8')]
+    if payload is not None:
+        buffers.append(b"\n")
+        buffers.append(payload.encode('UTF-8'))
+    return buffers
+
+
+def _with_length(buffers):
+    buffers.insert(0, ("%i\n" % sum(len(b) for b in buffers)).encode('UTF-8'))
+    return buffers
+
+
+def write_gathered(stream, buffers):
+    """ Writes buffers to the binary stream without joining them, with one system call if possible. """
+    if not hasattr(os, 'writev'): # windows
+        for b in buffers:
+            stream.write(b)
+        stream.flush()
+        return
+    stream.flush()
+    fd = stream.fileno()
+    views = [memoryview(b) for b in buffers]
+    while views:
+        views = write_some(fd, views)
+
+
+def write_some(fd, views):
+    """
+        Writes as much of the (first MAX_VIEWS) memoryviews as fd takes with one os.writev.
+        Returns the views which are left, continuing behind the written bytes.
+        A non-blocking fd which takes nothing returns all views.
+    """
+    try:
+        written = os.writev(fd, views[:MAX_VIEWS])
+    except BlockingIOError:
+        return views
+    # a pipe may take less than all
+    while views and written >= len(views[0]):
+        written -= len(views[0])
+        views.pop(0)
+    if views:
+        views[0] = views[0][written:]
+    return views
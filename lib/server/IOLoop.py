@@ -0,0 +1,183 @@
+# coding=utf8
+
+import os
+import time
+import heapq
+import select
+import itertools
+from queue import Queue
+from threading import Thread, Lock, current_thread
+from collections import deque
+
+from ..utils import Debug
+
+
+# ----------------------------------------- IO LOOP ---------------------------------- #
+
+class IOLoop(object):
+    """
+        One thread which reads the stdout pipes of all tss.js processes and runs the
+        adapters of all projects (see TssAdapterThread.attach_to_loop). So the number
+        of threads doesn't grow with the number of open projects.
+
+        Readers are registered with add_reader(fd, on_readable): on_readable() is called
+        when fd can be read without blocking, likewise add_writer(fd, on_writable) for the
+        stdin pipes which have output left (see TssLoopWriter). Other threads hand work to
+        the loop with call_soon(), which wakes the loop with a byte on a pipe. call_later() runs
+        a function after a delay, eg. the next debounce or execution timeout of an adapter.
+
+        The loop thread only does I/O and scheduling. call_in_worker() hands CPU bound work
+        (decoding and transforming the answers, see AsyncCommand.set_result_transform) to one
+        worker thread, which runs it in order, so a large answer doesn't delay the other projects.
+
+        Pipes can only be selected on posix systems. IOLoop.get() returns None on
+        windows, then every connection and adapter uses its own thread as before.
+    """
+
+    lock = Lock()
+    instance = None
+
+    @classmethod
+    def get(cls):
+        """ Returns the running loop (starts it on the first call) or None if pipes can't be selected. """
+        with cls.lock:
+            if cls.instance is None and os.name == 'posix':
+                cls.instance = IOLoop()
+                cls.instance.start()
+            return cls.instance
+
+    def __init__(self):
+        self.readers = {} # readers[fd] = on_readable()
+        self.writers = {} # writers[fd] = on_writable()
+        self.callbacks = deque() # (function, args) for the next round
+        self.timers = [] # heap of [time, sequence number, function, args], function None: cancelled
+        self.sequence = itertools.count()
+        self.callbacks_lock = Lock()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        import fcntl # posix only
+        flags = fcntl.fcntl(self.wakeup_write, fcntl.F_GETFL)
+        fcntl.fcntl(self.wakeup_write, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.thread = Thread(target=self.run, name='ArcticTypescript IOLoop')
+        self.thread.daemon = True
+        self.work = Queue() # (function, args) for the worker
+        self.worker = Thread(target=self.run_worker, name='ArcticTypescript IOLoop worker')
+        self.worker.daemon = True
+
+    def start(self):
+        self.thread.start()
+        self.worker.start()
+
+    def is_loop_thread(self):
+        return current_thread() is self.thread
+
+
+    # SCHEDULING (thread safe)
+    def call_soon(self, function, *args):
+        """ Runs function(*args) in the loop thread. """
+        with self.callbacks_lock:
+            self.callbacks.append((function, args))
+        if not self.is_loop_thread():
+            try:
+                os.write(self.wakeup_write, b'.')
+            except BlockingIOError:
+                pass # the pipe is full of wakeups already
+
+    def call_in_worker(self, function, *args):
+        """ Runs function(*args) in the worker thread, after the functions which have been handed over before. """
+        self.work.put((function, args))
+
+    def call_later(self, delay, function, *args):
+        """ Runs function(*args) in the loop thread after delay seconds. Returns a handle for cancel_timer(). """
+        timer = [time.time() + delay, next(self.sequence), function, args]
+        self.call_soon(heapq.heappush, self.timers, timer)
+        return timer
+
+    def cancel_timer(self, timer):
+        """ Only call this in the loop thread. """
+        timer[2] = None
+
+    def add_reader(self, fd, on_readable):
+        self.call_soon(self.readers.__setitem__, fd, on_readable)
+
+    def remove_reader(self, fd):
+        """ Only call this in the loop thread. """
+        self.readers.pop(fd, None)
+
+    def add_writer(self, fd, on_writable):
+        self.call_soon(self.writers.__setitem__, fd, on_writable)
+
+    def remove_writer(self, fd):
+        """ Only call this in the loop thread. """
+        self.writers.pop(fd, None)
+
+
+    # LOOP
+    def run(self):
+        """ Loop of the IOLoop thread. """
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                Debug('error', "IOLoop: %s" % e)
+
+    def run_worker(self):
+        """ Loop of the worker thread. """
+        while True:
+            (function, args) = self.work.get()
+            self._call(function, *args)
+
+    def run_once(self):
+        fds = list(self.readers) + [self.wakeup_read]
+        try:
+            readable, writable, _ = select.select(fds, list(self.writers), [], self.time_until_next_timer())
+        except (OSError, ValueError):
+            self._remove_closed_fds()
+            return
+
+        for fd in writable:
+            if fd in self.writers:
+                self._call(self.writers[fd])
+        for fd in readable:
+            if fd == self.wakeup_read:
+                os.read(self.wakeup_read, 4096)
+            elif fd in self.readers:
+                self._call(self.readers[fd])
+
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            (when, sequence, function, args) = heapq.heappop(self.timers)
+            if function is not None:
+                self._call(function, *args)
+
+        with self.callbacks_lock:
+            callbacks = self.callbacks
+            self.callbacks = deque()
+        for function, args in callbacks:
+            self._call(function, *args)
+
+    def time_until_next_timer(self):
+        """ Returns the timeout for select(): 0 if there is work, None if there is nothing to wait for. """
+        if self.callbacks:
+            return 0
+        while self.timers and self.timers[0][2] is None:
+            heapq.heappop(self.timers)
+        if not self.timers:
+            return None
+        return max(0, self.timers[0][0] - time.time())
+
+    def _remove_closed_fds(self):
+        for fds, remove in ((self.readers, 'remove_reader'), (self.writers, 'remove_writer')):
+            for fd in list(fds):
+                try:
+                    os.fstat(fd)
+                except OSError:
+                    Debug('tss+', "IOLoop: fd %i has been closed without %s()" % (fd, remove))
+                    del fds[fd]
+
+    def _call(self, function, *args):
+        """ A failing reader or adapter must not stop the loop of all projects. """
+        try:
+            function(*args)
+        except Exception as e:
+            Debug('error', "IOLoop: %s failed: %s" % (getattr(function, '__name__', function), e))
+
@@ -0,0 +1,171 @@
+# coding=utf8
+
+import json
+import math
+import time
+from collections import deque, Counter, OrderedDict
+from threading import Lock
+
+
+# ----------------------------------------- HISTOGRAM ---------------------------------- #
+
+class Histogram(object):
+    """
+        Durations in seconds. Count, sum and maximum cover all samples,
+        the percentiles are calculated from the last MAX_SAMPLES samples.
+    """
+
+    MAX_SAMPLES = 1024
+
+    def __init__(self):
+        self.samples = deque(maxlen=self.MAX_SAMPLES)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p, ordered=None):
+        """ Returns the sample below which p percent of the samples are (nearest rank) or None. """
+        if ordered is None:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        rank = int(math.ceil(p / 100.0 * len(ordered)))
+        return ordered[max(0, min(len(ordered), rank) - 1)]
+
+    def summary(self, percentiles):
+        """ Returns {'count', 'mean', 'max', 'p<n>' for n in percentiles}, the times in milliseconds. """
+        ordered = sorted(self.samples)
+        summary = {'count': self.count,
+                   'mean': 1000 * self.total / self.count if self.count else 0,
+                   'max': 1000 * self.max}
+        for p in percentiles:
+            value = self.percentile(p, ordered)
+            summary['p%i' % p] = 1000 * value if value is not None else 0
+        return summary
+
+
+# ----------------------------------------- METRICS REGISTRY ---------------------------------- #
+
+class MetricsRegistry(object):
+    """
+        Collects how long commands wait and execute, how deep the queues get and
+        how many bytes are sent, for comparing tss.js versions and settings.
+
+        - histograms, keyed by (name, command kind, lane), eg. ('queue wait', 'completions', 'fast0')
+        - gauges, keyed by (name, lane), remember the current and the maximal value
+        - counters, keyed by (name, command kind, lane), eg. ('replaced', 'update', 'slow')
+        - sources: functions which return a dict of counters kept elsewhere
+          (eg. COMMAND_COUNTERS or cache statistics). They are called by snapshot().
+
+        The command kind is the first word of a command, the lane is the process
+        ('slow' or 'fast<n>', see TssJsStarterThread). The byte counters count the characters
+        of commands and answers, which is the number of bytes for ASCII text.
+        Thread safe, imports no sublime modules.
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self):
+        self.lock = Lock()
+        self.sources = OrderedDict() # sources[name] = function returning a dict
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {} # histograms[(name, kind, lane)] = Histogram
+            self.gauges = {} # gauges[(name, lane)] = [current value, maximal value]
+            self.counters = Counter() # counters[(name, kind, lane)]
+            self.started = time.time()
+
+
+    # RECORDING
+    def observe(self, name, kind, lane, seconds):
+        with self.lock:
+            histogram = self.histograms.get((name, kind, lane))
+            if histogram is None:
+                histogram = self.histograms[(name, kind, lane)] = Histogram()
+            histogram.add(seconds)
+
+    def set_gauge(self, name, lane, value):
+        with self.lock:
+            gauge = self.gauges.get((name, lane))
+            if gauge is None:
+                self.gauges[(name, lane)] = [value, value]
+            else:
+                gauge[0] = value
+                gauge[1] = max(gauge[1], value)
+
+    def count(self, name, kind='', lane='', n=1):
+        with self.lock:
+            self.counters[(name, kind, lane)] += n
+
+    def add_source(self, name, function):
+        """ function() returns a dict of numbers which is added to every snapshot as sources[name]. """
+        self.sources[name] = function
+
+
+    # READING
+    def snapshot(self):
+        """ Returns all metrics as dict of lists, which can be dumped to JSON. Times are in milliseconds. """
+        with self.lock:
+            histograms = [dict(h.summary(self.PERCENTILES), name=name, kind=kind, lane=lane)
+                          for (name, kind, lane), h in sorted(self.histograms.items())]
+            gauges = [{'name': name, 'lane': lane, 'value': value, 'max': maximum}
+                      for (name, lane), (value, maximum) in sorted(self.gauges.items())]
+            counters = [{'name': name, 'kind': kind, 'lane': lane, 'value': value}
+                        for (name, kind, lane), value in sorted(self.counters.items())]
+            uptime = time.time() - self.started
+        sources = {}
+        for name, function in list(self.sources.items()):
+            try:
+                sources[name] = dict(function())
+            except Exception as e:
+                sources[name] = {'error': str(e)}
+        return {'time': time.time(),
+                'uptime': uptime,
+                'histograms': histograms,
+                'gauges': gauges,
+                'counters': counters,
+                'sources': sources}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def dump(self, path):
+        """ Writes the snapshot as JSON to path. """
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+    def report(self):
+        """ Returns the snapshot as text tables. """
+        snapshot = self.snapshot()
+        lines = ["ArcticTypescript metrics of the last %.0fs (times in ms)" % snapshot['uptime'], ""]
+
+        columns = ['p%i' % p for p in self.PERCENTILES]
+        lines.append("%-12s %-22s %-6s %7s %9s %s %9s"
+                     % (('histogram', 'command', 'lane', 'count', 'mean')
+                        + (' '.join('%9s' % c for c in columns), 'max')))
+        for h in snapshot['histograms']:
+            lines.append("%-12s %-22s %-6s %7i %9.1f %s %9.1f"
+                         % (h['name'], h['kind'], h['lane'], h['count'], h['mean'],
+                            ' '.join('%9.1f' % h[c] for c in columns), h['max']))
+
+        lines += ["", "%-24s %-6s %9s %9s" % ('gauge', 'lane', 'current', 'max')]
+        for g in snapshot['gauges']:
+            lines.append("%-24s %-6s %9i %9i" % (g['name'], g['lane'], g['value'], g['max']))
+
+        lines += ["", "%-24s %-22s %-6s %12s" % ('counter', 'command', 'lane', 'value')]
+        for c in snapshot['counters']:
+            lines.append("%-24s %-22s %-6s %12i" % (c['name'], c['kind'], c['lane'], c['value']))
+
+        for name, values in sorted(snapshot['sources'].items()):
+            lines += ["", name]
+            for key, value in sorted(values.items()):
+                lines.append("  %-22s %s" % (key, value))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,134 @@
+# coding=utf8
+
+import heapq
+import itertools
+import time
+
+
+# ----------------------------------------- MIDDLEWARE QUEUE ---------------------------------- #
+
+class MiddlewareQueue(object):
+    """
+        The middleware queue of the TssAdapterThread.
+        Holds AsyncCommand instances which have not been sent to tss.js yet.
+
+        Commands are indexed by their id for merging, executable commands are
+        kept in two heaps ordered by AsyncCommand.schedule_key() (one for long
+        running commands, one for all others) and debouncing commands are kept
+        in a heap ordered by the time they can be executed. So append, remove
+        and pop_next have a constant or logarithmic cost per command, even with
+        thousands of pending commands.
+
+        Heap entries are deleted lazily: remove() only forgets the entry, it will
+        be skipped as soon as it reaches the top of its heap.
+        Keys only grow (debouncing postpones, it never brings forward), so entries
+        with outdated keys are pushed again with their current key when they reach the top.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.by_id = {} # by_id[command id] = [commands], from old to new
+        self.entries = {} # entries[command] = sequence number of its heap entry
+        self.ready = [] # (schedule_key, seq, command) of executable, short running commands
+        self.ready_long_running = [] # (schedule_key, seq, command) of executable, long running commands
+        self.debouncing = [] # (time when executable, seq, command)
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, command):
+        return command in self.entries
+
+    def __iter__(self):
+        """ Iterates over all pending commands, not in any particular order. """
+        return iter(list(self.entries.keys()))
+
+
+    def append(self, command):
+        seq = next(self.sequence)
+        self.entries[command] = seq
+        self.by_id.setdefault(command.id, []).append(command)
+        self._push(command, seq)
+
+    def remove(self, command):
+        """ Removes command. Its heap entry will be dropped lazily. """
+        del self.entries[command]
+        same_id = self.by_id[command.id]
+        same_id.remove(command)
+        if not same_id:
+            del self.by_id[command.id]
+
+    def with_id(self, _id):
+        """ Returns all pending commands with id _id, from old to new. """
+        return list(self.by_id.get(_id, []))
+
+
+    def pop_next(self, slot_is_free=True, long_running_allowed=True):
+        """
+            Pops the executable command with the smallest schedule_key().
+            Long running commands are only considered if long_running_allowed.
+            Returns (command or None, is_waiting). is_waiting is True if there is an
+            executable command which has not been returned because of the given limits.
+        """
+        self._promote_executable_debouncing_commands()
+        short = self._top(self.ready)
+        long_running = self._top(self.ready_long_running)
+
+        if not slot_is_free:
+            return None, (short is not None or long_running is not None)
+
+        is_waiting = long_running is not None and not long_running_allowed
+        if not long_running_allowed:
+            long_running = None
+
+        if short is None and long_running is None:
+            return None, is_waiting
+
+        if long_running is None or (short is not None and short < long_running):
+            heap = self.ready
+        else:
+            heap = self.ready_long_running
+        key, seq, command = heapq.heappop(heap)
+        self.remove(command)
+        return command, is_waiting
+
+    def time_until_next_execution(self):
+        """ Returns the seconds until the next debouncing command can be executed or None. """
+        while self.debouncing:
+            when, seq, command = self.debouncing[0]
+            if self.entries.get(command) != seq:
+                heapq.heappop(self.debouncing)
+                continue
+            return max(0, when - time.time())
+        return None
+
+
+    def _push(self, command, seq):
+        if command.can_be_executed_now():
+            heap = self.ready_long_running if command.is_long_running() else self.ready
+            heapq.heappush(heap, (command.schedule_key(), seq, command))
+        else:
+            heapq.heappush(self.debouncing, (time.time() + command.time_until_execution(), seq, command))
+
+    def _promote_executable_debouncing_commands(self):
+        now = time.time()
+        while self.debouncing and self.debouncing[0][0] <= now:
+            when, seq, command = heapq.heappop(self.debouncing)
+            if self.entries.get(command) == seq:
+                self._push(command, seq)
+
+    def _top(self, heap):
+        """ Drops removed and outdated entries and returns the top entry of heap or None. """
+        while heap:
+            key, seq, command = heap[0]
+            if self.entries.get(command) != seq:
+                heapq.heappop(heap)
+            elif not command.can_be_executed_now() or command.schedule_key() != key:
+                heapq.heappop(heap)
+                self._push(command, seq)
+            else:
+                return heap[0]
+        return None
@@ -1,7 +1,8 @@
 # coding=utf8
 
 from subprocess import Popen, PIPE
-from threading import Thread
+from threading import Thread, Lock, Event
+from collections import OrderedDict
 try:
     from queue import Queue, Empty
 except ImportError:
@@ -9,81 +10,170 @@ except ImportError:
 
 import sublime
 import os
+import re
 import time
+import codecs
+import itertools
+import multiprocessing
 
 from ..display.Message import MESSAGE
 
-from ..utils import encode, Debug
+from ..utils import get_deep, Debug
 from ..utils.pathutils import get_tss_path, find_tsconfigdir, default_node_path
+from ..utils.fileutils import fn2l
 from ..utils.osutils import get_kwargs
+from ..utils.CancelCommand import CancelCommand
 from ..utils.disabling import set_plugin_temporarily_disabled
 
+from ..system.globals import TSS_HOSTS, WARM_TSS_HOSTS, METRICS
+
+from .MiddlewareQueue import MiddlewareQueue
+from .Framing import make_frame, make_batch_frame, write_gathered, write_some
+from .IOLoop import IOLoop
+from .Recorder import CommandRecorder, recording_path
+
 
 #    PROCESSES = global Processes() instance
 #     |
-#     |_____has 2 TssJsStarterProcess
-#     |     (1 for slow and 1 for fast commands)
+#     |_____has 1 + N TssJsStarterProcess
+#     |     (1 for slow commands and a pool of N query workers for fast commands)
 #     |     for each project root
 #     |
-#    TssJsStarterThread()------->starts>         tss.js
-#           |               |                      | | stdin stdout pipes
+#    TssJsStarterThread()------->starts>         tss.js (or attaches to a shared TssHost)
+#           |               |                      | | stdin stdout pipes = TssConnection
 #           |               ---->starts>         TssAdapterThread (does debouncing and command reordering)
+#           |                                      | |  writes "#<request id> [@<project id> ]<command>"
 #           |                                      | |
+#           |                                    TssReaderThread (routes "#<request id> <answer>"
+#           |                                      | |               back to the in-flight command)
 #           --sending AsyncCommand() instances---->| |----> sublime.set_timeout(async_command.callback)
 #               via synchronized Queue.Queue
+#
+#    On posix systems, the adapters and readers of all projects are no threads:
+#    they run in the one IOLoop thread, which reads all tss.js pipes (see IOLoop).
 
 
 # ----------------------------------------- PROCESSES ---------------------------------------- #
 
 class Processes(object):
     """
-        Keeps two tss.js Processes and adapters for each project root.
+        Keeps the tss.js Processes and adapters for each project root.
         Process SLOW is for slow commands like tss>errors which can last more than 5s easily.
-        Process FAST is for fast reacting commands eg. for autocompletion or type.
+        The FAST query workers are for fast reacting commands eg. for autocompletion or type.
+        File updates are sent to every process, queries to the least loaded worker.
+        If the setting record_tss_commands is a path, the commands of all processes
+        are recorded there (see CommandRecorder).
     """
 
+    # upper limit for the automatically chosen number of query workers
+    MAX_AUTO_WORKERS = 4
+    # one additional query worker per FILES_PER_WORKER files in tsconfig.json
+    FILES_PER_WORKER = 500
+
     def __init__(self, project):
-        """ starts the two processes """
+        """ starts the processes """
         self.project = project
         self.slow = None
-        self.fast = None
+        self.workers = []
+        self.recorder = self._open_recorder()
         self.start_tss_processes()
 
 
+    def all(self):
+        """ Returns the SLOW process and all query workers. """
+        return [self.slow] + self.workers
+
+
     def is_initialized(self):
-        """ Returns True if both processes (SLOW and FAST) have been started. """
-        return self.slow.started and self.fast.started
+        """ Returns True if all processes (SLOW and query workers) have been started. """
+        return all(p.started for p in self.all())
 
     def get_initialisation_error_message(self):
         """ Returns Errormessage if initializing has failed, otherwise false"""
-        if self.slow.error:
-            return self.slow.error
-        if self.fast.error:
-            return self.fast.error
+        for p in self.all():
+            if p.error:
+                return p.error
         return False
 
+    def least_loaded_worker(self):
+        """ Returns the query worker with the fewest pending commands. """
+        return min(self.workers, key=lambda w: w.load())
+
     def start_tss_processes(self):
         """
-            Start tss.js (2 times).
+            Start tss.js (1 + number_of_query_workers() times).
             Displays message to user while starting and calls project.on_services_started() afterwards
         """
-        Debug('notify', 'starting tsserver ' + self.project.tsconfigfile)
-        self.slow = TssJsStarterThread(self.project)
+        worker_count = self.number_of_query_workers()
+        Debug('notify', 'starting tsserver with %i query workers: %s' % (worker_count, self.project.tsconfigfile))
+        self.slow = TssJsStarterThread(self.project, 'slow', self.recorder)
         self.slow.start()
 
-        self.fast = TssJsStarterThread(self.project)
-        self.fast.start()
+        for i in range(worker_count):
+            worker = TssJsStarterThread(self.project, 'fast%i' % i, self.recorder)
+            worker.start()
+            self.workers.append(worker)
+
+        # boot processes for the next project while the user works on this one
+        TssWarmPool.refill(default_node_path(self.project.get_setting('node_path')),
+                           self.project.get_setting('warm_tss_processes'))
 
         self._wait_for_finish_and_notify_user()
 
+    def number_of_query_workers(self):
+        """
+            Returns the setting query_workers or, if not set, a size chosen
+            from the cpu count and the number of files in tsconfig.json.
+            One worker if tsconfig.json can't be read.
+        """
+        configured = self.project.get_setting('query_workers')
+        if configured:
+            return max(1, int(configured))
+
+        try:
+            cpus = multiprocessing.cpu_count()
+        except NotImplementedError:
+            cpus = 2
+        try:
+            files = len(get_deep(self.project._get_tsconfigsettings(), 'files'))
+        except KeyError:
+            files = 0
+        except CancelCommand:
+            Debug('tss', "Could not read tsconfig.json, starting one query worker")
+            return 1
+
+        # the SLOW process and sublime itself need a cpu, too
+        by_cpus = max(1, cpus - 2)
+        by_files = 1 + files // self.FILES_PER_WORKER
+        return max(1, min(by_cpus, by_files, self.MAX_AUTO_WORKERS))
+
     def kill(self):
         """ Trigger killing of adapter, tss.js and queue. """
 
-        Debug('tss+', "Killing tss.js process and adapter thread (for slow and fast lane) (Closing project %s)"
-                 % self.project.tsconfigfile)
-        self.slow.kill_tssjs_queue_and_adapter()
-        self.fast.kill_tssjs_queue_and_adapter()
+        Debug('tss+', "Killing tss.js processes and adapter threads (for slow lane and %i query workers) (Closing project %s)"
+                 % (len(self.workers), self.project.tsconfigfile))
+        for p in self.all():
+            p.kill_tssjs_queue_and_adapter()
+        if self.recorder is not None:
+            self.recorder.close()
 
+    def _open_recorder(self):
+        """
+            Returns a CommandRecorder if the setting record_tss_commands is set, otherwise None.
+            The name of the project is inserted into the file name, see recording_path().
+        """
+        path = self.project.get_setting('record_tss_commands')
+        if not path:
+            return None
+        project_dir = os.path.abspath(self.project.tsconfigdir)
+        path = recording_path(os.path.expanduser(path), project_dir)
+        try:
+            recorder = CommandRecorder(path, project_dir)
+        except (OSError, IOError) as e:
+            Debug('error', "Could not record the tss.js commands to %s: %s" % (path, e))
+            return None
+        Debug('notify', "Recording tss.js commands to %s" % path)
+        return recorder
 
 
     def _wait_for_finish_and_notify_user(self, i=1, dir=-1):
@@ -125,13 +215,31 @@ class TssJsStarterThread(Thread):
             * started
         for communication with the started Adapter and therewith the tss.js script.
 
+        If the setting shared_tss_host is enabled, no own tss.js process will be started.
+        The adapter then talks to the project inside of a shared TssHost for this lane.
+        Otherwise a booted process from the TssWarmPool is adopted, if there is one.
+
+        This class supervises the process: if tss.js dies, the adapter calls
+        restart_process() and on_recovered() (see TssAdapterThread.recover).
+
         tss.js from: https://github.com/clausreinke/typescript-tools
     """
-    def __init__(self, project):
-        """ init for project <project> """
+
+    # give up restarting if tss.js dies more often within RESTART_WINDOW seconds
+    MAX_RESTARTS = 3
+    RESTART_WINDOW = 60
+
+    def __init__(self, project, lane, recorder=None):
+        """ init for project <project>, lane is 'slow' or 'fast<n>', recorder: CommandRecorder or None """
         self.project = project
+        self.lane = lane
+        self.recorder = recorder
         self.started = False
         self.error = False
+        self.host = None
+        self.restart_times = []
+        self.tss_adapter = None
+        self.died_during_start = False # tss.js has died before the adapter existed
         Thread.__init__(self)
 
 
@@ -139,50 +247,136 @@ class TssJsStarterThread(Thread):
         """
             Starts the tss.js typescript services server process and the adapter thread.
         """
+        self._connect()
+        if self.error:
+            return
 
-        node_path, cwd, cmdline = self._make_commandline()
-        kwargs = get_kwargs(stderr=False)
+        self.check_process_health()
 
-        try:
-            self.tss_process = Popen(cmdline,
-                                     stdin=PIPE, stdout=PIPE, stderr=PIPE,
-                                     cwd=cwd, **kwargs)
-
-            Debug('tss', 'STARTED tss with: %s' % ' '.join(cmdline))
-
-        except PermissionError as e:
-            self.error = "\n".join(["PermissionError while starting typescript-tools.",
-                    "I have tried this path: >%s<" % node_path,
-                    "The total command is >%s<" % ' '.join(cmdline),
-                    "The error message is >%s<" % e,
-                    "If you are on windows and just have installed node, you first need to logout and login again."])
+        self.tss_queue = Queue()
+        self.tss_adapter = TssAdapterThread(self.connection,
+                                              self.tss_queue,
+                                              self.command_prefix,
+                                              supervisor=self,
+                                              recorder=self.recorder)
+        loop = IOLoop.get()
+        if loop is not None:
+            self.tss_adapter.attach_to_loop(loop)
+        else:
+            self.tss_adapter.daemon = True
+            self.tss_adapter.start()
+        if self.died_during_start:
+            self.tss_adapter.put("died!")
+
+        self.started = True
+
+
+    def _connect(self):
+        """ Sets self.connection and self.command_prefix or self.error. """
+        if self.project.get_setting('shared_tss_host'):
+            self._attach_to_host()
+        elif not self._adopt_warm_host():
+            self._start_own_process()
+        if not self.error:
+            self.connection.died_callbacks.append(self._on_process_died)
+
+
+    def _on_process_died(self):
+        """ Called by the reader. The adapter will restart tss.js (as soon as it exists). """
+        if self.tss_adapter is None:
+            self.died_during_start = True
             return
-        except FileNotFoundError:
-            self.error = "\n".join(["Could not find nodejs.",
-                    "I have tried this path: %s" % node_path,
-                    "Please install nodejs and/or set node_path in the project or plugin settings to the actual executable.",
-                    "If you are on windows and just have installed node, you first need to logout and login again."])
+        self.tss_adapter.put("died!")
+
+
+    def restart_process(self):
+        """
+            Called by the adapter after tss.js has died, never in the IOLoop thread.
+            Starts a new process. Returns (connection, command_prefix) or (None, None).
+        """
+        now = time.time()
+        self.restart_times = [t for t in self.restart_times if now - t < self.RESTART_WINDOW]
+        if len(self.restart_times) >= self.MAX_RESTARTS:
+            Debug('error', "tss.js (%s) has died %i times within %is. Giving up. Please reload the project."
+                            % (self.lane, len(self.restart_times) + 1, self.RESTART_WINDOW))
+            return None, None
+        self.restart_times.append(now)
+
+        Debug('notify', "tss.js (%s) has died. Restarting it: %s" % (self.lane, self.project.tsconfigfile))
+        self._disconnect()
+        self.host = None
+        self._connect()
+        if self.error:
+            Debug('error', "Could not restart tss.js (%s): %s" % (self.lane, self.error))
+            return None, None
+        return self.connection, self.command_prefix
+
+
+    def on_recovered(self, seconds, reissued_count):
+        """ Called by the adapter after the buffers have been replayed to the new process. """
+        Debug('notify', "tss.js (%s) recovered in %.2fs, %i queries reissued" % (self.lane, seconds, reissued_count))
+        sublime.set_timeout(lambda: MESSAGE.show('Typescript services recovered from a crash in %.1fs' % seconds, True), 0)
+
+
+    def owns_process(self):
+        """
+            Returns True if tss.js serves only this project, so the adapter may kill it if it hangs.
+            A warm process adopted for this project alone is owned, a shared host is not.
+        """
+        return self.host is None or not self.host.is_shared
+
+
+    def leave_hung_process(self):
+        """
+            Called by the adapter instead of killing a hung shared host. No project attaches to it anymore,
+            so restart_process() attaches to a new one. The hung host is killed with its last project.
+        """
+        self.host.forsake()
+
+
+    def _start_own_process(self):
+        node_path, cwd, cmdline = self._make_commandline()
+
+        tss_process, self.error = start_tss_process(node_path, cmdline, cwd)
+        if self.error:
             return
-        except Exception as e:
-            self.error = "Unexpected Error while starting typescript-tools."
-            print(e)
+
+        first_out = read_first_message(tss_process.stdout)
+        Debug('tss', 'FIRST TSS MESSAGE: %s' % first_out)
+
+        self.connection = TssConnection(tss_process)
+        self.connection.start()
+        self.command_prefix = ''
+
+
+    def _attach_to_host(self):
+        node_path = default_node_path(self.project.get_setting('node_path'))
+        self.host, self.error = TssHost.attach(node_path, self.lane)
+        if self.error:
             return
+        self._open_project_in_host()
 
 
-        first_out = self.tss_process.stdout.readline()
-        Debug('tss', 'FIRST TSS MESSAGE: %s' % first_out)
+    def _adopt_warm_host(self):
+        """ Takes a process from the TssWarmPool. Returns False if the pool is empty. """
+        node_path = default_node_path(self.project.get_setting('node_path'))
+        self.host = TssWarmPool.take(node_path)
+        if self.host is None:
+            return False
+        Debug('tss+', "ADOPTED warm tss.js process for %s" % self.lane)
+        self._open_project_in_host()
+        return True
 
-        self.check_process_health()
 
-        self.tss_queue = Queue()
-        self.tss_adapter = TssAdapterThread(self.tss_process.stdin,
-                                              self.tss_process.stdout,
-                                              self.tss_queue,
-                                              self.check_process_health)
-        self.tss_adapter.daemon = True
-        self.tss_adapter.start()
+    def _open_project_in_host(self):
+        """ Points the host at tsconfig.json of this project. """
+        self.connection = self.host.connection
+        self.command_prefix = '@%s ' % self.project.id
 
-        self.started = True
+        first_out = self.connection.request('open %s %s' % (self.project.id, fn2l(self.project.tsconfigdir)))
+        Debug('tss', 'FIRST TSS MESSAGE (host %s): %s' % (self.lane, first_out))
+        if 'TSS project error' in first_out:
+            self.error = "typescript-tools could not open the project: %s" % first_out
 
 
     def _make_commandline(self):
@@ -200,15 +394,350 @@ class TssJsStarterThread(Thread):
         return node_path, cwd, cmdline
 
     def send_async_command(self, async_command):
-        """ Send a AsyncCommand() instance to the adapter thread. """
-        self.tss_queue.put(async_command);
+        """ Send a AsyncCommand() instance to the adapter. """
+        self.tss_adapter.put(async_command)
+
+    def load(self):
+        """ Returns the number of commands queued, debouncing or in flight. """
+        if not self.started:
+            return 0
+        return self.tss_queue.qsize() \
+                + len(self.tss_adapter.middleware_queue) \
+                + len(self.tss_adapter.in_flight)
 
     def kill_tssjs_queue_and_adapter(self):
         """
             Tells adapter to leave syncronized queue and to finish
             and kills the tss.js process.
+            A shared host only forgets this project and will be killed with its last project.
+            An adopted warm process is killed, too: it is not returned to the pool.
         """
-        self.tss_queue.put("stop!") # setinel value to stop queue
+        if not self.started:
+            return
+        self.tss_adapter.put("stop!") # setinel value to stop queue
+        self._disconnect()
+
+    def _disconnect(self):
+        """ Leaves the process. A shared host must not call back a detached project when it dies. """
+        if self._on_process_died in self.connection.died_callbacks:
+            self.connection.died_callbacks.remove(self._on_process_died)
+        if self.host is not None:
+            try:
+                self.connection.send(self.connection.next_request_id(),
+                                     'close %s' % self.project.id)
+            except Exception as e:
+                Debug('tss++', "ERROR: %s" % e)
+            self.host.detach()
+        else:
+            self.connection.close()
+
+    def check_process_health(self):
+        self.connection.check_process_health()
+
+
+# Commands and answers are sent as "<byte length>\n<payload>" (tss.js --framed).
+# Set to False to debug tss.js with the line protocol.
+FRAMED_PROTOCOL = True
+
+def start_tss_process(node_path, cmdline, cwd):
+    """ Starts tss.js. Returns (process, False) or (None, error message) """
+    kwargs = get_kwargs(stderr=False)
+    if FRAMED_PROTOCOL:
+        cmdline = cmdline + ["--framed"]
+
+    try:
+        tss_process = Popen(cmdline,
+                            stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                            cwd=cwd, **kwargs)
+
+        Debug('tss', 'STARTED tss with: %s' % ' '.join(cmdline))
+        return tss_process, False
+
+    except PermissionError as e:
+        return None, "\n".join(["PermissionError while starting typescript-tools.",
+                "I have tried this path: >%s<" % node_path,
+                "The total command is >%s<" % ' '.join(cmdline),
+                "The error message is >%s<" % e,
+                "If you are on windows and just have installed node, you first need to logout and login again."])
+    except FileNotFoundError:
+        return None, "\n".join(["Could not find nodejs.",
+                "I have tried this path: %s" % node_path,
+                "Please install nodejs and/or set node_path in the project or plugin settings to the actual executable.",
+                "If you are on windows and just have installed node, you first need to logout and login again."])
+    except Exception as e:
+        print(e)
+        return None, "Unexpected Error while starting typescript-tools."
+
+
+def read_first_message(stdout):
+    """ Reads the startup message of tss.js (blocking). Returns b'' if tss.js has exited. """
+    first_out = stdout.readline()
+    if FRAMED_PROTOCOL and first_out.strip().isdigit():
+        first_out = stdout.read(int(first_out))
+    return first_out
+
+
+# ----------------------------------------- SHARED HOST -------------------- #
+
+class TssHost(object):
+    """
+        One "tss.js --host" process which serves the projects of all
+        OpenedProjects for one lane (eg. 'slow' or 'fast0').
+        The default lib is parsed only once per host and shared
+        between the language services of its projects.
+        Use TssHost.attach() and detach(). The process is killed on the last detach().
+        A new host is taken from the TssWarmPool if possible.
+    """
+
+    lock = Lock()
+
+    @classmethod
+    def attach(cls, node_path, lane):
+        """ Returns (host, False) or (None, error message) """
+        with cls.lock:
+            key = (node_path, lane)
+            if key in TSS_HOSTS and not TSS_HOSTS[key].is_alive():
+                del TSS_HOSTS[key] # has died, the attached projects will restart it
+            if key not in TSS_HOSTS:
+                host = TssWarmPool.take(node_path)
+                if host is None:
+                    host = TssHost(node_path, lane)
+                    if host.error:
+                        return None, host.error
+                host.key = key
+                host.users = 0
+                host.is_shared = True
+                TSS_HOSTS[key] = host
+            host = TSS_HOSTS[key]
+            host.users += 1
+            Debug('tss+', "ATTACHED to shared host %s (%i projects)" % (lane, host.users))
+            return host, False
+
+    def __init__(self, node_path, lane):
+        self.key = (node_path, lane)
+        self.users = 0
+        self.is_shared = False # True if it is attached to, False if it serves one project (see TssWarmPool)
+
+        tss_path = get_tss_path()
+        cmdline = [node_path, tss_path, "--host"]
+        tss_process, self.error = start_tss_process(node_path, cmdline, os.path.dirname(tss_path))
+        if self.error:
+            return
+
+        first_out = read_first_message(tss_process.stdout)
+        Debug('tss', 'FIRST TSS MESSAGE (shared host %s): %s' % (lane, first_out))
+
+        self.connection = TssConnection(tss_process)
+        self.connection.start()
+
+    def is_alive(self):
+        return self.connection.tss_process.poll() is None
+
+    def forsake(self):
+        """ Lets the next attach() start a new host. The attached projects can still detach. """
+        with self.lock:
+            if TSS_HOSTS.get(self.key) is self:
+                del TSS_HOSTS[self.key]
+
+    def detach(self):
+        with self.lock:
+            self.users -= 1
+            Debug('tss+', "DETACHED from shared host %s (%i projects)" % (self.key[1], self.users))
+            if self.users <= 0:
+                if TSS_HOSTS.get(self.key) is self:
+                    del TSS_HOSTS[self.key]
+                self.connection.close()
+
+
+# ----------------------------------------- WARM POOL -------------------- #
+
+class TssWarmPool(object):
+    """
+        Keeps booted "tss.js --host" processes (TssHost) without any project:
+        typescript.js is loaded and the default lib is parsed.
+        A new project adopts one of them with "open <project id> <tsconfig dir>"
+        instead of waiting for node. The pool is refilled in the background.
+        The size is the setting warm_tss_processes, per node_path.
+    """
+
+    lock = Lock()
+    refilling = set() # node_paths with a running refill thread
+
+    @classmethod
+    def take(cls, node_path):
+        """ Returns a booted TssHost with one user or None if the pool is empty. """
+        with cls.lock:
+            hosts = WARM_TSS_HOSTS.get(node_path, [])
+            while hosts:
+                host = hosts.pop(0)
+                if host.is_alive():
+                    host.users = 1
+                    return host
+        return None
+
+    @classmethod
+    def refill(cls, node_path, size):
+        """ Boots processes in a background thread until the pool for node_path has size processes. """
+        if not size or size <= 0:
+            return
+        with cls.lock:
+            if node_path in cls.refilling:
+                return
+            cls.refilling.add(node_path)
+        refill_thread = Thread(target=cls._refill, args=(node_path, size))
+        refill_thread.daemon = True
+        refill_thread.start()
+
+    @classmethod
+    def _refill(cls, node_path, size):
+        try:
+            while len(WARM_TSS_HOSTS.get(node_path, [])) < size:
+                host = TssHost(node_path, 'warm')
+                if host.error:
+                    Debug('tss', "Could not boot a warm tss.js process: %s" % host.error)
+                    return
+                with cls.lock:
+                    WARM_TSS_HOSTS.setdefault(node_path, []).append(host)
+                Debug('tss+', "BOOTED warm tss.js process (%i in pool)" % len(WARM_TSS_HOSTS[node_path]))
+        finally:
+            with cls.lock:
+                cls.refilling.discard(node_path)
+
+    @classmethod
+    def kill(cls):
+        """ Kills all processes in the pool. """
+        with cls.lock:
+            for hosts in WARM_TSS_HOSTS.values():
+                for host in hosts:
+                    host.connection.close()
+            WARM_TSS_HOSTS.clear()
+
+
+# ----------------------------------------- CONNECTION -------------------- #
+
+class TssConnection(object):
+    """
+        stdin and stdout of one tss.js process.
+        Every command is tagged with a request id ("#<id> <command>"). tss.js answers
+        with the same tag, so the answer can be routed to the on_answer function
+        which has been registered with send(). Several adapters may share one connection.
+        If tss.js dies unexpectedly, all functions in died_callbacks are called.
+        The answer of a command which has been sent with a stream (eg. JsonArrayStream) is fed
+        into the stream while it arrives, on_answer then gets the result of stream.finish().
+
+        With FRAMED_PROTOCOL, the command and its payload (eg. the content of an update)
+        are sent as one frame with a single gathered write (os.writev). So a large payload is
+        only encoded once and never concatenated with the command.
+        In the IOLoop, a TssLoopWriter writes without blocking: tss.js doesn't read while it
+        writes a large answer, which only the loop thread reads.
+    """
+
+    request_ids = itertools.count(1)
+
+    def __init__(self, tss_process):
+        self.tss_process = tss_process
+        self.stdin = tss_process.stdin
+        self.write_lock = Lock()
+        self.pending = {} # pending[request_id] = on_answer(answer)
+        self.streams = {} # streams[request_id] = stream for the answer
+        self.pending_lock = Lock()
+        self.is_closing = False
+        self.died_callbacks = []
+        loop = IOLoop.get()
+        self.writer = None
+        if loop is not None:
+            self.reader = TssLoopReader(loop, tss_process.stdout, self.on_answer, self.on_reader_closed, self.pop_stream)
+            self.writer = TssLoopWriter(loop, tss_process.stdin)
+        else:
+            reader_class = TssFramedReaderThread if FRAMED_PROTOCOL else TssReaderThread
+            self.reader = reader_class(tss_process.stdout, self.on_answer, self.on_reader_closed, self.pop_stream)
+            self.reader.daemon = True
+
+    def start(self):
+        self.reader.start()
+
+    def next_request_id(self):
+        return next(self.request_ids)
+
+    def send(self, request_id, command, on_answer=None, stream=None, payload=None):
+        """
+            Sends command to tss.js. on_answer(answer) will be called in the reader thread.
+            payload is sent in the lines after the command.
+        """
+        self.send_batch([(request_id, command, on_answer, stream, payload)])
+
+    def send_batch(self, requests):
+        """
+            Sends [(request_id, command, on_answer, stream, payload)] like send(), but in one frame.
+            tss.js answers them in one frame.
+        """
+        with self.pending_lock:
+            for request_id, command, on_answer, stream, payload in requests:
+                if on_answer is not None:
+                    self.pending[request_id] = on_answer
+                if stream is not None:
+                    self.streams[request_id] = stream
+                if command == 'quit':
+                    self.is_closing = True
+
+        if len(requests) == 1:
+            request_id, command, on_answer, stream, payload = requests[0]
+            buffers = make_frame(request_id, command, payload, FRAMED_PROTOCOL)
+        else:
+            buffers = make_batch_frame([(r[0], r[1], r[4]) for r in requests], FRAMED_PROTOCOL)
+        if self.writer is not None:
+            self.writer.write(buffers)
+        else:
+            with self.write_lock:
+                write_gathered(self.stdin, buffers)
+        for request in requests:
+            Debug('tss++', "Send to tss.js: #%i %s" % (request[0], request[1][0:100]))
+
+    def request(self, command, timeout=None, payload=None):
+        """
+            Sends command and blocks until the answer has arrived. Returns the answer.
+            Don't call this in the IOLoop thread, which has to read the answer.
+        """
+        answered = Event()
+        answers = []
+        def on_answer(answer):
+            answers.append(answer)
+            answered.set()
+        self.send(self.next_request_id(), command, on_answer, payload=payload)
+        answered.wait(timeout)
+        return answers[0] if answers else ""
+
+    def pop_stream(self, request_id):
+        """ Called by the reader thread when an answer starts. Returns its stream or None. """
+        with self.pending_lock:
+            return self.streams.pop(request_id, None)
+
+    def on_answer(self, request_id, answer):
+        """ Called by the reader thread for every tagged answer from tss.js. """
+        with self.pending_lock:
+            on_answer = self.pending.pop(request_id, None)
+        if on_answer is None:
+            Debug('tss++', "Received answer for unknown request #%i: %s" % (request_id, str(answer)[0:100]))
+        else:
+            on_answer(answer)
+
+    def on_reader_closed(self):
+        """ Called by the reader thread if tss.js has closed stdout. """
+        if not self.is_closing:
+            self.check_process_health()
+            for died_callback in list(self.died_callbacks):
+                died_callback()
+
+    def kill(self):
+        """ Kills a hung tss.js process. Other than close(), this calls the died_callbacks. """
+        try:
+            self.tss_process.kill()
+        except ProcessLookupError:
+            pass
+
+    def close(self):
+        """ Kills the tss.js process. """
+        self.is_closing = True
         try:
             self.tss_process.terminate()
             self.tss_process.kill()
@@ -231,82 +760,199 @@ class TssJsStarterThread(Thread):
 
 # ----------------------------------------- ADAPTER THREAD -------------------- #
 
+# Number of commands which may have been sent to one tss.js process without
+# having received their answer yet. Commands waiting on the middleware queue
+# can still be merged and debounced, so this should stay small.
+MAX_COMMANDS_IN_FLIGHT = 4
+
 class TssAdapterThread(Thread):
     """
         This class recieves commands from syncroized queue, merges/debounces them,
-        executes them and then calls the async_command.callback in the the main_thread
+        sends them to tss.js via the TssConnection and registers them as in-flight.
+        The TssReaderThread calls the async_command.callback in the the main_thread
         afterwards with the help of sublime.set_timeout().
 
-        This class uses a middleware queue (simple array) to allow modification of command order.
+        Answers are routed back by request id, so up to MAX_COMMANDS_IN_FLIGHT commands
+        can be sent without waiting for the previous answer. tss.js handles its input strictly
+        in order, so an update is always finished before a later query on
+        the same file is answered. Reordering only happens on the middleware queue.
+
+        This class uses a middleware queue (see MiddlewareQueue) to allow modification of command order.
         Every command form syncronized queue will immediatly be moved to middleware queue,
         because pythons Queue.Queue() does not allow for anything else than pop and put.
 
         Merging, debouncing and can then be done before poping the next command from middleware queue.
+        The next command is the one with the earliest deadline (see AsyncCommand priority classes).
 
         The thread block of syncronized queue will be used to wait for new commands.
-        To implement the debounce timeout, we add block release trigger commands
-        to the queue via sublime.set_timeout(). This releases the queue when the command
-        needs to be executed.
+        To implement the debounce timeout, the block has a timeout: the time until
+        the next debouncing command can be executed (see MiddlewareQueue.time_until_next_execution).
+        So the timing does not depend on the sublime main thread.
+        The reader thread puts the setinel string "wake!" on the queue when an
+        in-flight slot has been released while the adapter was waiting for one.
 
         If the setinel string "stop!" arrives on the syncronized queue, this thread will finish.
+
+        The journal holds what tss.js knows about the files which have been sent
+        (see AsyncCommand.set_late_binding and set_journal_entry). If the setinel string "died!"
+        arrives, tss.js has died: recover() lets the supervisor start a new process,
+        replays the unsaved buffers from the journal and sends the lost idempotent queries again.
+
+        The thread block also wakes up when the execution timeout of an in-flight command
+        passes. Then tss.js is considered hung and will be killed, which leads to recover().
+        A shared host is not killed, the adapter leaves it and recovers at once.
+        Cancelled commands are dropped when they are popped.
+
+        With attach_to_loop(), the adapter is not started as thread. Then put() schedules
+        on_loop_wakeup() in the IOLoop thread, which does one round of the working loop and
+        replaces the thread block with a timer for the next wakeup.
+
+        The adapter records the queue wait and execution time of every answered command,
+        the depth of its queues, merges and the sent and received bytes in METRICS
+        (see MetricsRegistry), labeled with the lane of its supervisor.
     """
 
-    def __init__(self, stdin, stdout, queue, check_process_health_function):
+    # seconds to wait for tss.js to answer a replayed update
+    REPLAY_TIMEOUT = 30
+
+    def __init__(self, connection, queue, command_prefix='', supervisor=None, recorder=None):
         """
-            stdin, stdout: Connection to tss.js,
+            connection: TssConnection to tss.js,
             queue: Synchronized queue to receive AsyncCommand instances.
+            command_prefix: is put in front of every command (eg. '@<project id> ' for a shared host)
+            supervisor: provides restart_process(), on_recovered(), owns_process() and leave_hung_process(),
+                        eg. TssJsStarterThread
+            recorder: CommandRecorder which gets every sent command and answer, or None
         """
-        self.stdin = stdin
-        self.stdout = stdout
+        self.connection = connection
         self.queue = queue
-        self.check_process_health = check_process_health_function
-        self.middleware_queue = []
+        self.command_prefix = command_prefix
+        self.supervisor = supervisor
+        self.recorder = recorder
+        self.lane = supervisor.lane if supervisor is not None else ''
+        self.middleware_queue = MiddlewareQueue()
+        self.in_flight = OrderedDict() # in_flight[request_id] = async_command, from old to new
+        self.sent_times = {} # sent_times[request_id] = time it has been sent, per lane unlike async_command.time_execute
+        self.timed_out = set() # request ids of in-flight commands which have passed their execution timeout
+        self.in_flight_lock = Lock()
+        self.is_waiting_for_slot = False
+        self.journal = {} # journal[filename] = (view change count or None, [lines] tss.js knows, is unsaved)
+        self.unsent = [] # commands which could not be written to a dead tss.js
+        self.is_connection_broken = False
+        self.is_stopped = False
+        self.loop = None # IOLoop, if the adapter runs in the loop thread
+        self.wakeup_timer = None
         Thread.__init__(self)
 
+    def put(self, item):
+        """ Hands an AsyncCommand or a setinel string to the adapter. Thread safe. """
+        self.queue.put(item)
+        if self.loop is not None:
+            self.loop.call_soon(self.on_loop_wakeup)
+
     def run(self):
         """ Working Loop. """
-        # block until queue is not empty anymore
-        # leave loop and finish thread if "stop!" arrives
-        for async_command in iter(self.queue.get, "stop!"):
-            Debug('adapter', "CONTINUTE execution queue")
+        while not self.is_stopped:
+            # block until queue is not empty anymore or the next debouncing command is due
+            try:
+                async_command = self.queue.get(timeout=self.time_until_next_wakeup())
+            except Empty:
+                async_command = None # debounce or execution timeout finished
+            self.work(async_command)
+
+        Debug('adapter', "QUIT async adapter to tss process and close queue")
+
+    def attach_to_loop(self, loop):
+        """ Runs the adapter in the IOLoop thread instead of an own thread. """
+        self.loop = loop
+        loop.call_soon(self.on_loop_wakeup)
 
+    def on_loop_wakeup(self):
+        """ One round of the working loop in the IOLoop thread, then a timer for the next wakeup. """
+        if self.is_stopped:
+            return
+        self.work(None)
+        if self.wakeup_timer is not None:
+            self.loop.cancel_timer(self.wakeup_timer)
+            self.wakeup_timer = None
+        if self.is_stopped:
+            Debug('adapter', "QUIT async adapter to tss process and close queue")
+            return
+        delay = self.time_until_next_wakeup()
+        if delay is not None:
+            self.wakeup_timer = self.loop.call_later(delay, self.on_loop_wakeup)
+
+    def work(self, async_command):
+        """ Handles async_command (or None) and all queued commands, then executes what can be executed. """
+        if async_command == "stop!":
+            return self.stop()
+        Debug('adapter', "CONTINUTE execution queue")
+
+        self.kill_if_hung()
+
+        if async_command == "died!":
+            self.recover()
+        elif async_command is not None and async_command != "wake!":
             self.append_to_middlewarequeue(async_command)
+        self.add_pending_items_in_queue_to_middleware_queue()
+        self.record_queue_depth()
+
+        # non blocking loop: work on middleware_queue and keep up-to-date with arriving commands
+        while not self.is_stopped and self.pop_and_execute_from_middleware_queue():
             self.add_pending_items_in_queue_to_middleware_queue()
+        self.record_queue_depth()
 
-            # non blocking loop: work on middleware_queue and keep up-to-date with arriving commands
-            while not self.middleware_queue_is_finished():
-                self.pop_and_execute_from_middleware_queue()
-                self.add_pending_items_in_queue_to_middleware_queue()
+        # => enter thread block
+        Debug('adapter+', "WAIT for new work (%i currently debouncing or waiting, %i in flight)"
+                            % (len(self.middleware_queue), len(self.in_flight)))
 
-            # => enter thread block
-            Debug('adapter+', "WAIT for new work (%i currently debouncing)" % len(self.middleware_queue))
 
-        Debug('adapter', "QUIT async adapter to tss process and close queue")
-        try:
-            self.stdin.close()
-        except Exception:
-            pass
-        try:
-            self.stdout.close()
-        except Exception:
-            pass
+    def time_until_next_wakeup(self):
+        """ Returns the seconds until the next debouncing command or in-flight timeout or None. """
+        if self.is_connection_broken:
+            return None
+        with self.in_flight_lock:
+            timeouts = [c.time_until_timeout(self.sent_times[request_id])
+                            for request_id, c in self.in_flight.items() if request_id not in self.timed_out]
+        timeouts.append(self.middleware_queue.time_until_next_execution())
+        timeouts = [t for t in timeouts if t is not None]
+        return min(timeouts) if timeouts else None
 
 
-    def append_to_middlewarequeue(self, async_command, set_timer=True):
-        """ Append async_command and set timer to release queue if told and needed. """
-        self.middleware_queue.append(async_command)
+    def kill_if_hung(self):
+        """
+            Kills tss.js if an in-flight command has passed its execution timeout on this lane.
+            A process which serves other projects, too (see supervisor.owns_process), is left
+            to them: the adapter recovers with a new one.
+        """
+        if self.is_connection_broken:
+            return
+        with self.in_flight_lock:
+            timed_out = [request_id for request_id, c in self.in_flight.items()
+                            if request_id not in self.timed_out
+                            and c.time_until_timeout(self.sent_times[request_id]) == 0]
+            self.timed_out.update(timed_out)
+            timed_out = [self.in_flight[request_id] for request_id in timed_out]
+        if not timed_out:
+            return
+        for async_command in timed_out:
+            async_command.on_timeout()
+        # stop sending until the supervisor has restarted it
+        self.is_connection_broken = True
+        if self.supervisor is None or self.supervisor.owns_process():
+            Debug('error', "tss.js (%s) is hung. Killing it." % self.lane)
+            self.connection.kill()
+        else:
+            Debug('error', "tss.js (%s) is hung. It serves other projects, too: reconnecting." % self.lane)
+            self.supervisor.leave_hung_process()
+            self.recover()
 
-        Debug('adapter+', "APPEND to middleware (in %fs): %s" % (async_command.time_until_execution(), async_command.id))
-        if set_timer and not async_command.can_be_executed_now():
-            self.trigger_queue_block_release_for(async_command)
 
+    def append_to_middlewarequeue(self, async_command):
+        """ Append async_command. A debouncing command shortens the next thread block. """
+        self.middleware_queue.append(async_command)
 
-    def trigger_queue_block_release_for(self, async_command):
-        """ Sets timeout to trigger a block release just when async_command can be executed. """
-        trigger_command = async_command.create_new_queue_trigger_command()
-        seconds = async_command.time_until_execution()
-        sublime.set_timeout(lambda: self.queue.put(trigger_command), int(seconds*1000) + 5)
-        Debug('adapter+', "TRIGGER QUEUE in %fs" % seconds)
+        Debug('adapter+', "APPEND to middleware (in %fs): %s" % (async_command.time_until_execution(), async_command.id))
 
 
     def add_pending_items_in_queue_to_middleware_queue(self):
@@ -315,44 +961,70 @@ class TssAdapterThread(Thread):
             while(True):
                 async_command = self.queue.get_nowait()
                 if async_command == "stop!":
-                    return self.clear_queues_and_reappend_stop()
-                self.append_to_middlewarequeue(async_command)
+                    return self.stop()
+                if async_command == "died!":
+                    self.recover()
+                elif async_command != "wake!":
+                    self.append_to_middlewarequeue(async_command)
         except Empty:
             pass
 
-    def clear_queues_and_reappend_stop(self):
-        # forget everything else and reappend "stop!", so the blocking queue won't miss it
+    def stop(self):
+        """ Forgets everything else and finishes the working loop. """
+        self.is_stopped = True
         try:
             while(True):
                 self.queue.get_nowait()
         except Empty:
             pass
-        self.middleware_queue = []
-        self.queue.put("stop!")
+        self.middleware_queue.clear()
 
 
-    def middleware_queue_is_finished(self):
-        """ Returns True if no more commands or only debouncing commands pending on middleware queue. """
-        for cmd in self.middleware_queue:
-            if cmd.can_be_executed_now():
-                return False
-        return True
+    def pop_next_from_middleware_queue(self):
+        """
+            Pops the command with the smallest AsyncCommand.schedule_key() which can be executed now.
+            Returns None if no more commands or only debouncing or waiting commands are pending.
+
+            A command waits if MAX_COMMANDS_IN_FLIGHT has been reached or if it is long running
+            and another long running command is in flight. So an interactive command
+            waits for at most one long running command, which has already been sent to tss.js.
+            The reader wakes the adapter with "wake!" if a waiting command can be sent.
+            Nothing is sent while tss.js is dead.
+        """
+        if self.is_connection_broken:
+            return None
 
+        with self.in_flight_lock:
+            slot_is_free = len(self.in_flight) < MAX_COMMANDS_IN_FLIGHT
+            long_running_in_flight = any(c.is_long_running() for c in self.in_flight.values())
 
-    def pop_and_execute_from_middleware_queue(self):
-        """ Executes the next command, but merge it first. If merging with procrastinating enabled, do not execute it. """
-        if not self.middleware_queue_is_finished():
-            command_to_execute = self.middleware_queue.pop(0)
-            Debug('adapter', "POPPED from middleware: %s" % command_to_execute.id)
+            next_command, is_waiting = self.middleware_queue.pop_next(slot_is_free,
+                                                                      not long_running_in_flight)
 
-            if command_to_execute.is_only_a_queue_trigger_command():
-                Debug('adapter+', "FOUND OLD TRIGGER object, don't execute anything")
-                return
+            if next_command is None and is_waiting:
+                self.is_waiting_for_slot = True
 
-            command_to_execute = self.merge_cmd_on_middleware_queue_and_return_replacement(command_to_execute)
-            if command_to_execute: # can be None if merge_procrastinate() has defered current item
-                Debug('adapter', "EXECUTE now: %s" % command_to_execute.id)
-                self.execute(command_to_execute)
+        return next_command
+
+
+    def pop_and_execute_from_middleware_queue(self):
+        """
+            Executes the next command, but merge it first. If merging with procrastinating enabled, do not execute it.
+            Returns False if there was no command to pop.
+        """
+        command_to_execute = self.pop_next_from_middleware_queue()
+        if command_to_execute is None:
+            return False
+        Debug('adapter', "POPPED from middleware: %s" % command_to_execute.id)
+
+        command_to_execute = self.merge_cmd_on_middleware_queue_and_return_replacement(command_to_execute)
+        if command_to_execute and command_to_execute.is_cancelled:
+            Debug('adapter+', "DROPPED cancelled command: %s" % command_to_execute.id)
+            METRICS.count('dropped cancelled', command_to_execute.kind(), self.lane)
+        elif command_to_execute: # can be None if merge_procrastinate() has defered current item
+            Debug('adapter', "EXECUTE now: %s" % command_to_execute.id)
+            self.execute(command_to_execute)
+        return True
 
 
     def merge_cmd_on_middleware_queue_and_return_replacement(self, async_command):
@@ -366,23 +1038,21 @@ class TssAdapterThread(Thread):
     def merge_immediate(self, command):
         """
             Removes all elements with the same id from middleware_queue.
-            Remember: command is already poped from array, so there is no need to handle it
+            Remember: command is already poped from queue, so there is no need to handle it
             Returns the last added aka newest same-id command
         """
-        commands_to_remove = []
+        commands_to_remove = self.middleware_queue.with_id(command.id) # from old to new
         newest_command = command
-        for possible_replacement in self.middleware_queue: # from old to new
-            if possible_replacement.id == command.id:
-                newest_command = possible_replacement
-                commands_to_remove.append(possible_replacement)
 
         if len(commands_to_remove) > 0:
+            newest_command = commands_to_remove[-1]
             command.on_replaced(newest_command)
             for c in commands_to_remove:
                 self.middleware_queue.remove(c)
-                if c.id != newest_command.id:
+                if c is not newest_command:
                     c.on_replaced(newest_command)
             Debug('adapter+', "MERGED with %i other commands (immediate): %s" % (len(commands_to_remove), command.id) )
+            METRICS.count('replaced', command.kind(), self.lane, len(commands_to_remove))
 
         return newest_command
 
@@ -390,12 +1060,9 @@ class TssAdapterThread(Thread):
     def merge_procrastinate(self, command):
         """
             If there is another command with same id, then do not execute it now.
-            Delete all same-id commands except for the last one(=newest) in the array.
+            Delete all same-id commands except for the last one(=newest) in the queue.
         """
-        commands_to_remove = []
-        for possible_duplicate in self.middleware_queue: # from old to new
-            if possible_duplicate.id == command.id:
-                commands_to_remove.append(possible_duplicate)
+        commands_to_remove = self.middleware_queue.with_id(command.id) # from old to new
 
         if len(commands_to_remove) > 0:
             newest_command = commands_to_remove.pop() # don't delete newest duplicate command.
@@ -404,6 +1071,7 @@ class TssAdapterThread(Thread):
                 c.on_replaced(newest_command)
                 self.middleware_queue.remove(c)
             Debug('adapter+', "MERGED with %i other commands (procrastinated): %s" % (len(commands_to_remove), command.id) )
+            METRICS.count('replaced', command.kind(), self.lane, len(commands_to_remove) + 1)
             return None # defer, no execution in this round
         else:
             return command # no defer, execute now, command has already been poped
@@ -411,28 +1079,489 @@ class TssAdapterThread(Thread):
 
     def execute(self, async_command):
         """
-            Executes Command.
+            Sends Command to tss.js and registers it as in flight.
+            The answer will be handled by on_answer() in the reader thread.
             If debouncing enabled und timeout not finished, add back to the end of the queue.
             This may cause unexpected behaviour but should be unnoticed mostly.
+            Pending commands of the same batch (see AsyncCommand.batch_with) are sent in the same frame.
         """
         if not async_command.can_be_executed_now():
-            self.append_to_middlewarequeue(async_command, set_timer=True) # reappend to end
+            self.append_to_middlewarequeue(async_command) # reappend to end
             Debug('adapter+', "MOVED to end of queue, debouncing")
             return
-        async_command.time_execute = time.time()
+
+        requests = []
+        sent = []
+        for c in self.collect_batch(async_command):
+            command, payload = c.command, c.payload
+            if c.make_command is not None:
+                command = c.make_command(self.journal)
+                if command is None:
+                    Debug('adapter+', "NOTHING to send, tss.js is up to date: %s" % c.id)
+                    continue
+                if isinstance(command, tuple):
+                    command, payload = command
+
+            c.time_execute = time.time()
+            request_id = self.connection.next_request_id()
+            c.request_id = request_id
+            with self.in_flight_lock:
+                self.in_flight[request_id] = c
+                self.sent_times[request_id] = c.time_execute
+            requests.append((request_id,
+                             self.command_prefix + command,
+                             lambda answer, request_id=request_id: self.on_answer(request_id, answer),
+                             c.make_stream(self.loop.call_in_worker if self.loop is not None else None),
+                             payload))
+            sent.append(c)
+
+        if not requests:
+            return
+        if len(requests) > 1:
+            Debug('adapter', "BATCH of %i commands: %s" % (len(requests), ', '.join(c.id for c in sent)))
+            METRICS.count('batched', '', self.lane, len(requests))
         try:
-            self.stdin.write(encode(async_command.command))
-            self.stdin.write(encode("\n"))
-            self.stdin.flush()
-            Debug('tss++', "Send to tss.js: %s" % async_command.command[0:100])
-
-            async_command.on_execute()
-            # causes result callback to be called async
-            results = self.stdout.readline().decode('UTF-8')
-            Debug('tss++', "Received from tss.js: %s" % results[0:100])
-            async_command.on_result(results)
+            self.connection.send_batch(requests)
+            for c, request in zip(sent, requests):
+                self.record_in_journal(c)
+                c.on_execute()
+                METRICS.count('request bytes', c.kind(), self.lane, len(request[1]) + len(request[4] or ''))
+            if self.recorder is not None:
+                self.recorder.on_send_batch(self.lane, [(request[0], request[1][len(self.command_prefix):], request[4], c)
+                                                        for c, request in zip(sent, requests)])
         except Exception as e:
             Debug('tss++', "ERROR: %s" % e)
-            self.check_process_health()
+            with self.in_flight_lock:
+                for request in requests:
+                    self.in_flight.pop(request[0], None)
+                    self.sent_times.pop(request[0], None)
+            # keep them for the restarted tss.js and stop sending until then
+            self.unsent.extend(sent)
+            self.is_connection_broken = True
+            self.connection.check_process_health()
+
+
+    def collect_batch(self, async_command):
+        """
+            Returns async_command and the commands of its batch which are pending on the
+            middleware queue and can be sent now, in the order of the batch.
+            They are merged like popped commands. A batch doesn't take more than the free in-flight slots.
+        """
+        if async_command.batch is None:
+            return [async_command]
+        with self.in_flight_lock:
+            free_slots = MAX_COMMANDS_IN_FLIGHT - len(self.in_flight) - 1
+        batch = []
+        for member in list(async_command.batch):
+            if member is async_command:
+                batch.append(member)
+                continue
+            if free_slots <= 0 or member not in self.middleware_queue \
+                    or not member.can_be_executed_now() or member.is_long_running():
+                continue
+            self.middleware_queue.remove(member)
+            member = self.merge_cmd_on_middleware_queue_and_return_replacement(member)
+            if member is not None and not member.is_cancelled:
+                batch.append(member)
+                free_slots -= 1
+        return batch
+
+
+    def record_in_journal(self, async_command):
+        """ Remembers what tss.js knows about a file after async_command has been sent. """
+        if async_command.journal_entry is None:
+            return
+        filename, content = async_command.journal_entry
+        if filename is None:
+            self.journal.clear() # tss.js reads all files from disk again
+        else:
+            self.journal[filename] = (None, content.split('\n'), True)
+
+
+    def recover(self):
+        """
+            Called after tss.js has died. The supervisor starts a new tss.js,
+            which reads all files from disk. Then the unsaved buffers from the journal are
+            replayed, the idempotent in-flight commands and all unsent commands are queued again.
+            In the IOLoop, the restart runs in a helper thread, because the loop has to read
+            the answers of the new process. Nothing is sent until it has finished.
+        """
+        self.is_connection_broken = True
+        if self.supervisor is None:
+            return
+        start_time = time.time()
+
+        with self.in_flight_lock:
+            lost = [c for request_id, c in self.in_flight.items() if request_id not in self.timed_out]
+            self.in_flight.clear()
+            self.sent_times.clear()
+            self.timed_out.clear()
+            self.is_waiting_for_slot = False
+
+        if self.loop is None:
+            return self.on_restarted(self.restart_and_replay(), lost, start_time)
+
+        def restart():
+            restarted = self.restart_and_replay()
+            self.loop.call_soon(self.on_restarted, restarted, lost, start_time)
+        restart_thread = Thread(target=restart)
+        restart_thread.daemon = True
+        restart_thread.start()
+
+    def restart_and_replay(self):
+        """
+            Starts a new tss.js and replays the unsaved buffers, the saved ones are forgotten.
+            Returns (connection, command_prefix) or (None, None).
+        """
+        connection, command_prefix = self.supervisor.restart_process()
+        if connection is None:
+            return None, None
+
+        for filename, (change_count, lines, is_unsaved) in list(self.journal.items()):
+            if not is_unsaved:
+                # the new tss.js reads it from disk if it is in tsconfig.json, otherwise it doesn't know it:
+                # either way the next update must send the whole file, not a line range
+                del self.journal[filename]
+                continue
+            Debug('tss+', "REPLAY unsaved buffer: %s" % filename)
+            connection.request('%supdate nocheck %i %s' % (command_prefix, len(lines), fn2l(filename)),
+                               self.REPLAY_TIMEOUT,
+                               payload='\n'.join(lines))
+        return connection, command_prefix
+
+    def on_restarted(self, restarted, lost, start_time):
+        """ Queues the lost and unsent commands for the new tss.js. """
+        connection, command_prefix = restarted
+        if connection is None:
+            return
+        self.connection = connection
+        self.command_prefix = command_prefix
+        self.is_connection_broken = False
+
+        reissued = [c for c in lost if c.is_idempotent() and not c.is_cancelled]
+        for async_command in reissued + self.unsent:
+            self.middleware_queue.append(async_command)
+        self.unsent = []
 
+        self.supervisor.on_recovered(time.time() - start_time, len(reissued))
+        if self.recorder is not None:
+            self.recorder.on_restart(self.lane)
+        if self.loop is not None:
+            self.put("wake!")
 
+
+    def on_answer(self, request_id, answer):
+        """
+            Called by the reader for the answer to an in-flight command.
+            Hands the answer to the command (in the IOLoop worker if the adapter runs in the loop)
+            and wakes the adapter if it waits for a free slot.
+            An answer which arrives after its command has timed out or has been
+            reissued to a restarted tss.js is ignored.
+        """
+        time_answered = time.time()
+        with self.in_flight_lock:
+            async_command = self.in_flight.pop(request_id, None)
+            if async_command is None:
+                Debug('tss+', "IGNORED answer for #%i, which is not in flight anymore" % request_id)
+                return
+            time_sent = self.sent_times.pop(request_id)
+            self.timed_out.discard(request_id)
+            wake_adapter = self.is_waiting_for_slot
+            self.is_waiting_for_slot = False
+
+        if self.loop is not None:
+            # decoding and transforming must not hold up the I/O of all projects
+            self.loop.call_in_worker(async_command.on_result, answer)
+        else:
+            async_command.on_result(answer)
+        self.record_answer(request_id, async_command, answer, time_sent, time_answered)
+        self.record_queue_depth()
+
+        if wake_adapter:
+            self.put("wake!")
+
+
+    def record_answer(self, request_id, async_command, answer, time_sent, time_answered):
+        """
+            Records the timings and the size of an answered command in METRICS (and the recorder).
+            The times of this lane are used: a command for all lanes (eg. an update) is sent and
+            answered once per lane, async_command.time_execute and .time_finish hold the last lane's.
+        """
+        kind = async_command.kind()
+        size = async_command.answer_size(answer)
+        METRICS.observe('queue wait', kind, self.lane, time_sent - async_command.time_queue)
+        METRICS.observe('execution', kind, self.lane, time_answered - time_sent)
+        METRICS.count('response bytes', kind, self.lane, size)
+        if self.recorder is not None:
+            self.recorder.on_answer(self.lane, request_id, answer, size,
+                                    async_command.time_queue, time_sent, time_answered)
+
+    def record_queue_depth(self):
+        METRICS.set_gauge('queue depth', self.lane, len(self.middleware_queue))
+        METRICS.set_gauge('in flight', self.lane, len(self.in_flight))
+
+
+# ----------------------------------------- READERS -------------------- #
+
+class TssAnswerParser(object):
+    """
+        Hands every "#<request id> <answer>" line of the text which has been read from tss.js
+        to on_answer(request_id, answer).
+        If get_stream(request_id) returns a stream, the answer is fed into it
+        chunk by chunk as it arrives and on_answer gets stream.finish().
+        So large answers never have to be in memory as one string.
+        Untagged lines (eg. the startup message) are logged and dropped.
+        The readers call on_closed() when tss.js closes stdout.
+    """
+
+    tag_re = re.compile(r'^#(\d+) ')
+    CHUNK_SIZE = 65536
+    BATCH_HEADER = b"batch\n"
+
+    def __init__(self, stdout, on_answer, on_closed, get_stream=lambda request_id: None):
+        self.stdout = stdout
+        self.on_answer = on_answer
+        self.on_closed = on_closed
+        self.get_stream = get_stream
+        self.start_of_line = '' # text of the current line until the tag is complete
+        self.request_id = None # of the current line, None while the tag is incomplete
+        self.stream = None
+        self.parts = []
+
+    def on_text(self, text):
+        while text:
+            end_of_line = text.find('\n')
+            if end_of_line == -1:
+                self.on_part(text)
+                return
+            self.on_part(text[:end_of_line])
+            self.on_end_of_line()
+            text = text[end_of_line+1:]
+
+    def on_part(self, text):
+        """ Handles text of the current line. """
+        if self.request_id is None:
+            self.start_of_line += text
+            if ' ' not in self.start_of_line:
+                return
+            m = self.tag_re.match(self.start_of_line)
+            if m is None:
+                return # untagged, wait for the end of line
+            self.request_id = int(m.group(1))
+            self.stream = self.get_stream(self.request_id)
+            text = self.start_of_line[m.end():]
+            self.start_of_line = ''
+        if self.stream is not None:
+            self.stream.feed(text)
+        else:
+            self.parts.append(text)
+
+    def on_end_of_line(self):
+        if self.request_id is None:
+            Debug('tss+', "Untagged answer from tss.js: %s" % self.start_of_line[0:100])
+            self.start_of_line = ''
+            return
+
+        if self.stream is not None:
+            try:
+                answer = self.stream.finish()
+            except Exception as e:
+                Debug('error', "Invalid answer from tss.js: %s" % e)
+                answer = "%s" % e
+        else:
+            answer = ''.join(self.parts) + '\n'
+        Debug('tss++', "Received from tss.js: #%i %s" % (self.request_id, str(answer)[0:100]))
+
+        request_id = self.request_id
+        self.request_id = None
+        self.stream = None
+        self.parts = []
+        self.on_answer(request_id, answer)
+
+
+class TssReaderThread(TssAnswerParser, Thread):
+    """ Reads the answers of tss.js (line protocol) in chunks in its own thread. """
+
+    def __init__(self, *args):
+        TssAnswerParser.__init__(self, *args)
+        Thread.__init__(self)
+
+    def run(self):
+        """ Reading Loop. """
+        decoder = codecs.getincrementaldecoder('UTF-8')()
+        try:
+            for chunk in iter(lambda: self.stdout.read1(self.CHUNK_SIZE), b''):
+                self.on_text(decoder.decode(chunk))
+        except Exception as e:
+            Debug('tss++', "ERROR: %s" % e)
+
+        Debug('adapter', "QUIT reader, tss.js has closed stdout")
+        self.on_closed()
+
+
+class TssFramedReaderThread(TssReaderThread):
+    """
+        Reads the framed answers of tss.js ("<byte length>\\n<payload>", FRAMED_PROTOCOL).
+        The payload is read into one reused buffer, so there is no need to search for
+        the end of the answer and no bytes object has to be created for each chunk.
+        The payload of a batch frame ("batch\\n<answer>\\n<answer>..") is split into lines.
+    """
+
+    def __init__(self, *args):
+        TssReaderThread.__init__(self, *args)
+        self.buffer = memoryview(bytearray(self.CHUNK_SIZE))
+
+    def run(self):
+        """ Reading Loop. """
+        try:
+            for header in iter(self.stdout.readline, b''):
+                self.read_payload(int(header))
+        except Exception as e:
+            Debug('tss++', "ERROR: %s" % e)
+
+        Debug('adapter', "QUIT reader, tss.js has closed stdout")
+        self.on_closed()
+
+    def read_payload(self, length):
+        decoder = codecs.getincrementaldecoder('UTF-8')()
+        on_text = self.on_part
+        if length >= len(self.BATCH_HEADER):
+            start = self.stdout.read(len(self.BATCH_HEADER))
+            length -= len(start)
+            if start == self.BATCH_HEADER:
+                on_text = self.on_text
+            else:
+                on_text(decoder.decode(start))
+        while length > 0:
+            count = self.stdout.readinto(self.buffer[:min(length, self.CHUNK_SIZE)])
+            if not count:
+                raise EOFError("tss.js has closed stdout within an answer")
+            length -= count
+            on_text(decoder.decode(self.buffer[:count]))
+        self.on_end_of_line()
+
+
+class TssLoopWriter(object):
+    """
+        Writes to the stdin of tss.js without blocking the IOLoop thread. stdin is non-blocking:
+        write() writes what the pipe takes at once and keeps the rest, which on_writable()
+        writes when the loop reports that the pipe takes more. A blocking write would wait
+        forever while tss.js is blocked writing a large answer, which only the loop thread reads.
+        Thread safe, the frames are written in the order of the write() calls.
+    """
+
+    def __init__(self, loop, stdin):
+        import fcntl # posix only, like the IOLoop
+        self.loop = loop
+        self.fd = stdin.fileno()
+        flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.output = [] # memoryviews which have not been written, only while registered in the loop
+        self.lock = Lock()
+        self.is_registered = False
+
+    def write(self, buffers):
+        """ Writes the byte buffers of a frame. Raises OSError (eg. BrokenPipeError) if tss.js has died. """
+        with self.lock:
+            self.output.extend(memoryview(b) for b in buffers)
+            if self.is_registered:
+                return # behind the output which waits for the pipe
+            try:
+                self.output = write_some(self.fd, self.output)
+            except OSError:
+                self.output = []
+                raise
+            if self.output:
+                Debug('tss++', "PIPE full, %i bytes wait until tss.js reads" % sum(len(v) for v in self.output))
+                self.is_registered = True
+                self.loop.add_writer(self.fd, self.on_writable)
+
+    def on_writable(self):
+        with self.lock:
+            try:
+                self.output = write_some(self.fd, self.output)
+            except OSError as e:
+                # tss.js has died, the reader notices it and the adapters recover
+                Debug('tss++', "ERROR: %s" % e)
+                self.output = []
+            if not self.output:
+                self.is_registered = False
+                self.loop.remove_writer(self.fd)
+
+
+class TssLoopReader(TssAnswerParser):
+    """
+        Reads the answers of tss.js in the IOLoop thread: on_readable() reads what has arrived
+        without blocking and feeds it into a state machine for the frames "<byte length>\\n<payload>"
+        (or the lines of the line protocol), so one thread can read the pipes of all processes.
+    """
+
+    def __init__(self, loop, *args):
+        TssAnswerParser.__init__(self, *args)
+        self.loop = loop
+        self.fd = None
+        self.decoder = codecs.getincrementaldecoder('UTF-8')()
+        self.header = b'' # of the current frame until its line break
+        self.remaining = None # bytes of the current payload which have not been read, None: in the header
+        self.payload_start = b'' # first bytes of the payload until it is known whether it is a batch
+        self.on_payload_text = None
+
+    def start(self):
+        self.fd = self.stdout.fileno()
+        self.loop.add_reader(self.fd, self.on_readable)
+
+    def on_readable(self):
+        try:
+            data = os.read(self.fd, self.CHUNK_SIZE)
+        except OSError as e:
+            Debug('tss++', "ERROR: %s" % e)
+            data = b''
+        if not data:
+            self.loop.remove_reader(self.fd)
+            Debug('adapter', "QUIT reader, tss.js has closed stdout")
+            self.on_closed()
+            return
+        if FRAMED_PROTOCOL:
+            self.feed(data)
+        else:
+            self.on_text(self.decoder.decode(data))
+
+    def feed(self, data):
+        """ Feeds the bytes which have arrived into the current frame(s). """
+        pos = 0
+        while pos < len(data):
+            if self.remaining is None:
+                end_of_header = data.find(b'\n', pos)
+                if end_of_header == -1:
+                    self.header += data[pos:]
+                    return
+                self.remaining = int(self.header + data[pos:end_of_header])
+                self.header = b''
+                self.payload_start = b''
+                self.on_payload_text = None
+                pos = end_of_header + 1
+            else:
+                count = min(self.remaining, len(data) - pos)
+                self.on_payload(data[pos:pos+count])
+                pos += count
+                self.remaining -= count
+            if self.remaining == 0:
+                self.on_payload(b'')
+                self.on_end_of_line()
+                self.remaining = None
+
+    def on_payload(self, data):
+        """ Decides with the first bytes whether the payload is a batch, then hands it on as text. """
+        if self.on_payload_text is None:
+            self.payload_start += data
+            if len(self.payload_start) < len(self.BATCH_HEADER) and self.remaining:
+                return
+            self.decoder.reset()
+            if self.payload_start.startswith(self.BATCH_HEADER):
+                self.on_payload_text = self.on_text
+                data = self.payload_start[len(self.BATCH_HEADER):]
+            else:
+                self.on_payload_text = self.on_part
+                data = self.payload_start
+        if data:
+            self.on_payload_text(self.decoder.decode(data))
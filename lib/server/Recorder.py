@@ -0,0 +1,98 @@
+# coding=utf8
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import itertools
+from threading import Lock
+
+
+# ----------------------------------------- COMMAND RECORDER ---------------------------------- #
+
+class CommandRecorder(object):
+    """
+        Writes every command which a TssAdapterThread sends to tss.js and the
+        size, timing and text of every answer to a gzipped log file, one JSON object per line:
+
+            {"e": "start", "time": <unix time>, "project": <tsconfig dir>, "version": 2}
+            {"e": "send", "t": <seconds since start>, "lane": "fast0", "batch": 3, "id": 17,
+             "kind": "type", "prio": "interactive", "cmd": "type 12 4 /p/x.ts", "payload": ..}
+            {"e": "answer", "t": .., "lane": "fast0", "id": 17, "size": 576, "wait": .., "exec": ..,
+             "answer": "{\"type\":\"..\"}"}
+            {"e": "restart", "t": .., "lane": "fast0"}
+
+        Commands which are sent in one frame have the same batch number. The commands are
+        recorded without the project prefix of a shared host. "payload" is left out if there is none.
+        "answer" is the JSON text of the answer (re-encoded if it has been decoded while streaming).
+        lib/benchmark/replay.py sends a recording to a fresh tss.js again and compares the answers.
+        Activated with the setting record_tss_commands. Thread safe, imports no sublime modules.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path, project_dir):
+        self.path = path
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.lock = Lock()
+        self.batches = itertools.count(1)
+        self.start = time.time()
+        self.write({'e': 'start', 'time': self.start, 'project': project_dir, 'version': self.VERSION})
+
+    def on_send_batch(self, lane, requests):
+        """ requests: [(request_id, command, payload, async_command)] which have been sent in one frame """
+        batch = next(self.batches)
+        t = time.time() - self.start
+        for request_id, command, payload, async_command in requests:
+            event = {'e': 'send', 't': round(t, 6), 'lane': lane, 'batch': batch, 'id': request_id,
+                     'kind': async_command.kind(), 'prio': async_command.get_priority_name(), 'cmd': command}
+            if payload is not None:
+                event['payload'] = payload
+            self.write(event)
+
+    def on_answer(self, lane, request_id, answer, size, time_queue, time_sent, time_answered):
+        """
+            answer: the raw answer text or the value decoded from the stream.
+            The times are those of lane: a command for all lanes is sent to each of them.
+        """
+        if not isinstance(answer, str):
+            answer = json.dumps(answer, separators=(',', ':'))
+        self.write({'e': 'answer', 't': round(time_answered - self.start, 6), 'lane': lane,
+                    'id': request_id, 'size': size,
+                    'wait': round(time_sent - time_queue, 6),
+                    'exec': round(time_answered - time_sent, 6),
+                    'answer': answer})
+
+    def on_restart(self, lane):
+        self.write({'e': 'restart', 't': round(time.time() - self.start, 6), 'lane': lane})
+
+    def write(self, event):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def recording_path(path, project_dir):
+    """
+        Returns path with the name and a hash of project_dir inserted before the extensions,
+        eg. ~/tss.jsonl.gz -> ~/tss-myproject-1a2b3c4d.jsonl.gz, so every project has its own recording.
+    """
+    directory, filename = os.path.split(path)
+    stem, dot, extensions = filename.partition('.')
+    project_hash = hashlib.md5(project_dir.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(directory, '%s-%s-%s%s%s' % (stem, os.path.basename(project_dir), project_hash,
+                                                      dot, extensions))
+
+
+def read_recording(path):
+    """ Returns the events of a recording as list of dicts. """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
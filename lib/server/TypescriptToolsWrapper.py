@@ -9,50 +9,77 @@ from ..display.T3SViews import T3SVIEWS
 from .AsyncCommand import AsyncCommand
 
 from ..utils import make_hash, Debug, max_calls
-from ..utils.fileutils import is_dts, fn2l
+from ..utils.fileutils import is_dts, fn2l, fn2k
+from ..utils.linediff import changed_line_range
+from ..utils.lrucache import LRUCache
 from ..utils.viewutils import get_file_infos
 from ..utils.CancelCommand import CancelCommand
+from ..system.globals import COMMAND_COUNTERS
 
 
 # --------------------------- TypescriptToolsWrapper ------------------------------------ #
 
 class TypescriptToolsWrapper(object):
     """ This Class translates the available commands to the corresponding string
-        command for the typescript-tools from clausreinke   """
+        command for the typescript-tools from clausreinke.
+        The query methods return the queued AsyncCommand, which can be cancelled.
 
+        The answers of type, definition and references are cached until the project content
+        changes: every update, add and reload creates a new project version. A definition only
+        depends on the file it is asked for and on the file of the definition, so it stays valid
+        as long as these two files are unchanged. Hits and misses are counted in COMMAND_COUNTERS.
+        A query which is asked again for the same project version before tss.js has answered
+        is not sent again, it follows the first one and gets the same answer (single flight). """
+
+    RESULT_CACHE_SIZE = 512
 
     def __init__(self, project):
         self.project = project
         self.added_files = {} # added_files[filename] = hash
+        self.queued_updates = {} # queued_updates[filename] = (view.change_count(), AsyncCommand) of the last update
         self.executed_with_most_recent_file_contents = []
         self.is_killing = False
+        self.version = 0 # project content version
+        self.reload_version = 0 # version of the last reload
+        self.file_versions = {} # file_versions[fn2k(filename)] = version of the last change of the file
+        self.results = LRUCache(self.RESULT_CACHE_SIZE) # results[command] = (version, [files] or None, answer)
+        self.in_flight_queries = {} # in_flight_queries[(command, version)] = first AsyncCommand asking it
+        self.details_requests = 0 # number of completion_details() calls, for their ids
 
 
     # RELOAD PROCESS
     @max_calls()
     def reload(self, callback=None):
+        # tss.js reads all files from disk again, so the next updates must send everything
+        self.added_files = {}
+        self.queued_updates = {}
+        self.on_new_version(None)
         AsyncCommand('reload', self.project) \
             .set_id('reload') \
+            .set_execution_timeout(300) \
+            .set_journal_entry(None, None) \
             .set_result_callback(lambda r: callback is None or callback()) \
-            .append_to_both_queues()
+            .append_to_all_queues()
         self.project.errors.start_recalculation()
 
 
     # GET INDEXED FILES
     @max_calls()
     def get_tss_indexed_files(self, callback):
-        AsyncCommand('files', self.project) \
+        return AsyncCommand('files', self.project) \
             .do_json_decode_tss_answer() \
             .set_result_callback(callback) \
-            .append_to_fast_queue()
+            .background() \
+            .append_to_queue()
 
-    # DUMP FILE (untested)
+    # DUMP FILE (untested), output "-": callback gets the content as JSON string
     @max_calls()
     def dump(self, filename, output, callback):
         dump_command = 'dump {0} {1}'.format( output, fn2l(filename) )
-        AsyncCommand(dump_command, self.project) \
+        return AsyncCommand(dump_command, self.project) \
             .set_result_callback(callback) \
-            .append_to_fast_queue()
+            .background() \
+            .append_to_queue()
 
     # Evaluate Javascript (refer to utils/debug.py)
     @max_calls()
@@ -66,23 +93,25 @@ class TypescriptToolsWrapper(object):
             print(json.dumps(js, indent=3))
             self.last_eva = js
         eva = 'eva {0}'.format(js_cmd)
-        AsyncCommand(eva, self.project) \
+        return AsyncCommand(eva, self.project) \
             .set_result_callback(cb) \
-            .append_to_slow_queue()
+            .background() \
+            .append_to_queue()
 
     # TYPE
     @max_calls()
-    def type(self, filename, line, col, callback):
+    def type(self, filename, line, col, callback, batch_with=None):
         """ callback({ tss type answer }, filename=, line=, col=) """
 
         type_command = 'type {0} {1} {2}'.format( str(line+1), str(col+1), fn2l(filename) )
 
-        AsyncCommand(type_command, self.project) \
-            .set_id("type_command") \
+        return self._send_or_use_cache(AsyncCommand(type_command, self.project) \
+            .set_id(type_command) \
+            .batch_with(batch_with) \
             .set_callback_kwargs(filename=filename, line=line, col=col) \
             .do_json_decode_tss_answer() \
-            .set_result_callback(callback) \
-            .append_to_fast_queue()
+            .interactive(),
+            callback)
 
 
     # DEFINITION
@@ -92,12 +121,13 @@ class TypescriptToolsWrapper(object):
 
         definition_command = 'definition {0} {1} {2}'.format( str(line+1), str(col+1), fn2l(filename) )
 
-        AsyncCommand(definition_command, self.project) \
-            .set_id("definition_command") \
+        return self._send_or_use_cache(AsyncCommand(definition_command, self.project) \
+            .set_id(definition_command) \
             .set_callback_kwargs(filename=filename, line=line, col=col) \
             .do_json_decode_tss_answer() \
-            .set_result_callback(callback) \
-            .append_to_fast_queue()
+            .navigation(),
+            callback,
+            lambda definition: [filename, definition['file']] if isinstance(definition, dict) else [filename])
 
 
     # REFERENCES
@@ -107,12 +137,83 @@ class TypescriptToolsWrapper(object):
 
         references_command = 'references {0} {1} {2}'.format( str(line+1), str(col+1), fn2l(filename) )
 
-        AsyncCommand(references_command, self.project) \
-            .set_id("references_command") \
+        return self._send_or_use_cache(AsyncCommand(references_command, self.project) \
+            .set_id(references_command) \
             .set_callback_kwargs(filename=filename, line=line, col=col) \
             .do_json_decode_tss_answer() \
-            .set_result_callback(callback) \
-            .append_to_fast_queue()
+            .navigation(),
+            callback)
+
+
+    # RESULT CACHE
+    def _send_or_use_cache(self, async_command, callback, files_of_answer=lambda answer: None):
+        """
+            Calls callback(answer, **callback_kwargs) with the cached answer to async_command if it
+            is still valid, otherwise queues async_command and caches its answer. If the same command
+            is in flight for the current version, async_command follows it instead of being queued.
+            The id of async_command must include the position: a leader may only be replaced by
+            an identical command, whose answer is the answer for its followers, too.
+            files_of_answer(answer) returns the files the answer depends on, None: all files.
+            Returns the queued (or following) AsyncCommand or None if the cache has been used.
+        """
+        cached = self.results.get(async_command.command)
+        if cached is not None and self._is_valid(cached):
+            COMMAND_COUNTERS['result cache hits'] += 1
+            Debug('command', "CMD answered from cache: %s" % async_command.command)
+            sublime.set_timeout(lambda: callback(cached[2], **async_command.callback_kwargs), 0)
+            return None
+        COMMAND_COUNTERS['result cache misses'] += 1
+
+        key = (async_command.command, self.version)
+        leader = self.in_flight_queries.get(key)
+        if leader is not None and not leader.future.done() and not leader.is_cancelled:
+            COMMAND_COUNTERS['single flight joins'] += 1
+            Debug('command', "CMD follows the identical command in flight: %s" % async_command.command)
+            return async_command \
+                .set_result_callback(callback) \
+                .follow(leader)
+
+        def forget(future):
+            if self.in_flight_queries.get(key) is async_command:
+                del self.in_flight_queries[key]
+        self.in_flight_queries[key] = async_command
+        async_command.future.add_done_callback(forget)
+
+        version = self.version
+        def on_answer(answer, **callback_kwargs):
+            # no tss.js error string and no reload since the command has been queued
+            if (answer is None or isinstance(answer, (dict, list))) and version >= self.reload_version:
+                self.results.put(async_command.command, (version, files_of_answer(answer), answer))
+            callback(answer, **callback_kwargs)
+
+        return async_command \
+            .set_result_callback(on_answer) \
+            .append_to_queue()
+
+    def _is_valid(self, cached):
+        version, files, answer = cached
+        if version < self.reload_version:
+            return False
+        if files is None:
+            return version == self.version
+        return all(self.file_versions.get(fn2k(f), 0) <= version for f in files)
+
+    def on_new_version(self, filename):
+        """ The content of filename has changed. filename None: all files may have changed """
+        self.version += 1
+        if filename is None:
+            self.reload_version = self.version
+            self.file_versions = {}
+            self.results.clear()
+        else:
+            self.file_versions[fn2k(filename)] = self.version
+
+    def changed_since(self, version, except_filename=None):
+        """ Returns True if a file other than except_filename has changed after version. """
+        if self.reload_version > version:
+            return True
+        except_key = fn2k(except_filename) if except_filename is not None else None
+        return any(v > version for k, v in self.file_versions.items() if k != except_key)
 
     # STRUCTURE
     @max_calls()
@@ -127,54 +228,134 @@ class TypescriptToolsWrapper(object):
             .set_callback_kwargs(filename=filename, sender_view_id=sender_view_id) \
             .do_json_decode_tss_answer() \
             .set_result_callback(callback) \
-            .append_to_fast_queue()
+            .navigation() \
+            .append_to_queue()
 
 
     # ASK FOR COMPLETIONS
     @max_calls()
-    def complete(self, filename, line, col, is_member_str, callback):
-        """ callback("tss type answer as string") """
+    def complete(self, filename, line, col, is_member_str, callback, prepare_entries, prepare_result, batch_with=None):
+        """
+            Asks for brief entries (name, kind, kindModifiers), see completion_details().
+            prepare_entries([entries]) while the answer arrives and
+            prepare_result({tss completions answer} or None, [prepared entries]) afterwards,
+            both in the reader thread.
+            callback(<return value of prepare_result>, **kwargs) afterwards.
+        """
 
-        completions_command = 'completions {0} {1} {2} {3}'.format(is_member_str, str(line+1), str(col+1), fn2l(filename))
+        completions_command = 'completions-brief {0} {1} {2} {3}'.format(is_member_str, str(line+1), str(col+1), fn2l(filename))
 
         Debug('autocomplete', "Send async completion command for line %i , %i" % (line+1, col+1))
 
-        AsyncCommand(completions_command, self.project) \
+        return AsyncCommand(completions_command, self.project) \
             .set_id("completions_command") \
+            .batch_with(batch_with) \
             .procrastinate() \
+            .stream_json_array(key='entries') \
+            .set_chunk_transform(prepare_entries) \
+            .set_result_transform(prepare_result) \
             .set_result_callback(callback) \
             .set_callback_kwargs(filename=filename, line=line, col=col, is_member_str=is_member_str) \
-            .append_to_fast_queue()
+            .interactive() \
+            .append_to_queue()
+
+
+    # COMPLETION DETAILS
+    @max_calls()
+    def completion_details(self, filename, line, col, names, callback):
+        """
+            callback([tss.js completion entries with type and docComment]) for the entries names
+            of the completions-brief answer for line, col.
+            Every request has its own id: a second one asks for other names and must not replace the first.
+        """
+
+        self.details_requests += 1
+        details_command = 'completionDetails {0} {1} {2} {3}'.format(len(names), str(line+1), str(col+1), fn2l(filename))
+
+        return AsyncCommand(details_command, self.project) \
+            .set_id("completion_details_command %i" % self.details_requests) \
+            .set_payload('\n'.join(names)) \
+            .do_json_decode_tss_answer() \
+            .set_result_callback(callback) \
+            .interactive() \
+            .append_to_queue()
 
 
     # UPDATE FILE
     @max_calls()
     def update(self, view):
-        """ updates the view.buffer's content to the buffer in tss.js """
+        """
+            updates the view.buffer's content to the buffer in tss.js.
+            Only a marker "file is dirty" is queued. The buffer is read when the
+            update is sent, so the newest version wins and all queued markers of
+            this file are merged into one update.
+            Only the changed lines are sent if tss.js already knows the file.
+            Returns the update command for the current buffer (maybe queued before),
+            so a query can be batched with it (see AsyncCommand.batch_with).
+        """
 
         # only update if the file contents have changed since last update call on this file
+        filename = view.file_name()
+        change_count = view.change_count()
+        queued = self.queued_updates.get(filename)
+        if queued is not None and queued[0] == change_count:
+            Debug('tss+', "NO UPDATE needed for file : %s" % filename)
+            return queued[1] if not queued[1].time_execute else None
+
+        update_command = AsyncCommand('update %s' % filename, self.project) \
+            .set_id('update %s' % filename) \
+            .set_late_binding(lambda journal: self._make_update_command(view, filename, journal)) \
+            .append_to_all_queues()
+        self.queued_updates[filename] = (change_count, update_command)
+
+        self.on_new_version(filename)
+        self.on_file_contents_have_changed()
+        return update_command
+
+
+    def _make_update_command(self, view, filename, journal):
+        """
+            Called by each adapter when the update is sent. journal is what its tss.js knows.
+            Returns (command, payload) of a line range update or of a full update as fallback
+            or None if tss.js already knows the current buffer.
+        """
+        if not view.is_valid():
+            return None
+        change_count = view.change_count() # before reading: the content may only be newer
+        known = journal.get(filename)
+        if known is not None and known[0] == change_count:
+            return None
+
         filename, lines, content = get_file_infos(view)
-        if self.need_update(filename, content):
-            update_command = 'update nocheck {0} {1}\n{2}'.format(str(lines+1), fn2l(filename), content)
+        new_lines = content.split('\n')
+        delta = changed_line_range(known[1] if known is not None else None, new_lines)
+        journal[filename] = (change_count, new_lines, view.is_dirty())
 
-            AsyncCommand(update_command, self.project) \
-                .set_id('update %s' % filename) \
-                .append_to_both_queues()
+        if delta is None or len(new_lines) != lines + 1:
+            Debug('tss+', "FULL UPDATE for file : %s" % filename)
+            return 'update nocheck {0} {1}'.format(str(lines+1), fn2l(filename)), content
 
-            self.on_file_contents_have_changed()
+        first, last, replacement = delta
+        Debug('tss+', "LINE RANGE UPDATE %i-%i (%i lines) for file : %s"
+                        % (first+1, last+1, len(replacement), filename))
+        return 'update nocheck {0} {1}-{2} {3}'.format(str(len(replacement)), str(first+1), str(last+1),
+                                                      fn2l(filename)), '\n'.join(replacement)
 
 
     # ADD FILE
     @max_calls()
     def add(self, filename, lines, content):
 
-        update_command = 'update nocheck {0} {1}\n{2}'.format(str(lines+1), fn2l(filename), content)
+        update_command = 'update nocheck {0} {1}'.format(str(lines+1), fn2l(filename))
 
         AsyncCommand(update_command, self.project) \
+            .set_payload(content) \
             .set_id('add %s' % filename) \
-            .append_to_both_queues()
+            .set_journal_entry(filename, content) \
+            .append_to_all_queues()
 
         self.need_update(filename, content) # save current state
+        self.on_new_version(filename)
         self.on_file_contents_have_changed()
 
 
@@ -213,8 +394,13 @@ class TypescriptToolsWrapper(object):
 
     # ERRORS
     @max_calls()
-    def errors(self, callback=None):
-        """ callback format: callback(result) """
+    def errors(self, callback, chunk_callback, prepare, prepare_chunk):
+        """
+            prepare_chunk([errors]) while the answer arrives and
+            prepare([errors] or tss error string, [prepared chunks]) afterwards, both in the reader thread.
+            chunk_callback(<return value of prepare_chunk>) and
+            callback(<return value of prepare>) on the main thread.
+        """
 
         # TODO: this may prevent initial error display or if user triggers manually
         if not self.files_changed_after_last_call('errors'):
@@ -222,14 +408,18 @@ class TypescriptToolsWrapper(object):
 
         T3SVIEWS.ERROR.on_calculation_initiated()
 
-        AsyncCommand('showErrors', self.project) \
+        return AsyncCommand('showErrors', self.project) \
             .set_id('showErrors') \
             .procrastinate() \
             .activate_debounce() \
+            .stream_json_array(chunk_callback) \
+            .set_chunk_transform(prepare_chunk) \
+            .set_result_transform(prepare) \
             .set_result_callback(lambda errors: [callback(errors), T3SVIEWS.ERROR.on_calculation_finished()] ) \
             .set_executing_callback(lambda: T3SVIEWS.ERROR.on_calculation_executing()) \
             .set_replaced_callback(lambda by: T3SVIEWS.ERROR.on_calculation_replaced()) \
-            .append_to_slow_queue()
+            .background() \
+            .append_to_queue()
 
 
     # KILL PROCESS (if no more files in editor)
@@ -252,7 +442,7 @@ class TypescriptToolsWrapper(object):
         AsyncCommand('quit', self.project) \
             .set_id('quit') \
             .set_result_callback(on_quit) \
-            .append_to_both_queues()
+            .append_to_all_queues()
 
         sublime.set_timeout(on_quit, 5000)
 
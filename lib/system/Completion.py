@@ -1,11 +1,13 @@
 # coding=utf8
 
 import re
-import json
 import sublime
 
 from ..utils import Debug
-from ..utils.uiutils import get_prefix
+from ..utils.fuzzy import top_matches
+from .ListItems import ListItems
+from .globals import METRICS
+from ..utils.uiutils import PREFIXES
 from ..utils.viewutils import get_file_infos, get_content_of_line_at
 
 
@@ -26,8 +28,26 @@ def get_col_after_last_dot(line_text):
     return line_text.rfind(".") + 1
 
 
-class Completion(object):
+# shared by all projects, the signatures of lib.d.ts are the same everywhere
+LIST_ITEMS = ListItems(PREFIXES)
+METRICS.add_source('list items cache', lambda: LIST_ITEMS.cache_info()._asdict())
+
 
+class Completion(object):
+    """
+        Member completions only depend on the receiver expression before the dot. So the list of the
+        last member completion is reused (narrowed locally with fuzzy matching while the identifier
+        after the dot is typed) until the text before the dot or another file changes.
+
+        tss.js is asked for brief entries (name and kind). The signatures and docs of the entries
+        which need a snippet (functions and methods) are only fetched for the first DETAILS_LIMIT
+        entries of the shown list. The list is shown immediately with the names. When the details
+        arrive, the names are replaced by snippets and a visible list is shown again.
+    """
+
+    MAX_NARROWED_ITEMS = 200
+    DETAILS_LIMIT = 40
+    NEEDS_SNIPPET = ('method', 'function', 'local function', 'constructor', 'construct')
     completion_chars = ['.']#['.',':']
     completion_list = []
     interface = False
@@ -36,28 +56,61 @@ class Completion(object):
 
     def __init__(self, project):
         self.project = project
+        self.pending_request = None # AsyncCommand of the last completion request
+        self.reusable = None # (receiver, project version, [(name, item)]) of the last member completion
+        self.details_for = None # (filename, line, col) of the last completion request
+        self.needs_details = set() # names of the entries which need a snippet
+        self.detailed = {} # detailed[name] = list item with the snippet made from the details
+        self.requested_details = set() # names whose details have arrived
+        self.pending_details = set() # names whose details have been requested, but not arrived yet
+
+    # PREPARE ENTRIES (reader thread)
+    def prepare_entries(self, entries, interface):
+        """
+            Creates the sublime list items for a chunk of entries while tss.js is still sending.
+            Called in the reader thread.
+        """
+        items = []
+        for entry in entries:
+            if interface and entry['kind'] != 'primitive type' and entry['kind'] != 'interface' : continue
+            items.append((entry['name'], LIST_ITEMS.list_item(entry), entry['kind'] in self.NEEDS_SNIPPET))
+        return items
+
+    # PREPARE RESULT (reader thread)
+    def prepare_result(self, tss_result, prepared_entries):
+        """
+            Called in the reader thread with the decoded answer and the items of all chunks.
+            Returns ([(name, list item)] sorted, set of names which need details)
+            or the failed tss_result (no dict).
+        """
+        if not isinstance(tss_result, dict) or 'entries' not in tss_result:
+            return tss_result
+        items = []
+        needs_details = set()
+        for chunk in prepared_entries:
+            for name, item, needs_snippet in chunk or []:
+                items.append((name, item))
+                if needs_snippet:
+                    needs_details.add(name)
+        items.sort(key=lambda named_item: named_item[1])
+        return (items, needs_details)
+
 
     # PREPARE LISTE
-    def prepare_list(self, tss_result_json):
-        del self.completion_list[:]
-
-        try:
-            entries = json.loads(tss_result_json)
-            entries = entries['entries']
-        except:
-            if tss_result_json.strip() == 'null':
+    def prepare_list(self, result):
+        """ Replaces the list with the items of result, the return value of prepare_result() """
+        if not isinstance(result, tuple):
+            if result is None:
                 sublime.status_message('ArcticTypescript: no completions available')
             else:
-                Debug('error', 'Completion request failed: %s' % tss_result_json)
+                Debug('error', 'Completion request failed: %s' % result)
             return 0
 
-        for entry in entries:
-            if self.interface and entry['kind'] != 'primitive type' and entry['kind'] != 'interface' : continue
-            key = self._get_list_key(entry)
-            value = self._get_list_value(entry)
-            self.completion_list.append((key,value))
-
-        self.completion_list.sort()
+        (named_items, self.needs_details) = result
+        self.detailed = {}
+        self.requested_details = set()
+        self.pending_details = set()
+        self.completion_list[:] = [item for name, item in named_items]
         return len(self.completion_list)
 
 
@@ -105,14 +158,34 @@ class Completion(object):
             self.enabled_for['line'] = cursor_line
             self.enabled_for['col'] = autocomplete_col
 
+            line_text = get_content_of_line_at(view, cursor_pos)
+            receiver = self._receiver(view, cursor_line, autocomplete_col, line_text)
+            if is_member:
+                named_items = self._reusable_items(view, receiver)
+                if named_items is not None:
+                    Debug('autocomplete', " -> same receiver as last time, narrow the last list locally")
+                    typed = line_text[autocomplete_col:]
+                    self._fetch_details(self._show(view, named_items, typed),
+                                        lambda: self._refine(view, named_items, typed))
+                    return
+
             Debug('autocomplete', " -> push current file contents as update to tss.js")
-            self.project.tsserver.update(view)
+            update_command = self.project.tsserver.update(view)
+            version = self.project.tsserver.version
+
+            interface = self.interface
 
-            def async_react_completions_available(tss_result_json, filename, line, col, is_member_str):
+            def async_react_completions_available(items, filename, line, col, is_member_str):
                 Debug('autocomplete', "Autocompletion results available for line %i , %i" % (line+1, col+1) )
 
-                i = self.prepare_list(tss_result_json)
+                i = self.prepare_list(items)
                 Debug('autocomplete', " -> prepare List (%i items)" % i )
+                if not i:
+                    return
+                named_items = items[0]
+                self.details_for = (filename, line, col)
+                # the details of a reused list are requested for this position
+                self.reusable = (receiver, version, named_items) if is_member_str == 'true' else None
 
                 # view or line changed
                 current_view = sublime.active_window().active_view()
@@ -147,92 +220,129 @@ class Completion(object):
 
 
                 Debug('autocomplete', " -> command to sublime to now show autocomplete box with prepared list" )
-
-                # this will trigger Listener.on_query_completions
-                # but on_query_completions needs to have the completion list
-                # already available
-                current_view.run_command('auto_complete',{
-                    'disable_auto_insert': True,
-                    'api_completions_only': True,
-                    'next_completion_if_showing': True
-                })
+                self._fetch_details(self._show(current_view, named_items),
+                                    lambda: self._refine(current_view, named_items))
                 Debug('autocomplete', " -> (sublime cmd finished)" )
 
-            self.project.tsserver.complete(view.file_name(), cursor_line, autocomplete_col, is_member_str, async_react_completions_available)
-
-
-
-
-    # ENTRY KEY
-    def _get_list_key(self,entry):
-        kindModifiers = get_prefix(entry['kindModifiers'])
-        kind = get_prefix(entry['kind'])
-        type = entry['type'] if 'type' in entry else entry['name']
-
-        return kindModifiers+' '+kind+' '+str(entry['name'])+' '+str(type)
-
-
-    # ENTRY VALUE
-    def _get_list_value(self,entry):
-
-        # {'kind': 'method', 'docComment': '', 'kindModifiers': 'declare', 'type': '(method) MSNodeExtensions.swapNode(otherNode: Node): Node', 'name': 'swapNode'}
-        # {'kind': 'property', 'docComment': '', 'kindModifiers': 'declare', 'type': '(property) GlobalEventHandlers.onpointerup: (ev: PointerEvent) => any', 'name': 'onpointerup'}
-        # {'kind': 'property', 'docComment': '', 'kindModifiers': 'declare', 'type': '(property) Node.DOCUMENT_TYPE_NODE: number', 'name': 'DOCUMENT_TYPE_NODE'}
-        # {'kind': 'method', 'docComment': 'Allows updating the print settings for the page.', 'kindModifiers': 'declare', 'type': '(method) Document.updateSettings(): void', 'name': 'updateSettings'}
-        # {'kindModifiers': 'declare', 'docComment': '', 'kind': 'function', 'name': 'setTimeout', 'type': '(function) setTimeout(handler: any, timeout?: any, ...args: any[]): number'}
-
-        type_ = entry['type'] if 'type' in entry else entry['name']
-
-        # remove (<kind>)
-        kind_part = "(%s)" % entry['kind']
-        if type_.startswith(kind_part):
-            type_ = type_[len(kind_part):]
-
-        # catches the inner argumetns of a function call
-        match = re.match('.*\((.*)\):', str(type_))
-        result = []
-
-        if match:
-            variables = self._parse_args(match.group(1))
-            count = 1
-            for variable in variables:
-                splits = variable.split(':')
-                if len(splits) > 1:
-                    data = '"'+variable+'"'
-                    data = '${'+str(count)+':'+data+'}'
-                    result.append(data)
-                    count = count+1
-                else:
-                    result.append('')
-
-            return re.escape(entry['name'])+'('+','.join(result)+')'
-        else:
-            return re.escape(entry['name'])
-
-    # PARSE FUNCTION ARGUMENTS
-    def _parse_args(self, group):
-        # group = "otherNode: Node, param2: string"
-        args = []
-        arg = ""
-        callback = False
-
-        for char in group:
-            if char == '(' or char == '<':
-                arg += char
-                callback = True
-            elif char == ')' or char == '>':
-                arg += char
-                callback = False
-            elif char == ',':
-                if callback == False:
-                    args.append(arg)
-                    arg = ""
-                else:
-                    arg+=char
-            else:
-                arg+=char
-
-        args.append(arg)
-        return args
-
-
+            self.pending_request = self.project.tsserver.complete(view.file_name(), cursor_line, autocomplete_col,
+                                                                 is_member_str, async_react_completions_available,
+                                                                 lambda entries: self.prepare_entries(entries, interface),
+                                                                 self.prepare_result,
+                                                                 batch_with=update_command)
+
+
+    # SHOW
+    def _show(self, view, named_items, typed=''):
+        """ Shows the best matches of typed, returns them as [(name, list item)] """
+        narrowed = self._narrow(named_items, typed)
+        self.completion_list[:] = [item for name, item in narrowed]
+        # this will trigger Listener.on_query_completions
+        # but on_query_completions needs to have the completion list
+        # already available
+        view.run_command('auto_complete',{
+            'disable_auto_insert': True,
+            'api_completions_only': True,
+            'next_completion_if_showing': True
+        })
+        return narrowed
+
+
+    def _refine(self, view, named_items, typed=''):
+        """ Shows the list again with the snippets made from the arrived details, if it is still visible """
+        if not view.is_auto_complete_visible() or sublime.active_window().active_view().id() != view.id():
+            return
+        Debug('autocomplete', " -> details arrived, show the list again" )
+        view.run_command('hide_auto_complete')
+        self.enabled_for['viewid'] = view.id() # on_query_completions takes the new list
+        self._show(view, named_items, typed)
+
+
+    # REUSE MEMBER COMPLETIONS
+    def narrowed_list(self, view):
+        """
+            Returns the items of the last member completion narrowed to the identifier typed after
+            the dot, if the cursor is still behind the same receiver expression, otherwise None.
+        """
+        pos = view.sel()[0].begin()
+        line_text = get_content_of_line_at(view, pos)
+        if not is_member_completion(line_text):
+            return None
+        dot_col = get_col_after_last_dot(line_text)
+        named_items = self._reusable_items(view, self._receiver(view, view.rowcol(pos)[0], dot_col, line_text))
+        if named_items is None:
+            return None
+        narrowed = self._narrow(named_items, line_text[dot_col:])
+        self._fetch_details(narrowed)
+        return [item for name, item in narrowed]
+
+    def _receiver(self, view, line, dot_col, line_text):
+        return (view.file_name(), line, dot_col, line_text[:dot_col])
+
+    def _reusable_items(self, view, receiver):
+        """ Returns the [(name, item)] of the last member completion for receiver or None if outdated. """
+        if self.reusable is None:
+            return None
+        (reusable_receiver, version, named_items) = self.reusable
+        if reusable_receiver != receiver or self.project.tsserver.changed_since(version, view.file_name()):
+            return None
+        return named_items
+
+    def _narrow(self, named_items, typed):
+        """ Returns [(name, list item)] of the best matches, with the snippets made from the details """
+        if typed:
+            named_items = top_matches(typed, [(name, (name, item)) for name, item in named_items],
+                                      self.MAX_NARROWED_ITEMS)
+        return [(name, self.detailed.get(name, item)) for name, item in named_items]
+
+
+    # LAZY DETAILS
+    def _fetch_details(self, named_items, on_arrived=None):
+        """
+            Requests the details of the entries among the first DETAILS_LIMIT of named_items
+            which need a snippet. on_arrived() is called after they have arrived.
+            Names are requested again if their request has failed or has been cancelled.
+            Returns False if there is nothing to request.
+        """
+        names = [name for name, item in named_items[:self.DETAILS_LIMIT]
+                 if name in self.needs_details
+                 and name not in self.requested_details and name not in self.pending_details]
+        if not names or self.details_for is None:
+            return False
+        pending_details = self.pending_details
+        pending_details.update(names)
+
+        def async_react_details(details):
+            if self.pending_details is not pending_details:
+                return # the list has been replaced in the meantime
+            if isinstance(details, list):
+                self.requested_details.update(names)
+                for entry in details:
+                    if 'type' in entry:
+                        self.detailed[entry['name']] = LIST_ITEMS.list_item(entry)
+                Debug('autocomplete', " -> details for %i entries available" % len(details))
+            if on_arrived is not None:
+                on_arrived()
+
+        (filename, line, col) = self.details_for
+        details_command = self.project.tsserver.completion_details(filename, line, col, names, async_react_details)
+        if details_command is None:
+            pending_details.difference_update(names)
+            return False
+        # answered, failed or cancelled: not pending anymore
+        details_command.future.add_done_callback(
+            lambda future: sublime.set_timeout(lambda: pending_details.difference_update(names), 0))
+        return True
+
+
+    # CANCEL OUTDATED REQUEST
+    def cancel_outdated_request(self, view, view_closed=False):
+        """ Cancels the pending completion request for view if it has been closed or the cursor has left the line. """
+        if self.pending_request is None or self.pending_request.is_executed:
+            return
+        if view.id() != self.enabled_for['viewid']:
+            return
+        if not view_closed and view.rowcol(view.sel()[0].begin())[0] == self.enabled_for['line']:
+            return
+        Debug('autocomplete', " -> view closed or line changed before tss.js has answered -> cancel request")
+        self.pending_request.cancel()
+        self.pending_request = None
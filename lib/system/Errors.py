@@ -1,7 +1,6 @@
 # coding=utf8
 
 import sublime
-import json
 import re
 
 from ..utils import max_calls, Debug
@@ -14,35 +13,79 @@ class Errors(object):
     def __init__(self, project):
         self.project = project
         self.lasterrors = []
+        self.errors_by_file = {}
         self.message = "" # contains exception message if an error occured
+        self.first_chunk_displayed = False
         pass
 
     @max_calls()
     def start_recalculation(self):
-        self.project.tsserver.errors(self.on_results)
+        self.first_chunk_displayed = False
+        chunks = []
+
+        def prepare_first_chunk(errors):
+            """ Only the first chunk will be displayed before the whole answer has arrived """
+            chunks.append(errors)
+            if len(chunks) == 1:
+                return self.prepare_results(errors)
+            return None
+
+        self.project.tsserver.errors(self.on_results, self.on_chunk_of_results,
+                                     self.prepare_results, prepare_first_chunk)
+
+    @max_calls()
+    def on_chunk_of_results(self, prepared):
+        """ Called while tss.js is still sending. Displays the first chunk immediately. """
+        if prepared is not None and not self.first_chunk_displayed:
+            self.first_chunk_displayed = True
+            self.on_results(prepared)
 
     @max_calls()
-    def on_results(self, errors):
-        """ this is the callback from the async process if new errors have been calculated """
+    def on_results(self, prepared):
+        """
+            this is the callback from the async process if new errors have been calculated.
+            prepared has been created by prepare_results() in the reader thread,
+            so only the views have to be updated here.
+        """
+        if prepared is None:
+            prepared = self.prepare_results(None)
+
+        self.lasterrors = prepared['errors']
+        self.failure = prepared['failure']
+        self.text = prepared['text']
+        self.line_to_file = prepared['line_to_file']
+        self.line_to_pos = prepared['line_to_pos']
+        self.errors_by_file = prepared['by_file']
+
+        self.project.highlighter.highlight_all_open_files()
+        sublime.active_window().run_command('typescript_error_panel_set_text',
+                                            { "project_id": self.project.id } )
+
+
+    def prepare_results(self, errors, prepared_chunks=None):
+        """
+            Called in the reader thread with the decoded answer of tss.js (list or error string).
+            Does not use the sublime API or any state of self.
+            Returns a dict with the errors, the content of the error view and the errors grouped by file.
+        """
+        prepared = {'errors': [], 'failure': "", 'text': "",
+                    'line_to_file': {}, 'line_to_pos': {}, 'by_file': {}}
         try:
-            self.failure = ""
-            self.lasterrors = json.loads(errors)
-            if isinstance(self.lasterrors, str):
-                self.lasterrors = [ self._provide_better_explanations_for_tss_errors(self.lasterrors)]
-                # self.lasterrors is a list or None
-            if not isinstance(self.lasterrors, list):
+            if isinstance(errors, str):
+                errors = [ self._provide_better_explanations_for_tss_errors(errors)]
+                # errors is a list or None
+            if not isinstance(errors, list):
                 raise Warning("tss.js internal error: %s" % errors)
-            self._provide_better_explanations_for_some_errors()
-            self._tssjs_to_errorview()
+            self._provide_better_explanations_for_some_errors(errors)
+            prepared['text'], prepared['line_to_file'], prepared['line_to_pos'] = self._tssjs_to_errorview(errors)
+            prepared['by_file'] = self._group_by_file(errors)
+            prepared['errors'] = errors
 
         except BaseException as e: # Also catches JSON exceptions
-            self.lasterrors = []
-            self.failure = "%s" % e
+            prepared['failure'] = "%s" % e
             Debug('error', 'Internal ArcticTypescript error during show_errors: %s (Exception Message: %s)' % (errors, e))
 
-        self.project.highlighter.highlight_all_open_files()
-        sublime.active_window().run_command('typescript_error_panel_set_text',
-                                            { "project_id": self.project.id } )
+        return prepared
 
 
     def _provide_better_explanations_for_tss_errors(self, errorstr):
@@ -71,25 +114,26 @@ class Errors(object):
         return None
 
 
-    def _provide_better_explanations_for_some_errors(self):
+    def _provide_better_explanations_for_some_errors(self, errors):
 
         # do not use : inside of explanation
         additions = {1148 : '// What to do? Either use /// <reference path="x.ts" /> instead of import x = require("x");, or switch to external modules (Add the compilerOptions module="amd"|"commonjs" and out="some/builddir" to tsconfig.json). Restart ArcticTypescript or sublime.'}
 
-        for e in self.lasterrors:
+        for e in errors:
             for code, add in additions.items():
-                if e['code'] == code:
+                # the first chunk of errors has already been explained
+                if e['code'] == code and not e['text'].endswith(add):
                     e['text'] = e['text'] + ' ' + add
 
 
-    def _tssjs_to_errorview(self):
+    def _tssjs_to_errorview(self, errors):
         """
             Takes the de-jsoned output of the tss.js error command and creates the content for the error view.
             It also creates a relation between each line in the error view and the file and position of the error.
 
-            Sets    self.text
-                    self.line_to_file[line] = filename
-                    self.line_to_pos[line] = ((l,c),(l,c))
+            Returns text,
+                    line_to_file[line] = filename,
+                    line_to_pos[line] = ((l,c),(l,c))
 
         """
         line_to_file = {}
@@ -99,7 +143,7 @@ class Errors(object):
         previous_file = ''
         line = 0
 
-        for e in self.lasterrors:
+        for e in errors:
             filename = e['file'].split('/')[-1]
             if previous_file != filename:
                 text.append("\n\nOn File : %s \n" % filename)
@@ -117,14 +161,26 @@ class Errors(object):
             line_to_file[line] = e['file']
 
 
-        if len(self.lasterrors) == 0:
+        if len(errors) == 0:
             text.append("\n\nno errors")
 
         text.append('\n')
 
-        self.line_to_file = line_to_file
-        self.line_to_pos = line_to_pos
-        self.text = ''.join(text)
+        return ''.join(text), line_to_file, line_to_pos
+
+
+    def _group_by_file(self, errors):
+        """
+            Returns by_file[fn2k(filename)] = [((l,c), (l,c), flat error text, is_error)]
+            so the highlighter only has to look at the errors of the view.
+        """
+        by_file = {}
+        for e in errors:
+            a = (e['start']['line']-1, e['start']['character']-1)
+            b = (e['end']['line']-1, e['end']['character']-1)
+            by_file.setdefault(fn2k(e['file']), []).append(
+                (a, b, ''.join(self._flatten_errortext(e['text'])), e['category'] == 'Error'))
+        return by_file
 
 
     def _flatten_errortext(self, text_or_dict):
@@ -151,18 +207,16 @@ class Errors(object):
         error_regions = []
         warning_regions = []
 
-        for e in self.lasterrors:
-            if fn2k(e['file']) == fn2k(view.file_name()):
-
-                a = view.text_point(e['start']['line']-1, e['start']['character']-1)
-                b = view.text_point(e['end']['line']-1, e['end']['character']-1)
+        for (start, end, text, is_error) in self.errors_by_file.get(fn2k(view.file_name()), []):
+            a = view.text_point(*start)
+            b = view.text_point(*end)
 
-                error_texts[(a,b)] = ''.join(self._flatten_errortext(e['text']))
+            error_texts[(a,b)] = text
 
-                if e['category'] == 'Error':
-                    error_regions.append(sublime.Region(a,b))
-                else:
-                    warning_regions.append(sublime.Region(a,b))
+            if is_error:
+                error_regions.append(sublime.Region(a,b))
+            else:
+                warning_regions.append(sublime.Region(a,b))
 
         return error_regions, warning_regions, error_texts
 
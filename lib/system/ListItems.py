@@ -0,0 +1,91 @@
+# coding=utf8
+
+import re
+from functools import lru_cache
+
+
+# catches the inner arguments of a function call
+SIGNATURE_RE = re.compile(r'.*\((.*)\):')
+
+
+# ----------------------------------------- LIST ITEMS ---------------------------------- #
+
+class ListItems(object):
+    """
+        Transforms tss.js completion entries to sublime list items (key, snippet).
+        Most signatures are the same for every request (eg. the members of lib.d.ts),
+        so the items are memoized by (kindModifiers, kind, name, type) in a LRU cache
+        with at most maxsize entries. Thread safe. Imports no sublime modules.
+        MAXSIZE holds the brief and the detailed items of the largest lists (the globals of
+        lib.d.ts are several thousand entries), a smaller cache evicts every entry of such
+        a list before it is requested again.
+    """
+
+    MAXSIZE = 32768
+
+    def __init__(self, prefixes, maxsize=MAXSIZE):
+        self.prefixes = prefixes # symbols for kinds and modifiers, eg. {'method': u'○'}
+        self._cached_item = lru_cache(maxsize=maxsize)(self._make_item)
+
+    def list_item(self, entry):
+        """ Returns (key, snippet) for a full or brief (no type) completion entry """
+        return self._cached_item(entry['kindModifiers'], entry['kind'], entry['name'], entry.get('type'))
+
+    def cache_info(self):
+        return self._cached_item.cache_info()
+
+
+    # KEY AND SNIPPET
+    def _make_item(self, kind_modifiers, kind, name, type_):
+        key = self.prefixes.get(kind_modifiers, '') + ' ' + self.prefixes.get(kind, '') + ' ' + str(name)
+        if type_ is None: # brief entry
+            return (key, re.escape(name))
+        return (key + ' ' + str(type_), make_snippet(name, kind, type_))
+
+
+def make_snippet(name, kind, type_):
+    """
+        Returns the snippet which inserts name with a field for every argument, eg. for
+        type_ = '(method) Node.insertBefore(newChild: Node, refChild?: Node): Node'
+        'insertBefore(${1:"newChild: Node"},${2:" refChild?: Node"})'
+    """
+    # remove (<kind>)
+    kind_part = "(%s)" % kind
+    if type_.startswith(kind_part):
+        type_ = type_[len(kind_part):]
+
+    match = SIGNATURE_RE.match(type_)
+    if not match:
+        return re.escape(name)
+
+    fields = []
+    count = 1
+    for variable in parse_args(match.group(1)):
+        if ':' in variable:
+            fields.append('${%i:"%s"}' % (count, variable))
+            count += 1
+        else:
+            fields.append('')
+    return re.escape(name) + '(' + ','.join(fields) + ')'
+
+
+def parse_args(group):
+    """ Splits "otherNode: Node, callback: (a, b) => void" at the commas outside of () and <> """
+    if '(' not in group and '<' not in group:
+        return group.split(',')
+
+    args = []
+    arg = []
+    callback = False
+    for char in group:
+        if char == '(' or char == '<':
+            callback = True
+        elif char == ')' or char == '>':
+            callback = False
+        elif char == ',' and not callback:
+            args.append(''.join(arg))
+            arg = []
+            continue
+        arg.append(char)
+    args.append(''.join(arg))
+    return args
@@ -16,6 +16,7 @@ from .ProjectWizzard import ProjectWizzard
 from .ErrorsHighlighter import ErrorsHighlighter
 from .Errors import Errors
 from .Completion import Completion
+from .QuickInfo import QuickInfo
 
 from ..server.Processes import Processes
 from ..server.TypescriptToolsWrapper import TypescriptToolsWrapper
@@ -135,6 +136,7 @@ class OpenedProject(object):
         self.highlighter = None
         self.tsserver = None
         self.completion = None
+        self.quick_info = None
 
         if not startview.is_valid() or startview.window() is None:
             return
@@ -176,6 +178,7 @@ class OpenedProject(object):
         self.tsserver = TypescriptToolsWrapper(self)
         self.errors = Errors(self)
         self.completion = Completion(self)
+        self.quick_info = QuickInfo(self)
         self.highlighter = ErrorsHighlighter(self)
         Debug('notify', 'Initializion finished')
 
@@ -0,0 +1,114 @@
+# coding=utf8
+
+import sublime
+import html
+
+from ..utils import Debug
+from ..utils.debounce import debounce
+from ..utils.lrucache import LRUCache
+from .Completion import js_id_re
+
+
+# ----------------------------------------- QUICK INFO ---------------------------------- #
+
+class QuickInfo(object):
+    """
+        Type and documentation of the identifier under the cursor or mouse (tss.js type command).
+
+        The answers are kept in a LRU cache keyed by
+        (filename, view.change_count(), line, col of the start of the identifier),
+        so every position inside an identifier hits the same entry and a modification
+        of the buffer makes all entries of the file outdated. A cache hit needs no tss.js round trip.
+
+        If the cursor has been idle for PREFETCH_DELAY seconds, the quick info of the identifier
+        under the cursor is requested in advance. So the hover popup and TypescriptType
+        can be shown immediately most of the time.
+    """
+
+    CACHE_SIZE = 256
+    PREFETCH_DELAY = 0.3
+
+    def __init__(self, project):
+        self.project = project
+        self.cache = LRUCache(self.CACHE_SIZE)
+        self.pending_prefetch = None # AsyncCommand of the last prefetch
+
+
+    # LOOKUP
+    def lookup(self, view, pos):
+        """ Returns the cached quick info for the identifier at pos or None """
+        key = self._key(view, pos)
+        if key is None:
+            return None
+        return self.cache.get(key)
+
+
+    # REQUEST
+    def request(self, view, pos, on_info):
+        """
+            Calls on_info(quick info dict) on the main thread. Immediately if the info is cached,
+            otherwise after tss.js has answered. on_info is not called if there is no info.
+            Returns the AsyncCommand or None.
+        """
+        key = self._key(view, pos)
+        if key is None:
+            return None
+        info = self.cache.get(key)
+        if info is not None:
+            Debug('autocomplete', "Quick info from cache for %s" % str(key))
+            on_info(info)
+            return None
+
+        def async_react(info, filename, line, col):
+            if info is None or 'kind' not in info:
+                return
+            self.cache.put(key, info)
+            on_info(info)
+
+        filename, change_count, line, col = key
+        update_command = self.project.tsserver.update(view)
+        return self.project.tsserver.type(filename, line, col, callback=async_react,
+                                          batch_with=update_command)
+
+
+    # PREFETCH
+    def schedule_prefetch(self, view):
+        """ Requests the quick info under the cursor if the cursor stays there for PREFETCH_DELAY seconds. """
+        if self.pending_prefetch is not None:
+            self.pending_prefetch.cancel() # the cursor has moved
+            self.pending_prefetch = None
+        if not self.project.get_setting('quick_info_popup'):
+            return
+        debounce(self._prefetch, self.PREFETCH_DELAY, 'quick_info_prefetch' + self.project.id, view)
+
+    def _prefetch(self, view):
+        if not view.is_valid() or len(view.sel()) != 1 or not view.sel()[0].empty():
+            return
+        self.pending_prefetch = self.request(view, view.sel()[0].begin(), lambda info: None)
+
+
+    # HOVER POPUP
+    def show_popup(self, view, pos):
+        """ Shows the quick info of the identifier at pos as popup, immediately if it is cached. """
+        def on_info(info):
+            if view.is_valid():
+                view.show_popup(self._to_html(info), sublime.HIDE_ON_MOUSE_MOVE_AWAY,
+                                location=pos, max_width=800)
+        self.request(view, pos, on_info)
+
+
+    def _key(self, view, pos):
+        """ Returns (filename, change_count, line, col) of the identifier at pos or None """
+        word = view.word(pos)
+        m = js_id_re.match(view.substr(word))
+        if m is None or m.end() != word.size() or not word.contains(pos):
+            return None
+        (line, col) = view.rowcol(word.begin())
+        return (view.file_name(), view.change_count(), line, col)
+
+    def _to_html(self, info):
+        lines = ['<div style="padding: 4px">', '<b>%s</b>' % html.escape(info['type'])]
+        if info.get('docComment'):
+            lines.append('<br>%s' % html.escape(info['docComment']).replace('\n', '<br>'))
+        lines.append('</div>')
+        return ''.join(lines)
@@ -1,10 +1,28 @@
 # coding=utf8
 
+from collections import Counter
+
+from ..server.Metrics import MetricsRegistry
+
 
 # ############## system/Project.py #########################################
 
 OPENED_PROJECTS = {}
 
+# ############## server/Processes.py #######################################
+
+TSS_HOSTS = {} # shared tss.js host processes, key: (node_path, lane)
+WARM_TSS_HOSTS = {} # booted tss.js host processes without project, key: node_path
+
+# ############## server/AsyncCommand.py ###################################
+
+COMMAND_COUNTERS = Counter() # eg. COMMAND_COUNTERS['cancelled']
+
+# ############## server/Metrics.py ########################################
+
+METRICS = MetricsRegistry() # latency histograms, queue gauges and byte counters of all processes
+METRICS.add_source('command counters', lambda: COMMAND_COUNTERS)
+
 # ############## Allows Disabling of ArcticTypescript ######################
 
 plugin_disabled_for_folders = [] # path for certain folders or '*global'
@@ -0,0 +1,246 @@
+# coding=utf8
+
+import os
+import sys
+import json
+import time
+import tempfile
+from queue import Queue
+from threading import Event, Lock
+
+from ArcticTypescript.lib.benchmark import stand_in_tss
+from ArcticTypescript.lib.server.AsyncCommand import AsyncCommand
+from ArcticTypescript.lib.server.Framing import write_gathered
+from ArcticTypescript.lib.server.Processes import TssConnection, TssAdapterThread, \
+    start_tss_process, read_first_message, FRAMED_PROTOCOL, MAX_COMMANDS_IN_FLIGHT
+from sublime_unittest import TestCase
+
+
+STAND_IN_PATH = os.path.abspath(stand_in_tss.__file__)
+TIMEOUT = 10
+
+
+class StandInLane(object):
+    """
+        Supervisor of a TssAdapterThread against stand_in_tss.py. The adapter is not started,
+        the test drives it with work(), so nothing happens behind the test's back.
+        Every stand-in logs the commands it receives to its own file.
+        With is_shared, the adapter must not kill a hung stand-in.
+    """
+
+    lane = 'test'
+
+    def __init__(self, server_args, is_shared=False):
+        self.server_args = server_args
+        self.is_shared = is_shared
+        self.logs = [] # log file of every started stand-in
+        self.connections = []
+        self.left = [] # connections the adapter has left hung
+        self.recovered = [] # reissued_count of every recovery
+        self.died = Event()
+        connection, command_prefix = self.restart_process()
+        self.adapter = TssAdapterThread(connection, Queue(), command_prefix, supervisor=self)
+
+    def restart_process(self):
+        handle, log = tempfile.mkstemp(suffix='.log')
+        os.close(handle)
+        self.logs.append(log)
+        framed = ['--framed'] if FRAMED_PROTOCOL else []
+        self.process, error = start_tss_process(sys.executable, [sys.executable, STAND_IN_PATH, '--log', log]
+                                                + framed + self.server_args, '.')
+        if error:
+            raise RuntimeError(error)
+        read_first_message(self.process.stdout)
+        self.died.clear()
+        connection = TssConnection(self.process)
+        connection.died_callbacks.append(self.died.set)
+        connection.start()
+        self.connections.append(connection)
+        return connection, ''
+
+    def owns_process(self):
+        return not self.is_shared
+
+    def leave_hung_process(self):
+        self.left.append(self.adapter.connection)
+
+    def on_recovered(self, seconds, reissued_count):
+        self.recovered.append(reissued_count)
+
+    def send(self, *async_commands):
+        for async_command in async_commands:
+            async_command.time_queue = time.time()
+            self.adapter.work(async_command)
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        if not self.died.wait(TIMEOUT):
+            raise RuntimeError("the reader has not noticed the killed stand-in")
+
+    def write_raw(self, text):
+        """ Sends text as it is, eg. without a tag. """
+        data = text.encode('utf-8')
+        buffers = [('%i\n' % len(data)).encode('ascii'), data] if FRAMED_PROTOCOL else [data, b'\n']
+        connection = self.adapter.connection
+        if connection.writer is not None:
+            connection.writer.write(buffers)
+        else:
+            write_gathered(connection.stdin, buffers)
+
+    def received(self, process_number=-1):
+        """ Returns the commands the stand-in has received (the last started one by default). """
+        with open(self.logs[process_number]) as log:
+            return log.read().splitlines()
+
+    def close(self):
+        self.adapter.work("stop!")
+        for connection in self.connections:
+            connection.close()
+        for log in self.logs:
+            os.remove(log)
+
+
+def query(command):
+    return AsyncCommand(command, None).interactive()
+
+def update(filename, content):
+    return AsyncCommand('update nocheck 1 %s' % filename, None) \
+        .set_payload(content) \
+        .set_journal_entry(filename, content)
+
+def saved_update(filename, content):
+    """ Like TypescriptToolsWrapper._make_update_command for a saved view. """
+    def make_command(journal):
+        journal[filename] = (1, [content], False)
+        return 'update nocheck 1 %s' % filename, content
+    return AsyncCommand('update %s' % filename, None).set_late_binding(make_command)
+
+def wait(*async_commands):
+    return [async_command.future.result(TIMEOUT) for async_command in async_commands]
+
+
+class test_recover(TestCase):
+
+    def setUp(self):
+        self.lane = StandInLane(['--latency', '*=0', '--latency', 'type=30', '--latency', 'reload=30'])
+
+    def tearDown(self):
+        self.lane.close()
+
+    def test_restart_replay_and_reissue(self):
+        lane, adapter = self.lane, self.lane.adapter
+        unsaved, saved = update('/p/unsaved.ts', 'var a;'), saved_update('/p/saved.ts', 'var b;')
+        lane.send(unsaved, saved)
+        wait(unsaved, saved)
+
+        # in flight when tss.js dies: the stand-in needs 30s for them
+        lost_query, lost_reload = query('type 1 1 /p/unsaved.ts'), AsyncCommand('reload', None)
+        lane.send(lost_query, lost_reload)
+        self.assertEqual(list(adapter.in_flight.values()), [lost_query, lost_reload])
+        lane.kill()
+
+        # can't be written to the dead tss.js, the second one isn't even tried
+        unsent_first, unsent_second = query('definition 1 1 /p/unsaved.ts'), query('type 2 2 /p/unsaved.ts')
+        lane.send(unsent_first, unsent_second)
+        self.assertEqual(adapter.unsent, [unsent_first])
+
+        lane.server_args = ['--latency', '*=0']
+        adapter.work("died!")
+        wait(lost_query, unsent_first, unsent_second)
+
+        self.assertEqual(lane.recovered, [1])
+        self.assertEqual(lane.received(), ['update nocheck 1 /p/unsaved.ts', # replayed unsaved buffer
+                                           'type 1 1 /p/unsaved.ts', # reissued query
+                                           'definition 1 1 /p/unsaved.ts', # unsent, in order
+                                           'type 2 2 /p/unsaved.ts'])
+        self.assertFalse(lost_reload.future.done()) # not idempotent, not sent again
+        self.assertEqual(list(adapter.journal), ['/p/unsaved.ts']) # the saved buffer must be sent in full again
+        self.assertEqual(adapter.unsent, [])
+        self.assertFalse(adapter.in_flight)
+
+
+class test_pipelining(TestCase):
+
+    def setUp(self):
+        self.lane = StandInLane(['--concurrent', '--echo', '--latency', '*=0',
+                                 '--latency', 'references=0.6', '--latency', 'definition=0.3'])
+
+    def tearDown(self):
+        self.lane.close()
+
+    def test_answers_out_of_order(self):
+        lane, adapter = self.lane, self.lane.adapter
+        arrived = []
+        arrived_lock = Lock()
+        def track(async_command):
+            def on_done(future):
+                with arrived_lock:
+                    arrived.append(async_command.command)
+            async_command.future.add_done_callback(on_done)
+            return async_command
+
+        slow = track(AsyncCommand('references 1 1 /a.ts', None).navigation())
+        medium = track(query('definition 1 1 /a.ts'))
+        fast = [track(query('type %i 1 /a.ts' % i)) for i in range(1, MAX_COMMANDS_IN_FLIGHT - 1)]
+        waiting = track(query('type 9 9 /a.ts'))
+        lane.send(slow, medium, *fast)
+        self.assertEqual(len(adapter.in_flight), MAX_COMMANDS_IN_FLIGHT)
+        lane.send(waiting)
+        self.assertTrue(waiting in adapter.middleware_queue) # no free slot
+
+        wait(*fast)
+        adapter.work(None) # woken by the reader, a slot is free
+        self.assertFalse(waiting in adapter.middleware_queue)
+
+        # the stand-in answers untagged commands untagged; those and answers which are not in flight are ignored
+        lane.write_raw('files')
+        adapter.connection.send(adapter.connection.next_request_id(), 'type 7 7 /a.ts') # nobody waits for it
+        unknown_id = adapter.connection.next_request_id()
+        adapter.connection.send(unknown_id, 'type 8 8 /a.ts', lambda answer: adapter.on_answer(unknown_id, answer))
+
+        all_commands = [slow, medium] + fast + [waiting]
+        for async_command, answer in zip(all_commands, wait(*all_commands)):
+            self.assertEqual(json.loads(answer), async_command.command)
+        self.assertEqual(arrived[-2:], [medium.command, slow.command])
+        self.assertFalse(adapter.in_flight)
+
+
+class test_hung(TestCase):
+
+    def tearDown(self):
+        self.lane.close()
+
+    def send_hanging_query(self):
+        """ Sends a query which tss.js doesn't answer within its timeout, but a later lane would. """
+        hanging = query('type 1 1 /a.ts').set_execution_timeout(0.2)
+        self.lane.send(hanging)
+        hanging.time_execute = time.time() + 60 # sent by another lane much later
+        time.sleep(0.3)
+        self.lane.adapter.work(None)
+        with self.assertRaises(TimeoutError):
+            hanging.future.result(0)
+        return hanging
+
+    def test_own_process_is_killed(self):
+        self.lane = lane = StandInLane(['--latency', '*=0', '--latency', 'type=30'])
+        self.send_hanging_query()
+        self.assertTrue(lane.died.wait(TIMEOUT))
+        lane.server_args = ['--latency', '*=0']
+        lane.adapter.work("died!")
+        self.assertEqual(lane.recovered, [0]) # timed out on this lane, not reissued
+        self.assertEqual(lane.left, [])
+
+    def test_shared_process_is_left(self):
+        self.lane = lane = StandInLane(['--latency', '*=0', '--latency', 'type=30'], is_shared=True)
+        first_connection = lane.adapter.connection
+        lane.server_args = ['--latency', '*=0']
+        self.send_hanging_query()
+        self.assertEqual(lane.left, [first_connection])
+        self.assertEqual(lane.recovered, [0])
+        self.assertTrue(first_connection.tss_process.poll() is None) # still serves the other projects
+
+        after = query('type 2 2 /a.ts')
+        lane.send(after)
+        wait(after)
+        self.assertEqual(lane.received(), ['type 2 2 /a.ts'])
@@ -0,0 +1,72 @@
+# coding=utf8
+
+import os
+import fcntl
+
+from ArcticTypescript.lib.server.Framing import make_frame, make_batch_frame, write_some
+from ArcticTypescript.lib.server.Processes import TssLoopReader
+from sublime_unittest import TestCase
+
+
+class test_make_frame(TestCase):
+
+    def test_framed(self):
+        frame = b''.join(make_frame(12, 'update nocheck 2 a.ts', 'ä\nb'))
+        header, payload = frame.split(b'\n', 1)
+        self.assertEqual(int(header), len(payload))
+        self.assertEqual(payload.decode('UTF-8'), '#12 update nocheck 2 a.ts\nä\nb')
+
+    def test_line_protocol(self):
+        self.assertEqual(b''.join(make_frame(3, 'files', framed=False)), b'#3 files\n')
+
+    def test_batch(self):
+        frame = b''.join(make_batch_frame([(1, 'update nocheck 1 a.ts', 'x'), (2, 'type 1 1 a.ts', None)]))
+        header, payload = frame.split(b'\n', 1)
+        self.assertEqual(int(header), len(payload))
+        self.assertEqual(payload, b'batch\n#1 update nocheck 1 a.ts\nx\n#2 type 1 1 a.ts')
+
+
+class test_write_some(TestCase):
+
+    def test_full_pipe(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            fcntl.fcntl(write_fd, fcntl.F_SETFL, fcntl.fcntl(write_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            data = [b'a' * 100000, b'b' * 100000]
+            views = write_some(write_fd, [memoryview(b) for b in data])
+            left = sum(len(v) for v in views)
+            self.assertTrue(0 < left < 200000) # the pipe takes less than all
+            self.assertEqual(write_some(write_fd, views), views) # and nothing until it is read
+            received = b''
+            while views:
+                received += os.read(read_fd, 65536)
+                views = write_some(write_fd, views)
+            while len(received) < 200000:
+                received += os.read(read_fd, 65536)
+            self.assertEqual(received, b''.join(data))
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+
+class test_feed_frames(TestCase):
+
+    PAYLOADS = [b'#1 a', b'batch\n#2 \xc3\xa4\n#3 b', b'#4 c\nd']
+    FRAMES = b''.join(str(len(p)).encode('ascii') + b'\n' + p for p in PAYLOADS)
+    ANSWERS = [(1, 'a\n'), (2, '\u00e4\n'), (3, 'b\n'), (4, 'c\nd\n')]
+
+    def make_reader(self):
+        reader = TssLoopReader(None, None, lambda request_id, answer: reader.answers.append((request_id, answer)), None)
+        reader.answers = []
+        return reader
+
+    def test_at_once(self):
+        reader = self.make_reader()
+        reader.feed(self.FRAMES)
+        self.assertEqual(reader.answers, self.ANSWERS)
+
+    def test_byte_by_byte(self):
+        reader = self.make_reader()
+        for i in range(len(self.FRAMES)):
+            reader.feed(self.FRAMES[i:i+1])
+        self.assertEqual(reader.answers, self.ANSWERS)
@@ -0,0 +1,18 @@
+# coding=utf8
+
+from ArcticTypescript.lib.utils.fuzzy import fuzzy_score, top_matches
+from sublime_unittest import TestCase
+
+
+class test_fuzzy(TestCase):
+
+    def test_score(self):
+        self.assertIsNone(fuzzy_score('xq', 'toUpperCase'))
+        self.assertLess(fuzzy_score('toU', 'toUpperCase'), fuzzy_score('tou', 'toUpperCase'))
+        self.assertLess(fuzzy_score('tou', 'toUpperCase'), fuzzy_score('tuc', 'toUpperCase'))
+
+    def test_top_matches(self):
+        entries = [(name, name.upper()) for name in ['charAt', 'concat', 'toUpperCase', 'toString', 'trim']]
+        self.assertEqual(top_matches('t', entries, 2), ['TRIM', 'TOSTRING'])
+        self.assertEqual(top_matches('tSt', entries, 10), ['TOSTRING'])
+        self.assertEqual(top_matches('', entries, 2), ['CHARAT', 'CONCAT'])
@@ -0,0 +1,40 @@
+# coding=utf8
+
+import json
+
+from ArcticTypescript.lib.utils.jsonstream import JsonArrayStream
+from sublime_unittest import TestCase
+
+
+class test_json_array_stream(TestCase):
+
+    def feed_in_pieces(self, text, key=None, size=3):
+        chunks = []
+        stream = JsonArrayStream(chunks.append, key)
+        for i in range(0, len(text), size):
+            stream.feed(text[i:i+size])
+        return stream.finish(), chunks
+
+
+    def test_array(self):
+        value = [{"a": 1, "b": "x]},"}, 12345, -2.5e10, None, [1, [2]], "e"]
+        result, chunks = self.feed_in_pieces(json.dumps(value))
+        self.assertEqual(result, value)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(sum(chunks, []), value)
+
+    def test_array_member(self):
+        value = {"isMemberCompletion": True, "entries": [{"name": "a"}, {"name": "b"}], "z": [3]}
+        result, chunks = self.feed_in_pieces(json.dumps(value, indent=1), key='entries')
+        self.assertEqual(result, value)
+        self.assertEqual(sum(chunks, []), value['entries'])
+
+    def test_no_array(self):
+        self.assertEqual(self.feed_in_pieces('null')[0], None)
+        self.assertEqual(self.feed_in_pieces('"TSS error"')[0], "TSS error")
+        self.assertEqual(self.feed_in_pieces('null', key='entries')[0], None)
+
+    def test_incomplete(self):
+        stream = JsonArrayStream()
+        stream.feed('[1, 2')
+        self.assertRaises(ValueError, stream.finish)
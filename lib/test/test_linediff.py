@@ -0,0 +1,39 @@
+# coding=utf8
+
+from ArcticTypescript.lib.utils.linediff import changed_line_range
+from sublime_unittest import TestCase
+
+
+class test_changed_line_range(TestCase):
+
+    def apply(self, old, delta):
+        first, last, replacement = delta
+        return old[:first] + replacement + old[last + 1:]
+
+    def assert_roundtrip(self, old, new):
+        delta = changed_line_range(old, new)
+        self.assertIsNotNone(delta)
+        self.assertGreater(len(delta[2]), 0)
+        self.assertLessEqual(delta[0], delta[1])
+        self.assertEqual(self.apply(old, delta), new)
+        return delta
+
+
+    def test_changed_line(self):
+        delta = self.assert_roundtrip(['a', 'b', 'c'], ['a', 'B', 'c'])
+        self.assertEqual(delta, (1, 1, ['B']))
+
+    def test_inserted_and_deleted_lines(self):
+        self.assert_roundtrip(['a', 'b', 'c'], ['a', 'x', 'b', 'c'])
+        self.assert_roundtrip(['a', 'b', 'c'], ['x', 'a', 'b', 'c'])
+        self.assert_roundtrip(['a', 'b', 'c'], ['a', 'c'])
+        self.assert_roundtrip(['a', 'b', 'c'], ['b', 'c'])
+        self.assert_roundtrip(['a', 'b', 'c'], ['a', 'b', 'c', ''])
+
+    def test_repeated_lines(self):
+        self.assert_roundtrip(['a', 'a', 'a'], ['a', 'a'])
+        self.assert_roundtrip(['a', 'a'], ['a', 'a', 'a'])
+
+    def test_no_range_without_old_version(self):
+        self.assertIsNone(changed_line_range(None, ['a']))
+        self.assertIsNone(changed_line_range([], ['a']))
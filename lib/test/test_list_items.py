@@ -0,0 +1,30 @@
+# coding=utf8
+
+from ArcticTypescript.lib.system.ListItems import ListItems, make_snippet
+from sublime_unittest import TestCase
+
+
+class test_list_items(TestCase):
+
+    def test_snippet(self):
+        self.assertEqual(make_snippet('insertBefore', 'method', '(method) Node.insertBefore(newChild: Node, refChild?: Node): Node'),
+                         'insertBefore(${1:"newChild: Node"},${2:" refChild?: Node"})')
+        self.assertEqual(make_snippet('get', 'method', '(method) X.get(m: Map<string, number>): void'),
+                         'get(${1:"m: Map<string, number>"})')
+        self.assertEqual(make_snippet('length', 'property', '(property) String.length: number'), 'length')
+
+    def test_memoized(self):
+        list_items = ListItems({'method': 'M'}, maxsize=1)
+        entry = {'kind': 'method', 'kindModifiers': '', 'name': 'f', 'type': '(method) f(): void'}
+        self.assertEqual(list_items.list_item(entry), (' M f (method) f(): void', 'f()'))
+        list_items.list_item(entry)
+        self.assertEqual(list_items.cache_info().hits, 1)
+        self.assertEqual(list_items.list_item({'kind': 'method', 'kindModifiers': '', 'name': 'f'}), (' M f', 'f'))
+
+    def test_large_list_stays_cached(self):
+        list_items = ListItems({})
+        entries = [{'kind': 'method', 'kindModifiers': '', 'name': 'f%i' % i} for i in range(10000)]
+        for i in range(2):
+            for entry in entries:
+                list_items.list_item(entry)
+        self.assertEqual(list_items.cache_info().hits, len(entries))
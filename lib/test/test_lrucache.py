@@ -0,0 +1,26 @@
+# coding=utf8
+
+from ArcticTypescript.lib.utils.lrucache import LRUCache
+from sublime_unittest import TestCase
+
+
+class test_lru_cache(TestCase):
+
+    def test_drops_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_remove_if(self):
+        cache = LRUCache()
+        cache.put(('x.ts', 1), 'x')
+        cache.put(('y.ts', 1), 'y')
+        cache.remove_if(lambda key, value: key[0] == 'x.ts')
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(('y.ts', 1) in cache)
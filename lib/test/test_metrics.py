@@ -0,0 +1,35 @@
+# coding=utf8
+
+import json
+
+from ArcticTypescript.lib.server.Metrics import MetricsRegistry, Histogram
+from sublime_unittest import TestCase
+
+
+class test_metrics(TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for ms in range(1, 101):
+            histogram.add(ms / 1000.0)
+        summary = histogram.summary((50, 95, 99))
+        self.assertAlmostEqual(summary['p50'], 50)
+        self.assertAlmostEqual(summary['p95'], 95)
+        self.assertAlmostEqual(summary['p99'], 99)
+        self.assertAlmostEqual(summary['max'], 100)
+        self.assertEqual(summary['count'], 100)
+
+    def test_snapshot_is_json(self):
+        metrics = MetricsRegistry()
+        metrics.observe('execution', 'completions', 'fast0', 0.02)
+        metrics.set_gauge('queue depth', 'slow', 3)
+        metrics.set_gauge('queue depth', 'slow', 1)
+        metrics.count('replaced', 'update', 'slow', 2)
+        metrics.add_source('cache', lambda: {'hits': 7})
+
+        snapshot = json.loads(metrics.to_json())
+        self.assertEqual(snapshot['gauges'], [{'name': 'queue depth', 'lane': 'slow', 'value': 1, 'max': 3}])
+        self.assertEqual(snapshot['counters'][0]['value'], 2)
+        self.assertEqual(snapshot['histograms'][0]['kind'], 'completions')
+        self.assertEqual(snapshot['sources'], {'cache': {'hits': 7}})
+        self.assertTrue('completions' in metrics.report())
@@ -0,0 +1,140 @@
+# coding=utf8
+
+import time
+from queue import Queue
+
+from ArcticTypescript.lib.server.AsyncCommand import AsyncCommand
+from ArcticTypescript.lib.server.MiddlewareQueue import MiddlewareQueue
+from ArcticTypescript.lib.server.Processes import TssAdapterThread
+from sublime_unittest import TestCase
+
+
+def command(_id, priority=AsyncCommand.PRIORITY_INTERACTIVE, queued=0.0, now=None):
+    """ A command with id _id which has been queued <queued> seconds before now. """
+    now = time.time() if now is None else now
+    c = AsyncCommand('type 1 1 /a.ts', None).set_id(_id)
+    c.priority = priority
+    c.time_queue = c.time_last_bounce = now - queued
+    return c
+
+def pop_all(queue):
+    popped = []
+    while True:
+        c, is_waiting = queue.pop_next()
+        if c is None:
+            return popped
+        popped.append(c)
+
+
+class test_middleware_queue(TestCase):
+
+    def test_deadline_order(self):
+        now = time.time()
+        interactive = command('i', AsyncCommand.PRIORITY_INTERACTIVE, 0, now) # deadline now + 0.05
+        sync = command('s', AsyncCommand.PRIORITY_SYNC, 0, now) # now
+        navigation = command('n', AsyncCommand.PRIORITY_NAVIGATION, 1, now) # now - 0.5
+        background = command('b', AsyncCommand.PRIORITY_BACKGROUND, 10, now) # now - 5
+        queue = MiddlewareQueue()
+        for c in (interactive, sync, navigation, background):
+            queue.append(c)
+        self.assertEqual(pop_all(queue), [background, navigation, sync, interactive])
+        self.assertEqual(len(queue), 0)
+
+    def test_same_key_in_order_of_arrival(self):
+        now = time.time()
+        commands = [command('c%i' % i, now=now) for i in range(5)]
+        queue = MiddlewareQueue()
+        for c in commands:
+            queue.append(c)
+        self.assertEqual(pop_all(queue), commands)
+
+    def test_limits(self):
+        now = time.time()
+        long_running = command('n', AsyncCommand.PRIORITY_NAVIGATION, 1, now)
+        short = command('i', now=now)
+        queue = MiddlewareQueue()
+        queue.append(long_running)
+        queue.append(short)
+        self.assertEqual(queue.pop_next(slot_is_free=False), (None, True))
+        self.assertEqual(queue.pop_next(long_running_allowed=False), (short, True)) # the earlier long running one waits
+        self.assertEqual(queue.pop_next(long_running_allowed=False), (None, True))
+        self.assertEqual(queue.pop_next(), (long_running, False))
+
+    def test_remove_and_with_id(self):
+        now = time.time()
+        first, second, other = command('a', now=now), command('a', now=now), command('b', now=now)
+        queue = MiddlewareQueue()
+        for c in (first, second, other):
+            queue.append(c)
+        self.assertEqual(queue.with_id('a'), [first, second])
+        queue.remove(first)
+        self.assertEqual(queue.with_id('a'), [second])
+        self.assertEqual(queue.with_id('x'), [])
+        self.assertFalse(first in queue)
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(pop_all(queue), [second, other]) # the heap entry of first is skipped
+        queue.append(first) # removed commands can be appended again
+        self.assertEqual(pop_all(queue), [first])
+
+    def test_stale_key_after_bounce(self):
+        now = time.time()
+        postponed, other = command('a', queued=1, now=now), command('b', queued=0.5, now=now)
+        queue = MiddlewareQueue()
+        queue.append(postponed)
+        queue.append(other)
+        # a newer command which is replaced by postponed moves its deadline behind other
+        command('a', now=now).on_replaced(postponed)
+        self.assertEqual(pop_all(queue), [other, postponed])
+
+    def test_debouncing(self):
+        debouncing = command('e', AsyncCommand.PRIORITY_BACKGROUND).activate_debounce(0.05)
+        queue = MiddlewareQueue()
+        queue.append(debouncing)
+        self.assertEqual(queue.pop_next(), (None, False))
+        self.assertTrue(0 < queue.time_until_next_execution() <= 0.05)
+        time.sleep(0.06)
+        self.assertEqual(queue.pop_next(), (debouncing, False))
+        self.assertEqual(queue.time_until_next_execution(), None)
+
+
+class test_merge(TestCase):
+
+    def setUp(self):
+        self.adapter = TssAdapterThread(None, Queue())
+
+    def test_immediate(self):
+        now = time.time()
+        popped, older, newest = command('a', now=now), command('a', now=now), command('a', now=now)
+        other = command('b', now=now)
+        for c in (older, newest, other):
+            self.adapter.middleware_queue.append(c)
+        self.assertEqual(self.adapter.merge_cmd_on_middleware_queue_and_return_replacement(popped), newest)
+        self.assertEqual(list(self.adapter.middleware_queue), [other])
+        newest.future.set_result('answer')
+        self.assertEqual((popped.future.result(0), older.future.result(0)), ('answer', 'answer'))
+
+    def test_procrastinate(self):
+        now = time.time()
+        popped, older, newest = [command('a', now=now).procrastinate() for i in range(3)]
+        for c in (older, newest):
+            self.adapter.middleware_queue.append(c)
+        self.assertEqual(self.adapter.merge_cmd_on_middleware_queue_and_return_replacement(popped), None)
+        self.assertEqual(list(self.adapter.middleware_queue), [newest]) # sent in a later round
+        newest.future.set_result('answer')
+        self.assertEqual((popped.future.result(0), older.future.result(0)), ('answer', 'answer'))
+
+    def test_follower_of_replaced_leader(self):
+        now = time.time()
+        leader, newest = command('a', now=now), command('a', now=now)
+        follower = command('a', now=now).follow(leader)
+        self.adapter.middleware_queue.append(newest)
+        self.assertEqual(self.adapter.merge_cmd_on_middleware_queue_and_return_replacement(leader), newest)
+        newest.future.set_result('answer')
+        self.assertEqual(follower.future.result(0), 'answer')
+        self.assertTrue(follower.is_executed)
+
+    def test_nothing_to_merge(self):
+        for merge in (AsyncCommand.MERGE_IMMEDIATE, AsyncCommand.MERGE_PROCRASTINATE):
+            c = command('a')
+            c.merge_behaviour = merge
+            self.assertEqual(self.adapter.merge_cmd_on_middleware_queue_and_return_replacement(c), c)
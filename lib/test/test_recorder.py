@@ -0,0 +1,41 @@
+# coding=utf8
+
+import os
+import tempfile
+
+from ArcticTypescript.lib.server.Recorder import CommandRecorder, read_recording, recording_path
+from sublime_unittest import TestCase
+
+
+class FakeCommand(object):
+    def kind(self):
+        return 'update'
+    def get_priority_name(self):
+        return 'sync'
+
+
+class test_recorder(TestCase):
+
+    def test_round_trip(self):
+        path = os.path.join(tempfile.mkdtemp(), 'recording.gz')
+        recorder = CommandRecorder(path, '/project')
+        recorder.on_send_batch('fast0', [(1, 'update nocheck 1 /project/a.ts', 'var a;', FakeCommand()),
+                                         (2, 'type 1 4 /project/a.ts', None, FakeCommand())])
+        recorder.on_answer('fast0', 1, {'type': 'number'}, 10, 100.0, 100.5, 100.75)
+        recorder.close()
+        recorder.on_restart('fast0') # ignored after close
+
+        events = read_recording(path)
+        self.assertEqual([e['e'] for e in events], ['start', 'send', 'send', 'answer'])
+        self.assertEqual(events[0]['project'], '/project')
+        self.assertEqual(events[1]['batch'], events[2]['batch'])
+        self.assertEqual(events[1]['payload'], 'var a;')
+        self.assertTrue('payload' not in events[2])
+        self.assertEqual((events[3]['wait'], events[3]['exec']), (0.5, 0.25))
+        self.assertEqual(events[3]['answer'], '{"type":"number"}')
+
+    def test_recording_path(self):
+        first = recording_path('/tmp/tss.jsonl.gz', '/projects/first')
+        self.assertTrue(first.startswith('/tmp/tss-first-'))
+        self.assertTrue(first.endswith('.jsonl.gz'))
+        self.assertNotEqual(first, recording_path('/tmp/tss.jsonl.gz', '/other/first'))
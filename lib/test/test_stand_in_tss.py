@@ -0,0 +1,40 @@
+# coding=utf8
+
+import io
+import json
+
+from ArcticTypescript.lib.benchmark.stand_in_tss import StandInTss, DEFAULT_SIZES
+from sublime_unittest import TestCase
+
+
+class test_stand_in_tss(TestCase):
+
+    def serve(self, frames):
+        output = io.BytesIO()
+        StandInTss(output, True, {'*': 0}, DEFAULT_SIZES).serve(io.BytesIO(frames))
+        return output.getvalue()
+
+    def frame(self, text):
+        data = text.encode('utf-8')
+        return ('%i\n' % len(data)).encode('ascii') + data
+
+    def test_update_lines_and_batch(self):
+        output = self.serve(self.frame('#1 update nocheck 2 /a.ts\nvar a;\nvar b;')
+                            + self.frame('batch\n#2 update nocheck 1 /a.ts\nvar c;\n#3 type 1 1 /a.ts'))
+        frames = []
+        while output:
+            header, output = output.split(b'\n', 1)
+            frames.append(output[:int(header)].decode('utf-8'))
+            output = output[int(header):]
+        self.assertEqual(len(frames), 3) # startup message, update, batch
+        self.assertEqual(frames[1], '#1 "updated /a.ts"')
+        batch = frames[2].split('\n')
+        self.assertEqual(batch[:2], ['batch', '#2 "updated /a.ts"'])
+        self.assertTrue(batch[2].startswith('#3 '))
+        self.assertEqual(json.loads(batch[2][3:])['kind'], 'method')
+
+    def test_log(self):
+        log = io.StringIO()
+        StandInTss(io.BytesIO(), True, {'*': 0}, DEFAULT_SIZES, log=log) \
+            .serve(io.BytesIO(self.frame('#1 update nocheck 1 /a.ts\nvar a;') + self.frame('#2 @p1 type 1 1 /a.ts')))
+        self.assertEqual(log.getvalue().splitlines(), ['update nocheck 1 /a.ts', 'type 1 1 /a.ts'])
@@ -0,0 +1,44 @@
+# coding=utf8
+
+import heapq
+
+
+# ----------------------------------------- FUZZY MATCHING ---------------------------------- #
+
+def fuzzy_score(typed, name):
+    """
+        Returns a sortable score (smaller is better) if all chars of typed appear
+        in name in the same order (case insensitive), otherwise None.
+        Exact prefixes rank before case insensitive prefixes before other matches,
+        then fewer skipped chars, then shorter names.
+    """
+    if name.startswith(typed):
+        return (0, 0, len(name))
+    lower_name = name.lower()
+    lower_typed = typed.lower()
+    if lower_name.startswith(lower_typed):
+        return (1, 0, len(name))
+    pos = 0
+    skipped = 0
+    for char in lower_typed:
+        found = lower_name.find(char, pos)
+        if found < 0:
+            return None
+        skipped += found - pos
+        pos = found + 1
+    return (2, skipped, len(name))
+
+
+def top_matches(typed, entries, k):
+    """
+        entries: [(name, item)], returns the items of the k best fuzzy matches of typed,
+        best first. Uses a heap of size k instead of sorting all matches.
+    """
+    if not typed:
+        return [item for name, item in entries[:k]]
+    def scored():
+        for i, (name, item) in enumerate(entries):
+            score = fuzzy_score(typed, name)
+            if score is not None:
+                yield (score, i, item) # i: equal scores keep the order of entries
+    return [item for score, i, item in heapq.nsmallest(k, scored())]
@@ -0,0 +1,160 @@
+# coding=utf8
+
+import json
+
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+_delimiters = ',:]}' + _whitespace
+
+
+# ----------------------------------------- JSON ARRAY STREAM ---------------------------------- #
+
+class JsonArrayStream(object):
+    """
+        Incremental decoder for a JSON array or for an array which is a member
+        of a JSON object, eg. the entries of '{"isMemberCompletion":true,"entries":[...]}'.
+
+        Use feed(text) as the text arrives. The array elements which could be decoded
+        are handed to on_elements([elements]) after each feed(). finish() returns the whole
+        decoded value. Only the text of the element which is not complete yet is kept.
+
+        If the text is no array (or no object if key is given), eg. an error string,
+        it is collected and decoded by finish().
+    """
+
+    def __init__(self, on_elements=None, key=None):
+        """ key: name of the streamed array in the object. None: the text is the array """
+        self.on_elements = on_elements
+        self.key = key
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'start'
+        self.elements = []
+        self.head = {} # other members of the object
+        self.member = None # name of the member which is decoded next
+        self.size = 0 # characters fed so far
+
+    def feed(self, text):
+        self.size += len(text)
+        self.buffer += text
+        count = len(self.elements)
+        while self._step():
+            pass
+        # forget decoded text
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        if self.on_elements is not None and len(self.elements) > count:
+            self.on_elements(self.elements[count:])
+
+    def finish(self):
+        """ Returns the decoded value. Raises ValueError if the text was not complete. """
+        if self.state == 'fallback':
+            return json.loads(self.buffer)
+        if self.state != 'end':
+            raise ValueError("incomplete JSON: %s" % self.buffer[:100])
+        if self.key is None:
+            return self.elements
+        self.head[self.key] = self.elements
+        return self.head
+
+
+    def _step(self):
+        """ Decodes the next token. Returns False if more text is needed. """
+        if self.state in ('fallback', 'end'):
+            return False
+        c = self._next_char()
+        if c is None:
+            return False
+
+        if self.state == 'start':
+            if c == ('[' if self.key is None else '{'):
+                self.pos += 1
+                self.state = 'array first' if self.key is None else 'member first'
+            else:
+                self.state = 'fallback'
+
+        elif self.state in ('array first', 'element'):
+            if c == ']' and self.state == 'array first':
+                self.pos += 1
+                self._on_array_end()
+            else:
+                value = self._decode_value()
+                if value is None:
+                    return False
+                self.elements.append(value[0])
+                self.state = 'array next'
+
+        elif self.state == 'array next':
+            self.pos += 1
+            if c == ',':
+                self.state = 'element'
+            elif c == ']':
+                self._on_array_end()
+            else:
+                raise ValueError("unexpected %s in JSON array" % c)
+
+        elif self.state in ('member first', 'member'):
+            if c == '}' and self.state == 'member first':
+                self.pos += 1
+                self.state = 'end'
+            else:
+                return self._decode_member_name()
+
+        elif self.state == 'member value':
+            if c == '[' and self.member == self.key:
+                self.pos += 1
+                self.state = 'array first'
+            else:
+                value = self._decode_value()
+                if value is None:
+                    return False
+                self.head[self.member] = value[0]
+                self.state = 'member next'
+
+        elif self.state == 'member next':
+            self.pos += 1
+            if c == ',':
+                self.state = 'member'
+            elif c == '}':
+                self.state = 'end'
+            else:
+                raise ValueError("unexpected %s in JSON object" % c)
+
+        return True
+
+    def _next_char(self):
+        """ Skips whitespace. Returns the next char or None. """
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in _whitespace:
+            self.pos += 1
+        if self.pos < len(self.buffer):
+            return self.buffer[self.pos]
+        return None
+
+    def _decode_value(self):
+        """ Returns (value,) or None if the value is not complete yet. """
+        try:
+            value, end = _decoder.raw_decode(self.buffer, self.pos)
+        except ValueError:
+            return None
+        # a number at the end of the buffer may continue in the next text
+        if end >= len(self.buffer) or self.buffer[end] not in _delimiters:
+            return None
+        self.pos = end
+        return (value,)
+
+    def _decode_member_name(self):
+        start = self.pos
+        name = self._decode_value()
+        if name is None:
+            return False
+        if self._next_char() != ':':
+            self.pos = start # wait for the colon
+            return False
+        self.pos += 1
+        self.member = name[0]
+        self.state = 'member value'
+        return True
+
+    def _on_array_end(self):
+        self.state = 'end' if self.key is None else 'member next'
@@ -0,0 +1,37 @@
+# coding=utf8
+
+
+# CHANGED LINES
+def changed_line_range(old_lines, new_lines):
+    """
+        Compares two versions of a file, given as lists of lines.
+        Returns (first, last, replacement): replacing the old lines first..last
+        (0 based, inclusive) with the list replacement results in new_lines.
+
+        tss.js can neither insert nor delete lines without replacing at least
+        one line, so both ranges contain at least one line.
+        Returns None if no such range exists (eg. for an empty old version).
+    """
+    if not old_lines or not new_lines:
+        return None
+
+    max_prefix = min(len(old_lines), len(new_lines))
+    prefix = 0
+    while prefix < max_prefix and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+
+    max_suffix = max_prefix - prefix
+    suffix = 0
+    while suffix < max_suffix and old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+        suffix += 1
+
+    # pure insertion or deletion: replace a neighbouring line as well
+    while len(old_lines) - suffix <= prefix or len(new_lines) - suffix <= prefix:
+        if prefix > 0:
+            prefix -= 1
+        elif suffix > 0:
+            suffix -= 1
+        else:
+            return None
+
+    return prefix, len(old_lines) - suffix - 1, new_lines[prefix:len(new_lines) - suffix]
@@ -0,0 +1,52 @@
+# coding=utf8
+
+from collections import OrderedDict
+from threading import Lock
+
+
+# ----------------------------------------- LRU CACHE ---------------------------------- #
+
+class LRUCache(object):
+    """
+        Dict with at most maxsize entries. If it is full, the least recently
+        used entry is dropped. Counts hits and misses of get(). Thread safe.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict() # from least to most recently used
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def remove_if(self, predicate):
+        """ Removes all entries for which predicate(key, value) returns True. """
+        with self.lock:
+            for key in [k for k, v in self.entries.items() if predicate(k, v)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -47,5 +47,10 @@ settings_validations = {
     "show_build_file": bool,           #?:boolean,   default: false
     "pre_processing_commands": list,   #?:[string]   default: []
     "post_processing_commands": list,  #?:[string]   default: []
+    "query_workers": int,              #?:number,    default: null -> chosen from cpu count and number of files
+    "shared_tss_host": bool,           #?:boolean,   default: false
+    "warm_tss_processes": int,         #?:number,    default: 0
+    "quick_info_popup": bool,          #?:boolean,   default: true
+    "record_tss_commands": str,        #?:string,    default: null -> no recording
 }
 allowed_settings = list(settings_validations.keys())
\ No newline at end of file